@@ -1,13 +1,18 @@
-import math, urllib, os, shutil, time, sys
+import math, os, time, sys, threading, argparse, multiprocessing, numpy
 import xml.etree.cElementTree as ET
-from map_info_parser import get_key
+from tile_downloader import TileDownloader, TileJob
+from tile_manifest import TileManifest, TileRecord
+from tile_store import _MAPS_CACHE_PATH, open_tile_store, migrate_directory_store, DirectoryTileStore
+from tile_providers import get_provider
+from tile_coverage import CoverageShape, covered_tiles
 from PyQt5.QtGui import QImage, QPainter
-from PyQt5.QtCore import QPoint
+from PyQt5.QtCore import QPoint, QRect, QBuffer, QIODevice, Qt
 
 QString = type("")
 
 _default_radius_m = 1000            # * radius of map coverage, in meters
-zooms = [17,18,19,20]               # 0-22
+zooms = [19,20]                     # * zooms to download, 0-22
+_PYRAMID_MIN_ZOOM = 12              # * zooms from here up to min(zooms) are built locally
 
 _PWD = os.path.dirname(os.path.abspath(__file__))
 
@@ -16,20 +21,14 @@ def pd(path):
 
 _INFO_FILE_PATH = os.path.join(pd(pd(_PWD)), 'map_info.xml')
 
-if get_key():
-    _KEY = '&key=' + get_key()
-else:
-    _KEY = ''
-
-TILEWIDTH = 640       # Larget tile dimension you can grab without paying
-TILEHEIGHT = 615      # Effective height to cut off Google logo
-_GOOGLESTRIP = 25      # Height of the Google logo, which will be cut off
-_GRABRATE = 4          # Fastest rate at which we can download tiles without paying
+_NUM_WORKERS = 4       # Concurrent download threads; the provider's rate still caps the total rate
 _EARTHPIX = 268435456  # Number of pixels in half the earth's circumference at zoom = 21
 _DEGREE_PRECISION = 4  # Number of decimal places for rounding coordinates
+_PYRAMID_QUALITY = 90  # JPEG quality of locally built tiles
+_STITCH_BYTES = 64 * 1024 * 1024  # Overview image painted in memory at once (the rest stays on disk)
 _pixrad = _EARTHPIX / math.pi
 
-_MAPS_CACHE_PATH = os.path.expanduser('~/.local/share/mapscache')
+_ERROR_TILES_PATH = os.path.join(_MAPS_CACHE_PATH, 'error_tiles.txt')
 
 class bcolors:
     HEADER = '\033[95m'
@@ -58,10 +57,6 @@ def endProgress():
     sys.stdout.write("#" * (40 - progress_x) + "]\n")
     sys.stdout.flush()
 
-def clearContents(folder):
-    shutil.rmtree(folder)
-    os.makedirs(folder)
-
 def round_to(val, digits):
     return int(val * 10**digits) / 10.**digits
 
@@ -77,102 +72,429 @@ def pix_to_lat(k, lat, ntiles, tile_size, zoom):
     latpix = _EARTHPIX - _pixrad * math.log((1 + sinlat)/(1 - sinlat)) / 2.0
     return math.degrees(math.pi/2 - 2 * math.atan(math.exp(((latpix + pixels_to_degrees((k-ntiles/2)*tile_size, zoom)) - _EARTHPIX) / _pixrad)))
 
+def load_error_digests(path=_ERROR_TILES_PATH):
+    # sha1s of images the map API sends instead of tiles ("no imagery here" and
+    # the like), one per line; copy them from a map's _manifest.txt
+    digests = set()
+    if os.path.isfile(path):
+        with open(path, 'r') as error_file:
+            for line in error_file:
+                if line.strip() and not line.startswith('#'):
+                    digests.add(line.split()[0])
+    return digests
+
+def is_bad_tile(data, error_digests):
+    # tiles that do not decode or are known error images are never kept
+    return TileManifest.digest(data) in error_digests or not QImage().loadFromData(data)
+
+def adopt_untracked_tiles(manifest, store, zoom, provider):
+    # register tiles stored before the manifest existed (always Google tiles)
+    if manifest.anchor(zoom) is not None:
+        return
+    for i, j, lat, lon in sorted(store.read_info(zoom)):
+        if manifest.anchor(zoom) is None:
+            manifest.set_anchor(zoom, lat, lon)
+        anchor_lat, anchor_lon = manifest.anchor(zoom)
+        kx, ky = provider.lattice_offset(anchor_lat, anchor_lon, lat, lon, zoom)
+        data = store.get(zoom, i, j)
+        manifest.add(TileRecord(zoom, kx, ky, i, j, lat, lon, len(data), TileManifest.digest(data)))
+
+def relayout_tiles(manifest, store, zoom, wanted, error_digests=()):
+    # drop tiles that are no longer covered, damaged or known error images,
+    # then move the survivors to their i, j position in the new grid
+    moves = []
+    for record in manifest.records(zoom):
+        if (record.kx, record.ky) not in wanted or record.digest in error_digests or \
+                not manifest.verify(record, store):
+            store.remove(zoom, record.i, record.j)
+            manifest.drop(record)
+        elif (record.i, record.j) != wanted[(record.kx, record.ky)]:
+            moves.append(record)
+    store.commit()
+    store.move(zoom, [((record.i, record.j), wanted[(record.kx, record.ky)]) for record in moves])
+    for record in moves:
+        record.i, record.j = wanted[(record.kx, record.ky)]
+        manifest.add(record)
+
 # for fetching tiles from google
-urlbase = 'https://maps.googleapis.com/maps/api/staticmap?center=%f,%f&zoom=%d&maptype=%s&size=%dx%d&format=jpg'
-urlbase += _KEY
-
-# extract info for each map, for comparing and compiling
-print bcolors.BOLD + 'Parsing map_info.xml...' + bcolors.ENDC
-map_dict = {}
-try:
-    xmlroot = ET.parse(_INFO_FILE_PATH).getroot()
-    for xmlnode in xmlroot.findall('map'):
-        name = xmlnode.attrib['name']
-        map_dict[name] = {}
-        map_dict[name]['lat'] = float(str(xmlnode.find('lat').text))
-        map_dict[name]['lon'] = float(str(xmlnode.find('lon').text))
-        if not xmlnode.find('radius_m'):
-            map_dict[name]['r_m'] = _default_radius_m
-        else:
-            map_dict[name]['r_m'] = int(str(xmlnode.find('radius_m').text))
-        map_dict[name]['fetch'] = False
-except:
-    print bcolors.BOLD + bcolors.FAIL + 'ERROR: Incorrectly formatted xml file!' + bcolors.ENDC
-
-# check to see which maps need to be fetched or updated
-for mapname in map_dict:
-    print bcolors.OKGREEN + 'Processing maps for %s...' % mapname + bcolors.ENDC
+def downsample_tile(job):
+    # one tile of a lower zoom, from the block of tiles under it one zoom up;
+    # parts are (x, y, height, data) on a canvas twice the tile size
+    tile_size, parts = job
+    canvas = QImage(2 * tile_size, 2 * tile_size, QImage.Format_RGB32)
+    canvas.fill(Qt.black)
+    painter = QPainter(canvas)
+    for x, y, height, data in parts:
+        tile = QImage()
+        if tile.loadFromData(data):
+            painter.drawImage(QPoint(x, y), tile, QRect(0, 0, tile_size, height))
+    painter.end()
+    tile = canvas.scaled(tile_size, tile_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    tile_buffer = QBuffer()
+    tile_buffer.open(QIODevice.WriteOnly)
+    tile.save(tile_buffer, 'JPG', _PYRAMID_QUALITY)
+    return tile_buffer.data().data()
+
+def pyramid_zooms():
+    return range(_PYRAMID_MIN_ZOOM, min(zooms))
+
+def build_pyramid(store, provider, source_zoom, min_zoom=_PYRAMID_MIN_ZOOM, keep=(), processes=None):
+    """
+    Builds every zoom from source_zoom - 1 down to min_zoom by halving the
+    level above it, so overview levels cost no downloads. Zooms in keep are
+    left alone but still feed the level below them. Tiles keep the provider's
+    size and spacing, on a lattice of their own. Tiles are downsampled by a
+    pool of processes (in-process if processes is 1). Returns the zooms built.
+    """
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
+    built = []
+    try:
+        for zoom in range(source_zoom - 1, min_zoom - 1, -1):
+            if zoom in keep:
+                continue
+            store.remove_zoom(zoom)
+            info = sorted(store.read_info(zoom + 1))
+            if not info:
+                break
+            cols = max(item[0] for item in info) + 1
+            rows = max(item[1] for item in info) + 1
+            # tile (i, j) covers tiles 2i..2i+1, 2j..2j+2 one zoom up, which share its upper left corner
+            ref_i, ref_j, ref_lat, ref_lon = info[0]
+            size, dx, dy = provider.tile_size, provider.col_spacing, provider.row_spacing
+            startProgress('\tBuilding zoom level = %d from zoom %d' % (zoom, zoom + 1))
+            for j in range((rows + 1) // 2):
+                region = store.get_region(zoom + 1, 0, cols - 1, 2 * j, 2 * j + 2)
+                blocks = []
+                for i in range((cols + 1) // 2):
+                    parts = []
+                    for up_i in (2 * i, 2 * i + 1):
+                        for up_j in (2 * j, 2 * j + 1, 2 * j + 2):
+                            if (up_i, up_j) in region:
+                                height = size if up_j == rows - 1 else dy
+                                parts.append(((up_i - 2 * i) * dx, (up_j - 2 * j) * dy, height, region[(up_i, up_j)]))
+                    # (a sparse grid may leave only the overlap of the row below)
+                    if any(y < 2 * dy for x, y, height, data in parts):
+                        blocks.append((i, parts))
+                tiles = (pool.map if pool is not None else map)(downsample_tile, [(size, parts) for i, parts in blocks])
+                for (i, parts), data in zip(blocks, tiles):
+                    lon = pix_to_lon(1, ref_lon, 0, (2 * i - ref_i) * dx + size / 2, zoom + 1)
+                    lat = pix_to_lat(1, ref_lat, 0, (2 * j - ref_j) * dy + size / 2, zoom + 1)
+                    store.put(zoom, i, j, lat, lon, data)
+                store.commit()
+                progress(int(100.0 * (j + 1) / ((rows + 1) // 2)))
+            endProgress()
+            built.append(zoom)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return built
+
+def build_map_pyramid(mapname, manifest, store, provider, processes=None):
+    # built zooms replace any downloaded tiles the manifest still lists for them
+    for zoom in pyramid_zooms():
+        if manifest.anchor(zoom) is not None or manifest.records(zoom):
+            manifest.forget(zoom)
+    print 'Building zoom levels %d-%d for %s...' % (_PYRAMID_MIN_ZOOM, min(zooms) - 1, mapname)
+    return build_pyramid(store, provider, min(zooms), keep=zooms, processes=processes)
+
+def stitch_overview(store, zoom, ntiles_x, ntiles_y, provider, filename, max_bytes=_STITCH_BYTES):
+    """
+    Paints every tile of a zoom into one overview image and saves it.
+
+    The image lives in a memory-mapped scratch file beside filename and is
+    painted a strip of tile rows at a time, each flushed to disk before the
+    next, so only about max_bytes of it is dirty in memory however large the
+    map is. Tiles are painted in the same order as a single full-size image
+    would be, so the result is the same.
+    """
+    dx, dy = provider.col_spacing, provider.row_spacing
+    width, height = ntiles_x * dx, ntiles_y * dy
+    scratch_path = filename + '.raw'
+    pixels = numpy.memmap(scratch_path, dtype=numpy.uint32, mode='w+', shape=(height, width))
+    try:
+        rows_per_strip = max(1, max_bytes // (4 * width * dy))
+        for top_j in range(0, ntiles_y, rows_per_strip):
+            bottom_j = min(top_j + rows_per_strip, ntiles_y)
+            strip_pixels = pixels[top_j * dy:bottom_j * dy]
+            strip = QImage(strip_pixels.ctypes.data, width, strip_pixels.shape[0], 4 * width, QImage.Format_RGB32)
+            painter = QPainter(strip)
+            # the row above reaches into the strip below its row spacing (the Google logo)
+            for (i, j), data in sorted(store.get_region(zoom, 0, ntiles_x - 1, max(top_j - 1, 0), bottom_j - 1).items()):
+                tile = QImage()
+                tile.loadFromData(data)
+                painter.drawImage(QPoint(i * dx, (j - top_j) * dy), tile)
+            painter.end()
+            del strip, strip_pixels
+            pixels.flush()
+        QImage(pixels.ctypes.data, width, height, 4 * width, QImage.Format_RGB32).save(QString(filename))
+    finally:
+        del pixels
+        os.remove(scratch_path)
+
+def get_map_dict(info_file_path=_INFO_FILE_PATH):
+    # extract info for each map, for comparing and compiling
+    map_dict = {}
+    try:
+        xmlroot = ET.parse(info_file_path).getroot()
+        for xmlnode in xmlroot.findall('map'):
+            name = xmlnode.attrib['name']
+            map_dict[name] = {}
+            map_dict[name]['lat'] = float(str(xmlnode.find('lat').text))
+            map_dict[name]['lon'] = float(str(xmlnode.find('lon').text))
+            if xmlnode.find('radius_m') is None:
+                map_dict[name]['r_m'] = _default_radius_m
+            else:
+                map_dict[name]['r_m'] = int(str(xmlnode.find('radius_m').text))
+            # tile source (see tile_providers.get_provider), with an optional rate limit
+            tiles = xmlnode.find('tiles')
+            map_dict[name]['tiles'] = '' if tiles is None else (tiles.text or '').strip()
+            map_dict[name]['rate'] = None if tiles is None or not 'rate' in tiles.attrib else float(tiles.attrib['rate'])
+            # a boundary polygon or corridor replaces the radius
+            map_dict[name]['shape'] = CoverageShape.from_xml(xmlnode)
+    except:
+        print bcolors.BOLD + bcolors.FAIL + 'ERROR: Incorrectly formatted xml file!' + bcolors.ENDC
+    return map_dict
+
+def map_needs_fetch(mapname, mapinfo):
+    # a map is up to date when its log matches its entry in map_info.xml
+    log_path = os.path.join(_MAPS_CACHE_PATH, mapname, '_log.txt')
+    if not os.path.exists(log_path):
+        return True
+    with open(log_path, 'r') as logfile:
+        loginfo = logfile.read().split('\n')
+        try:
+            return not (float(loginfo[0]) == mapinfo['lat'] and \
+                        float(loginfo[1]) == mapinfo['lon'] and \
+                        int(loginfo[2]) == mapinfo['r_m'] and \
+                        loginfo[3] == mapinfo.get('tiles', '') and \
+                        loginfo[4] == shape_spec(mapinfo))
+        except:
+            return True
+
+def shape_spec(mapinfo):
+    shape = mapinfo.get('shape')
+    return '' if shape is None else shape.spec()
+
+def fetch_map(mapname, mapinfo, num_workers=_NUM_WORKERS, processes=None, stitch_bytes=_STITCH_BYTES):
+    # fetch missing tiles from the map's provider; returns True once the map is complete
+    provider = get_provider(mapinfo.get('tiles'), mapinfo.get('rate'))
     folder_path = os.path.join(_MAPS_CACHE_PATH, mapname)
     log_path = os.path.join(folder_path, '_log.txt')
-    if os.path.exists(folder_path):
-        if os.path.exists(log_path):
-            with open(log_path, 'r') as logfile:
-                loginfo = logfile.read().split('\n')
-                try:
-                    if not (float(loginfo[0]) == map_dict[mapname]['lat'] and \
-                            float(loginfo[1]) == map_dict[mapname]['lon'] and \
-                            int(loginfo[2]) == map_dict[mapname]['r_m']):
-                        map_dict[mapname]['fetch'] = True
-                except:
-                    map_dict[mapname]['fetch'] = True
-        else:
-            map_dict[mapname]['fetch'] = True
-    else:
+    if not os.path.exists(folder_path):
         os.makedirs(folder_path)
-        map_dict[mapname]['fetch'] = True
-
-    # fetch tiles from the internet, if needed
-    if map_dict[mapname]['fetch']:
-        clearContents(folder_path)
-        print 'Downloading maps for %s...' % mapname
-        latitude = round_to(map_dict[mapname]['lat'], _DEGREE_PRECISION)
-        longitude = round_to(map_dict[mapname]['lon'], _DEGREE_PRECISION)
-        radius_meters = map_dict[mapname]['r_m']
-
-        for zoom in zooms:
-            zoom_folder_path = os.path.join(folder_path, str(zoom))
-            os.makedirs(zoom_folder_path)
-            startProgress('\tAt zoom level = %d' % zoom)
-            # the following conversion formula comes from an employee at google:
-            # https://groups.google.com/forum/#!topic/google-maps-js-api-v3/hDRO4oHVSeM
-            pixels_per_meter = 2**zoom / (156543.03392 * math.cos(math.radians(latitude)))
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    if DirectoryTileStore(folder_path).zooms():
+        print 'Packing %d cached tiles for %s...' % (migrate_directory_store(mapname), mapname)
+    print 'Downloading maps for %s...' % mapname
+    latitude = round_to(mapinfo['lat'], _DEGREE_PRECISION)
+    longitude = round_to(mapinfo['lon'], _DEGREE_PRECISION)
+    radius_meters = mapinfo['r_m']
+
+    manifest = TileManifest(folder_path)
+    store = open_tile_store(mapname, create=True)
+    if manifest.provider != provider.spec:
+        # tiles from another provider are laid out differently
+        for zoom in store.zooms():
+            store.remove_zoom(zoom)
+            manifest.forget(zoom)
+        store.commit()
+        manifest.set_provider(provider.spec)
+    downloader = TileDownloader(provider.rate, num_workers)
+    error_digests = load_error_digests()
+    map_start = time.time()
+    map_total = 0
+    map_fetched = 0
+    map_failed = 0
+    for zoom_number, zoom in enumerate(zooms):
+        # place the grid on the lattice of tiles already in the manifest
+        adopt_untracked_tiles(manifest, store, zoom, provider)
+        if manifest.anchor(zoom) is None:
+            manifest.set_anchor(zoom, *provider.anchor(latitude, longitude, zoom))
+        anchor_lat, anchor_lon = manifest.anchor(zoom)
+        wanted = {}
+        if mapinfo.get('shape') is not None:
+            # only the tiles that meet the shape, on the grid of their bounding box
+            covered = covered_tiles(mapinfo['shape'], provider, anchor_lat, anchor_lon, zoom)
+            min_kx = min(kx for kx, ky in covered)
+            min_ky = min(ky for kx, ky in covered)
+            for kx, ky in covered:
+                wanted[(kx, ky)] = (kx - min_kx, ky - min_ky)
+            ntiles_x = max(kx for kx, ky in covered) - min_kx + 1
+            ntiles_y = max(ky for kx, ky in covered) - min_ky + 1
+        else:
             # number of tiles required to go from center latitude to desired radius in meters
-            ntiles_x = int(round(2.0 * pixels_per_meter * radius_meters / TILEWIDTH))
-            ntiles_y = int(round(2.0 * pixels_per_meter * radius_meters / TILEHEIGHT))
-
-            if zoom <= 19:
-                bigimage = QImage(ntiles_x * TILEWIDTH, ntiles_y * TILEHEIGHT, 4) # -----------
-
-            with open(os.path.join(zoom_folder_path, 'info.txt'), 'w') as info_file:
-                for i in range(ntiles_x):
-                    lon = pix_to_lon(i, longitude, ntiles_x, TILEWIDTH, zoom)
-                    for j in range(ntiles_y):
-                        lat = pix_to_lat(j, latitude, ntiles_y, TILEHEIGHT, zoom)
-                        specs = lat, lon, zoom, 'satellite', TILEWIDTH, TILEWIDTH
-                        filename = os.path.join(zoom_folder_path, ('%d_%d' % (i, j)) + '.jpg')
-                        url = urlbase % specs
-                        result = urllib.urlopen(url).read()
-                        tile = QImage()
-                        tile.loadFromData(result)
-                        tile.save(QString(filename))
-                        info_file.write('%d %d %f %f\n' % (i, j, lat, lon))
-
-                        progress(int((1.0 * ntiles_y * i + j) / (ntiles_x * ntiles_y) * 100))
-                        time.sleep(1.0 / _GRABRATE)
-                        if zoom <= 19:
-                            destPos = QPoint(i*TILEWIDTH, j*TILEHEIGHT) # ---------
-                            painter = QPainter(bigimage) # --------------------------
-                            painter.drawImage(destPos, tile) # ----------------------
-                            painter.end() # -----------------------------------------
-
-                endProgress()
-            if zoom <= 19:
-                bigfilename = os.path.join(folder_path, 'ZOOM %d.jpg' % zoom) # --------------
-                bigimage.save(QString(bigfilename)) # ----------------------------------------
-            #+++++++++++++++++++++++++++++++++++++
-        with open(log_path, 'w') as logfile:
-            logfile.write(str(map_dict[mapname]['lat']) + '\n')
-            logfile.write(str(map_dict[mapname]['lon']) + '\n')
-            logfile.write(str(map_dict[mapname]['r_m']) + '\n')
-    else:
-        print 'Downloaded maps for %s already up to date.' % mapname
+            ntiles_x, ntiles_y = provider.tile_counts(latitude, radius_meters, zoom)
+            center_kx, center_ky = provider.lattice_offset(anchor_lat, anchor_lon, latitude, longitude, zoom)
+            for i in range(ntiles_x):
+                for j in range(ntiles_y):
+                    wanted[(center_kx + i - ntiles_x/2, center_ky + j - ntiles_y/2)] = (i, j)
+        relayout_tiles(manifest, store, zoom, wanted, error_digests)
+
+        jobs = []
+        for (kx, ky), (i, j) in sorted(wanted.items(), key=lambda item: item[1]):
+            if manifest.get(zoom, kx, ky) is None:
+                lat, lon = provider.tile_center(anchor_lat, anchor_lon, kx, ky, zoom)
+                jobs.append(TileJob(i, j, lat, lon, zoom, provider.url(kx, ky, zoom, lat, lon), kx, ky))
+
+        startProgress('\tAt zoom level = %d (%d/%d), %d of %d tiles missing' % \
+                      (zoom, zoom_number + 1, len(zooms), len(jobs), len(wanted)))
+        done = [0]
+        rejected = [0]
+        def save_tile(job, result):
+            done[0] += 1
+            progress(int(100.0 * done[0] / len(jobs)))
+            if result is None:
+                return
+            if is_bad_tile(result, error_digests):
+                # left missing, so it is fetched again on the next run
+                rejected[0] += 1
+                return
+            store.put(zoom, job.i, job.j, job.lat, job.lon, result)
+            store.commit()
+            manifest.add(TileRecord(zoom, job.kx, job.ky, job.i, job.j, job.lat, job.lon, len(result),
+                                    TileManifest.digest(result)))
+
+        failed = downloader.download(jobs, save_tile)
+        endProgress()
+        map_total += len(wanted)
+        map_fetched += len(jobs) - len(failed)
+        missing = [key for key in wanted if manifest.get(zoom, key[0], key[1]) is None]
+        map_failed += len(missing)
+        if rejected[0]:
+            print bcolors.WARNING + '\t%d tiles were not images or known error images' % rejected[0] + bcolors.ENDC
+        if missing:
+            print bcolors.WARNING + '\t%d of %d tiles missing at zoom %d' % (len(missing), len(wanted), zoom) + bcolors.ENDC
+
+        if zoom <= 19:
+            bigfilename = os.path.join(folder_path, 'ZOOM %d.jpg' % zoom)
+            stitch_overview(store, zoom, ntiles_x, ntiles_y, provider, bigfilename, stitch_bytes)
+    build_map_pyramid(mapname, manifest, store, provider, processes)
+    manifest.compact()
+    store.prune()
+    print '%d tiles stored as %d distinct images' % store.count()
+    store.close()
+    print 'Fetched %d new tiles for %s in %.1f s (%d of %d tiles cached, %d missing)' % \
+        (map_fetched, mapname, time.time() - map_start, map_total - map_failed, map_total, map_failed)
+    if map_failed:
+        # leave the log unwritten so the next run resumes this map
+        return False
+    with open(log_path, 'w') as logfile:
+        logfile.write(str(mapinfo['lat']) + '\n')
+        logfile.write(str(mapinfo['lon']) + '\n')
+        logfile.write(str(mapinfo['r_m']) + '\n')
+        logfile.write(mapinfo.get('tiles', '') + '\n')
+        logfile.write(shape_spec(mapinfo) + '\n')
+    return True
+
+def fetch_all_maps(map_dict=None, mapnames=None, num_workers=_NUM_WORKERS, processes=None,
+                   stitch_bytes=_STITCH_BYTES, fetched=None):
+    # check to see which maps need to be fetched or updated; fetched(mapname) is called
+    # after each map that was downloaded, even if some of its tiles are still missing
+    if map_dict is None:
+        print bcolors.BOLD + 'Parsing map_info.xml...' + bcolors.ENDC
+        map_dict = get_map_dict()
+    complete = True
+    for mapname in sorted(map_dict):
+        if mapnames and mapname not in mapnames:
+            continue
+        print bcolors.OKGREEN + 'Processing maps for %s...' % mapname + bcolors.ENDC
+        if map_needs_fetch(mapname, map_dict[mapname]):
+            complete = fetch_map(mapname, map_dict[mapname], num_workers=num_workers,
+                                 processes=processes, stitch_bytes=stitch_bytes) and complete
+            if fetched is not None:
+                fetched(mapname)
+        else:
+            print 'Downloaded maps for %s already up to date.' % mapname
+    return complete
+
+def check_map(mapname, error_digests):
+    # drops downloaded tiles that no longer decode or are known error images, so
+    # the next fetch downloads them again; returns the number dropped
+    folder_path = os.path.join(_MAPS_CACHE_PATH, mapname)
+    store = open_tile_store(mapname)
+    if store is None:
+        return 0
+    manifest = TileManifest(folder_path)
+    dropped = 0
+    for zoom in zooms:
+        for record in manifest.records(zoom):
+            data = store.get(zoom, record.i, record.j)
+            if data is None or is_bad_tile(data, error_digests):
+                store.remove(zoom, record.i, record.j)
+                manifest.drop(record)
+                dropped += 1
+    store.commit()
+    if dropped and os.path.exists(os.path.join(folder_path, '_log.txt')):
+        os.remove(os.path.join(folder_path, '_log.txt'))
+    manifest.close()
+    store.close()
+    return dropped
+
+class MapFetchThread(threading.Thread):
+    # runs fetch_all_maps() off the GUI thread; fetched(mapname) is called from this
+    # thread as each map is written (e.g. the emit of a signal connected to the GUI)
+    def __init__(self, mapnames=None, fetched=None):
+        super(MapFetchThread, self).__init__()
+        self.daemon = True
+        self.mapnames = mapnames
+        self.fetched = fetched
+        self.complete = False
+
+    def run(self):
+        # no process pool, which would fork the whole GUI
+        self.complete = fetch_all_maps(mapnames=self.mapnames, processes=1, fetched=self.fetched)
+
+def cached_mapnames():
+    # what the maps cache holds, nothing before the first fetch made it
+    if not os.path.isdir(_MAPS_CACHE_PATH):
+        return []
+    return sorted(os.listdir(_MAPS_CACHE_PATH))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Download map tiles for the maps in map_info.xml.')
+    parser.add_argument('maps', nargs='*', help='names of the maps to fetch (default: all)')
+    parser.add_argument('--workers', type=int, default=_NUM_WORKERS, help='number of concurrent downloads')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of processes building zoom levels locally (default: one per CPU)')
+    parser.add_argument('--stitch-memory', type=int, default=_STITCH_BYTES // (1024 * 1024),
+                        help='megabytes of the ZOOM overview images painted in memory at once')
+    parser.add_argument('--migrate', action='store_true',
+                        help='pack existing <map>/<zoom>/i_j.jpg caches into tiles.db and exit')
+    parser.add_argument('--pyramid', action='store_true',
+                        help='rebuild the locally built zoom levels of cached maps and exit')
+    parser.add_argument('--check', action='store_true',
+                        help='drop cached tiles that are corrupt or known error images, then fetch again')
+    args = parser.parse_args(argv)
+    if args.check:
+        error_digests = load_error_digests()
+        for mapname in cached_mapnames():
+            if args.maps and mapname not in args.maps:
+                continue
+            if os.path.isdir(os.path.join(_MAPS_CACHE_PATH, mapname)):
+                print 'Dropped %d bad tiles from %s' % (check_map(mapname, error_digests), mapname)
+    if args.pyramid:
+        for mapname in cached_mapnames():
+            if args.maps and mapname not in args.maps:
+                continue
+            store = open_tile_store(mapname)
+            if store is None:
+                continue
+            manifest = TileManifest(os.path.join(_MAPS_CACHE_PATH, mapname))
+            build_map_pyramid(mapname, manifest, store, get_provider(manifest.provider), args.processes)
+            manifest.compact()
+            store.close()
+        return 0
+    if args.migrate:
+        for mapname in cached_mapnames():
+            if args.maps and mapname not in args.maps:
+                continue
+            if DirectoryTileStore(os.path.join(_MAPS_CACHE_PATH, mapname)).zooms():
+                print 'Packed %d tiles for %s' % (migrate_directory_store(mapname), mapname)
+        return 0
+    return 0 if fetch_all_maps(mapnames=args.maps, num_workers=args.workers, processes=args.processes,
+                               stitch_bytes=args.stitch_memory * 1024 * 1024) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
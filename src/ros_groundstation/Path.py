@@ -2,20 +2,23 @@ import rospy
 from rosplane_msgs.msg import Current_Path
 import map_subscribers
 from math import isnan
+import numpy
 
 
 class Path:
-    def __init__(self, path):
+    # lla, if given, holds the points of Path.ned_points(path) already converted
+    def __init__(self, path, lla=None):
         if map_subscribers.InitSub.enabled:
+            if lla is None:
+                lla = [Path.convert_ned_to_lla(point) for point in Path.ned_points(path)]
             self.Va_d = path.path.Va_d
             self.path_type = path.path.path_type
             self.is_line = (self.path_type == Current_Path.LINE_PATH)
             if self.is_line:
-                self.r = Path.convert_ned_to_lla(path.path.r)
-                self.line_end = Path.convert_ned_to_lla(path.line_end)
+                self.r, self.line_end = lla
                 self.q = path.path.q
             else:
-                self.orbit_center = Path.convert_ned_to_lla(path.path.c)
+                self.orbit_center, = lla
                 self.lambda_ = path.path.lambda_
                 self.clockwise = (self.lambda_ == Current_Path.CLOCKWISE)
                 self.radius = path.path.rho
@@ -42,6 +45,30 @@ class Path:
                                               str(self.radius), str(self.orbit_start), str(self.orbit_end))
         return ret
 
+    @staticmethod
+    def ned_points(path):
+        # the NED points a path is drawn from: r and line_end for a line, c for an orbit
+        if path.path.path_type == Current_Path.LINE_PATH:
+            return [path.path.r, path.line_end]
+        return [path.path.c]
+
+    @staticmethod
+    def convert_paths(paths):
+        # a Path for each Extended_Path, converting all their points at once
+        points = [point for path in paths for point in Path.ned_points(path)]
+        if not map_subscribers.InitSub.enabled or not points:
+            return [Path(path) for path in paths]
+        points = numpy.array(points, dtype=numpy.float64).reshape(-1, 3)
+        lla = numpy.column_stack(map_subscribers.InitSub.GB.ned_to_gps_many(points[:, 0], points[:, 1], points[:, 2]))
+        assert (not numpy.isnan(lla).any())
+        lla = [tuple(point) for point in lla.tolist()]
+        converted, at = [], 0
+        for path in paths:
+            count = len(Path.ned_points(path))
+            converted.append(Path(path, lla[at:at + count]))
+            at += count
+        return converted
+
     @staticmethod
     def convert_ned_to_lla(point):
         assert (len(point) == 3)
@@ -49,6 +49,7 @@ class ArtificialHorizon(QtWidgets.QWidget):
         self.numSat = 0  # Number of Satellites (GPS)
 
         self.pitchInterval = 0.013  # % of height used to display 1 degree
+        self.shown = None  # readout() of the last paint
 
         self.setGeometry(300, 300, self.width, self.height)
         self.setWindowTitle('Artificial Horizon')
@@ -68,12 +69,36 @@ class ArtificialHorizon(QtWidgets.QWidget):
         self.width = newSize.size().width()
         self.height = newSize.size().height()
 
+    def readout(self):
+        """
+        Everything the widget displays, as drawn (e.g. angles rounded to whole degrees).
+        """
+        return (int(math.floor(StateSub.phi * (180.0 / math.pi))),
+                int(math.floor(StateSub.theta * (180.0 / math.pi))),
+                int(math.floor(StateSub.Va)),
+                int(math.floor(StateSub.alt)),
+                int(math.floor(StateSub.chi * (180.0 / math.pi))) % 360,
+                GPSDataSub.numSat,
+                ConComSub.enabled and (ConComSub.Va_c, ConComSub.h_c),
+                ConInSub.enabled and ConInSub.theta_c,
+                BatterySub.enabled and (round(BatterySub.voltage, 1), int(BatterySub.voltage_percent)))
+
+    def refresh(self):
+        """
+        Frame timer callback.
+
+        Repaints only if the displayed values changed since the last paint.
+        """
+        if self.readout() != self.shown:
+            self.update()
+
     def paintEvent(self, event):
         """
         Paint event callback.
 
         Creates a QPainter object and draws the artificial horizon.
         """
+        self.shown = self.readout()
         painter = QtGui.QPainter()
         painter.begin(self)
         self.drawArtificialHorizon(event, painter)
@@ -88,12 +113,7 @@ class ArtificialHorizon(QtWidgets.QWidget):
         artist (e.g. drawSky, drawGround, etc.).
         """
         # extract relevant values here from subscribers
-        self.roll = int(math.floor(StateSub.phi * (180.0 / math.pi)))
-        self.pitch = int(math.floor(StateSub.theta * (180.0 / math.pi)))
-        self.speed = int(math.floor(StateSub.Va))
-        self.altitude = int(math.floor(StateSub.alt))
-        self.heading = int(math.floor(StateSub.chi * (180.0 / math.pi))) % 360
-        self.numSat = GPSDataSub.numSat
+        self.roll, self.pitch, self.speed, self.altitude, self.heading, self.numSat = self.shown[:6]
 
         self.drawSky(event, painter)
 
@@ -0,0 +1,69 @@
+import re, numpy
+
+class CoordinateError(ValueError):
+    pass
+
+# [N|S|E|W][+|-]D[ M[ S]][N|S|E|W], fields split by spaces, '-', ':' or d ' " marks
+_DMS = re.compile(r'''^\s*([NSEW])?\s*([+-])?(\d+(?:\.\d+)?)
+                      (?:(?:\s*[d:-]\s*|\s+)(\d+(?:\.\d+)?)
+                      (?:(?:\s*['m:-]\s*|\s+)(\d+(?:\.\d+)?))?)?
+                      \s*(?:''|["'d])?\s*([NSEW])?\s*$''', re.X | re.I)
+
+_LIMITS = {'lat': 90.0, 'lon': 180.0}
+_KINDS = {'N': 'lat', 'S': 'lat', 'E': 'lon', 'W': 'lon'}
+
+def to_degrees(value):
+    """
+    Decimal degrees of a latitude or longitude: numbers (and strings of
+    them) are taken as they are, anything else goes to parse_coordinate.
+    """
+    if type(value) is float:
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return parse_coordinate(value)
+
+def to_degrees_many(values):
+    # as to_degrees, for a sequence or NumPy array; returns a float64 array
+    try:
+        return numpy.asarray(values, dtype=numpy.float64)
+    except ValueError:
+        return numpy.array([to_degrees(value) for value in values], dtype=numpy.float64)
+
+def parse_coordinate(text, kind=None):
+    """
+    Decimal degrees of a coordinate typed in or read from a file: decimal
+    degrees, or degrees, minutes and seconds as in N40-14-51.2, 40 14 51.2 N,
+    40d14'51.2"N or -111:39. kind ('lat' or 'lon') limits the range and
+    hemisphere letters allowed. Raises CoordinateError for anything else.
+    """
+    match = _DMS.match(text)
+    if match is None:
+        raise CoordinateError('not a coordinate: %r' % (text,))
+    before, sign, degrees, minutes, seconds, after = match.groups()
+    if before and after:
+        raise CoordinateError('two hemisphere letters in %r' % (text,))
+    hemisphere = (before or after or '').upper()
+    if hemisphere and sign:
+        raise CoordinateError('both a sign and a hemisphere letter in %r' % (text,))
+    if hemisphere and kind is not None and _KINDS[hemisphere] != kind:
+        raise CoordinateError('%r is not a %s' % (text, 'latitude' if kind == 'lat' else 'longitude'))
+    # only the last field given may have a fraction, and minutes and seconds stay under 60
+    fields = [field for field in (degrees, minutes, seconds) if field is not None]
+    if any('.' in field for field in fields[:-1]):
+        raise CoordinateError('fraction before the last field of %r' % (text,))
+    if any(float(field) >= 60 for field in fields[1:]):
+        raise CoordinateError('minutes or seconds of 60 or more in %r' % (text,))
+    value = sum(float(field) / 60**k for k, field in enumerate(fields))
+    limit = _LIMITS.get(kind or _KINDS.get(hemisphere), 180.0)
+    if value > limit:
+        raise CoordinateError('%r is beyond %g degrees' % (text, limit))
+    return -value if sign == '-' or hemisphere in ('S', 'W') else value
+
+def parse_latlon(text):
+    # (lat, lon) of a 'lat,lon' pair
+    fields = text.split(',')
+    if len(fields) != 2:
+        raise CoordinateError('not a lat,lon pair: %r' % (text,))
+    return parse_coordinate(fields[0], 'lat'), parse_coordinate(fields[1], 'lon')
@@ -0,0 +1,139 @@
+import numpy
+
+class FeatureGroup():
+    # the features of one source, with their cell keys sorted
+    def __init__(self, xs, ys, radii, key):
+        self.xs = xs
+        self.ys = ys
+        self.radii = radii
+        self.key = key          # what the source looked like when the group was built
+        self.cell_keys = numpy.zeros(0, dtype=numpy.int64)
+        self.numbers = numpy.zeros(0, dtype=numpy.int64)   # feature numbers, in cell key order
+
+class FeatureIndex():
+    """
+    Grid index over the point features drawn on the map (waypoints, obstacle
+    centers, planned path points), for picking them with the mouse. Points
+    are world pixels at zoom 0; obstacles may have a radius, in the same
+    units, so that anywhere on them picks them.
+
+    Features come in named groups, one per source: a group is rebuilt by
+    set_group() only when its source changed, and then only as far as need
+    be (appended features are added, a few moved ones are moved). Within a
+    group, features are sorted by cell key cell x << 32 | cell y, as in
+    TrailLevel, so the features in a range of cell columns are one slice.
+    """
+    MAX_MOVES = 8   # a group with more features moved than this is rebuilt
+
+    def __init__(self, cell):
+        self.cell = cell        # grid size in world pixels at zoom 0
+        self.groups = {}        # name -> FeatureGroup
+
+    def key(self, name):
+        # the key passed to set_group for the group, or None
+        group = self.groups.get(name)
+        return group and group.key
+
+    def set_group(self, name, xs, ys, radii=None, key=None):
+        """
+        Indexes the features of a group in place of its old ones. If the old
+        features are the first of the new ones (a waypoint was appended, or
+        nothing moved), only the rest are added; if there are as many as
+        before and only a few moved (a waypoint was dragged), only those are
+        moved. Returns whether any of the old features is gone or changed,
+        i.e. whether their numbers still mean the same features.
+        """
+        # copies, as move() changes them in place
+        xs = numpy.array(xs, dtype=numpy.float64)
+        ys = numpy.array(ys, dtype=numpy.float64)
+        radii = numpy.zeros(len(xs)) if radii is None else numpy.array(radii, dtype=numpy.float64)
+        old = self.groups.get(name)
+        if old is not None and len(xs) == len(old.xs) and numpy.array_equal(radii, old.radii):
+            moved = numpy.flatnonzero((xs != old.xs) | (ys != old.ys))
+            if len(moved) <= FeatureIndex.MAX_MOVES:
+                old.key = key
+                for number in moved:
+                    self.move(name, number, xs[number], ys[number])
+                return False
+        group = FeatureGroup(xs, ys, radii, key)
+        self.groups[name] = group
+        kept = len(old.xs) if old is not None else 0
+        if old is None or len(xs) < kept or not (numpy.array_equal(xs[:kept], old.xs) and
+                                                  numpy.array_equal(ys[:kept], old.ys) and
+                                                  numpy.array_equal(radii[:kept], old.radii)):
+            kept = 0
+        cell_keys = self.cell_keys(xs[kept:], ys[kept:])
+        order = numpy.argsort(cell_keys, kind='mergesort')
+        if kept:
+            at = numpy.searchsorted(old.cell_keys, cell_keys[order], side='right')
+            group.cell_keys = numpy.insert(old.cell_keys, at, cell_keys[order])
+            group.numbers = numpy.insert(old.numbers, at, kept + order)
+        else:
+            group.cell_keys = cell_keys[order]
+            group.numbers = order
+        return old is not None and len(old.xs) > kept
+
+    def points(self, name, numbers):
+        # x, y and radius of the given features of a group
+        group = self.groups[name]
+        return group.xs[numbers], group.ys[numbers], group.radii[numbers]
+
+    def cell_keys(self, xs, ys):
+        return (numpy.floor(xs / self.cell).astype(numpy.int64) << 32) | \
+            numpy.floor(ys / self.cell).astype(numpy.int64)
+
+    def move(self, name, number, x, y):
+        group = self.groups[name]
+        old_key, new_key = self.cell_keys(numpy.array([group.xs[number], x]), numpy.array([group.ys[number], y]))
+        group.xs[number], group.ys[number] = x, y
+        if new_key != old_key:
+            lo, hi = numpy.searchsorted(group.cell_keys, (old_key, old_key + 1))
+            at = lo + numpy.flatnonzero(group.numbers[lo:hi] == number)[0]
+            cell_keys = numpy.delete(group.cell_keys, at)
+            numbers = numpy.delete(group.numbers, at)
+            at = numpy.searchsorted(cell_keys, new_key)
+            group.cell_keys = numpy.insert(cell_keys, at, new_key)
+            group.numbers = numpy.insert(numbers, at, number)
+
+    def group_box(self, group, left, top, right, bottom):
+        # numbers of the features of a group whose cells meet the rectangle (unsorted)
+        cell = self.cell
+        left, top, right, bottom = int(left // cell), int(top // cell), int(right // cell), int(bottom // cell)
+        lo, hi = numpy.searchsorted(group.cell_keys, (left << 32, (right + 1) << 32))
+        rows = group.cell_keys[lo:hi] & 0xffffffff
+        return group.numbers[lo:hi][(rows >= top) & (rows <= bottom)]
+
+    def box(self, left, top, right, bottom):
+        """
+        The features whose points lie in the rectangle, as a dict of group
+        name to ascending feature numbers; groups with none are left out.
+        """
+        found = {}
+        for name, group in self.groups.items():
+            numbers = self.group_box(group, left, top, right, bottom)
+            xs, ys = group.xs[numbers], group.ys[numbers]
+            numbers = numbers[(xs >= left) & (xs <= right) & (ys >= top) & (ys <= bottom)]
+            if len(numbers):
+                found[name] = numpy.sort(numbers)
+        return found
+
+    def nearest(self, x, y, radius):
+        """
+        The feature nearest to x, y, measured to the edge of those with a
+        radius, if within radius: (group name, feature number, distance),
+        or None.
+        """
+        best = None
+        for name, group in self.groups.items():
+            if not len(group.xs):
+                continue
+            reach = radius + group.radii.max()
+            numbers = self.group_box(group, x - reach, y - reach, x + reach, y + reach)
+            if not len(numbers):
+                continue
+            distances = numpy.maximum(numpy.hypot(group.xs[numbers] - x, group.ys[numbers] - y) -
+                                      group.radii[numbers], 0)
+            k = numpy.argmin(distances)
+            if distances[k] <= radius and (best is None or distances[k] < best[2]):
+                best = (name, int(numbers[k]), float(distances[k]))
+        return best
@@ -0,0 +1,147 @@
+import numpy, threading
+from collections import OrderedDict
+from tile_providers import lon_to_world, lat_to_world
+
+def find_keys(sorted_keys, keys):
+    # positions of keys in sorted_keys, and whether each one is there
+    at = numpy.searchsorted(sorted_keys, keys)
+    if not len(sorted_keys):
+        return at, numpy.zeros(len(keys), dtype=bool)
+    return at, sorted_keys[numpy.minimum(at, len(sorted_keys) - 1)] == keys
+
+class TrailLevel():
+    """
+    The grid cells a trail has visited at one zoom level, with the latest
+    sample in each. Keys are cell x << 32 | cell y, so the cells of one
+    column range are a contiguous, sorted slice. Newly visited cells are
+    collected in a small side array and merged in MERGE_SIZE at a time.
+    """
+    MERGE_SIZE = 4096
+
+    def __init__(self, first):
+        self.next = first       # first sample not looked at yet
+        self.version = 0        # bumped whenever a cell gets a new or different sample
+        self.keys = numpy.zeros(0, dtype=numpy.int64)
+        self.numbers = numpy.zeros(0, dtype=numpy.int64)
+        self.new_keys = numpy.zeros(0, dtype=numpy.int64)
+        self.new_numbers = numpy.zeros(0, dtype=numpy.int64)
+
+    def count(self):
+        return len(self.keys) + len(self.new_keys)
+
+    def update(self, keys, numbers):
+        # keys are unique; numbers are later than any sample seen so far
+        changed = len(keys)
+        for cell_keys, cell_numbers in ((self.keys, self.numbers), (self.new_keys, self.new_numbers)):
+            at, seen = find_keys(cell_keys, keys)
+            # a cell that only gets a later sample of the same visit does not change the picture
+            changed -= numpy.count_nonzero(cell_numbers[at[seen]] == self.next - 1)
+            cell_numbers[at[seen]] = numbers[seen]
+            keys, numbers = keys[~seen], numbers[~seen]
+        at = numpy.searchsorted(self.new_keys, keys)
+        self.new_keys = numpy.insert(self.new_keys, at, keys)
+        self.new_numbers = numpy.insert(self.new_numbers, at, numbers)
+        if len(self.new_keys) > TrailLevel.MERGE_SIZE:
+            at = numpy.searchsorted(self.keys, self.new_keys)
+            self.keys = numpy.insert(self.keys, at, self.new_keys)
+            self.numbers = numpy.insert(self.numbers, at, self.new_numbers)
+            self.new_keys = self.new_keys[:0]
+            self.new_numbers = self.new_numbers[:0]
+        if changed:
+            self.version += 1
+
+    def query(self, left, top, right, bottom):
+        # samples of the cells in the given range of cell columns and rows
+        found = []
+        for cell_keys, cell_numbers in ((self.keys, self.numbers), (self.new_keys, self.new_numbers)):
+            lo, hi = numpy.searchsorted(cell_keys, (left << 32, (right + 1) << 32))
+            rows = cell_keys[lo:hi] & 0xffffffff
+            found.append(cell_numbers[lo:hi][(rows >= top) & (rows <= bottom)])
+        return numpy.concatenate(found)
+
+class FlightTrail():
+    """
+    Breadcrumb track of the aircraft: a fixed-capacity ring buffer of
+    (time, x, y, altitude, airspeed) samples, the oldest overwritten first.
+    x and y are world pixels at zoom 0, so drawing at any zoom is a scale
+    and an offset (see ViewProjection.from_world).
+
+    For drawing, the track is thinned on a pixel grid per zoom level: only
+    the latest sample in each cell x cell pixel square is kept, so laps
+    flown over the same ground replace each other instead of piling up.
+    The grid is brought up to date incrementally, from the samples appended
+    since it was last used.
+
+    Samples are appended on the ROS callback thread and read on the GUI
+    thread; readers hold lock while they use what they read.
+    """
+    TIME, X, Y, ALT, VA = range(5)
+    MAX_LEVELS = 3          # zoom levels whose grids are kept between calls
+
+    def __init__(self, capacity, cell=2.0):
+        self.capacity = capacity
+        self.cell = cell        # grid size in pixels at the level being decimated for
+        self.samples = numpy.zeros((5, capacity))   # one row per field
+        self.total = 0          # samples ever appended; sample n sits in column n % capacity
+        self.version = 0
+        self.clears = 0         # bumped by clear(), so drawings of the old trail can be told apart
+        self.levels = OrderedDict()     # zoom level -> TrailLevel, most recently used last
+        self.lock = threading.RLock()
+
+    def append(self, t, lat, lon, alt, Va):
+        sample = (t, lon_to_world(lon, 0), lat_to_world(lat, 0), alt, Va)
+        with self.lock:
+            self.samples[:, self.total % self.capacity] = sample
+            self.total += 1
+            self.version += 1
+
+    def clear(self):
+        with self.lock:
+            self.total = 0
+            self.levels = OrderedDict()
+            self.version += 1
+            self.clears += 1
+
+    def first(self):
+        # oldest sample still in the buffer
+        return max(0, self.total - self.capacity)
+
+    def field(self, field, numbers):
+        # one field (e.g. FlightTrail.ALT) of the given samples
+        return self.samples[field][numpy.asarray(numbers) % self.capacity]
+
+    def value_range(self, field):
+        # lowest and highest value of one field over the whole trail (which must not be empty)
+        with self.lock:
+            values = self.samples[field][:min(self.total, self.capacity)]
+            return values.min(), values.max()
+
+    def level(self, level):
+        # the grid at zoom level, brought up to date
+        with self.lock:
+            total, first = self.total, self.first()
+            state = self.levels.pop(level, None) or TrailLevel(first)
+            self.levels[level] = state
+            while len(self.levels) > FlightTrail.MAX_LEVELS:
+                self.levels.popitem(last=False)
+            start = max(state.next, first)
+            if start < total:
+                numbers = numpy.arange(start, total)
+                scale = 2.0**level / self.cell
+                keys = (numpy.floor(self.field(FlightTrail.X, numbers) * scale).astype(numpy.int64) << 32) | \
+                    numpy.floor(self.field(FlightTrail.Y, numbers) * scale).astype(numpy.int64)
+                # the last sample of the batch in each cell
+                keys, last = numpy.unique(keys[::-1], return_index=True)
+                state.update(keys, total - 1 - last)
+                state.next = total
+            return state
+
+    def decimated(self, level, left, top, right, bottom):
+        """
+        Numbers of the latest samples of the grid cells that meet the
+        rectangle (in world pixels at zoom level), ascending.
+        """
+        cell = self.cell
+        with self.lock:
+            numbers = self.level(level).query(int(left // cell), int(top // cell), int(right // cell), int(bottom // cell))
+            return numpy.sort(numbers[numbers >= self.first()])
@@ -1,75 +1,266 @@
-from FETCH_MAPS import *
-from collections import defaultdict
-from PyQt5.QtCore import QRect, Qt
+import math, os, numpy
+from FETCH_MAPS import zooms, pixels_to_degrees, QString
+from tile_store import open_tile_store, digest
+from tile_providers import get_provider, lon_to_world, lat_to_world, world_to_lon, world_to_lat, _EARTHPIX, _pixrad
+from tile_cache import TileCache
+from collections import OrderedDict
+from PyQt5.QtGui import QImage, QPainter, QPolygonF
+from PyQt5.QtCore import QPoint, QRect, QRectF, Qt
 
-TILEWIDTH = 640       # Larget tile dimension you can grab without paying
-TILEHEIGHT = 615      # Effective height to cut off Google logo
-_EARTHPIX = 268435456  # Number of pixels in half the earth's circumference at zoom = 21
-_pixrad = _EARTHPIX / math.pi
-_MAPS_CACHE_PATH = os.path.expanduser('~/.local/share/mapscache')
+_MAX_TILE_INDEXES = 8  # MapZoomObjs kept in memory, across all maps
 
 class LatLon():
     def __init__(self, lat = 0.0, lon = 0.0):
         self.lat = lat
         self.lon = lon
 
-class MapZoomObj():
-    def __init__(self, mapname, zoom):
-        filename = os.path.join(_MAPS_CACHE_PATH, mapname, str(zoom), 'info.txt')
-        self.tiles = defaultdict(dict)
+class ViewProjection():
+    """
+    Lat/lon to window pixels for one view of the map, with the per-view
+    constants worked out once. x() and y() take single values; project()
+    and polygon() take whole sequences or NumPy arrays at once, and
+    from_world() takes world pixels at zoom 0 (to_world() goes back).
+    """
+    def __init__(self, west, north, zoom):
+        zoom_factor = 2**(21-zoom)
+        self.x_scale = math.radians(_pixrad) / zoom_factor
+        self.x_offset = _EARTHPIX / zoom_factor - lon_to_world(west, zoom)
+        self.y_scale = _pixrad / zoom_factor
+        self.y_offset = _EARTHPIX / zoom_factor - lat_to_world(north, zoom)
+        self.world_scale = 2.0**zoom
+        self.world_x = lon_to_world(west, zoom)
+        self.world_y = lat_to_world(north, zoom)
+
+    def x(self, lon):
+        return lon * self.x_scale + self.x_offset
+
+    def y(self, lat):
+        return self.y_offset - self.y_scale * math.log(math.tan(math.pi/4 + math.radians(lat)/2))
+
+    def project(self, lats, lons):
+        # arrays of x and y for arrays of lat and lon
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lons = numpy.asarray(lons, dtype=numpy.float64)
+        return lons * self.x_scale + self.x_offset, \
+            self.y_offset - self.y_scale * numpy.log(numpy.tan(numpy.pi/4 + numpy.radians(lats)/2))
+
+    def from_world(self, xs, ys):
+        # arrays of x and y for arrays of world pixels at zoom 0
+        return xs * self.world_scale - self.world_x, ys * self.world_scale - self.world_y
+
+    def to_world(self, x, y):
+        # world pixels at zoom 0 of a window pixel
+        return (x + self.world_x) / self.world_scale, (y + self.world_y) / self.world_scale
 
-        with open(filename, 'r') as info_file:
-            for line in info_file:
-                items = line.split(' ')
-                self.tiles[int(items[0])][int(items[1])] = LatLon(float(items[2]), float(items[3].strip()))
+    @staticmethod
+    def world():
+        # the projection onto world pixels at zoom 0, in place of a window
+        return ViewProjection(world_to_lon(0, 0), world_to_lat(0, 0), 0)
 
-        self.cols = len(self.tiles)
-        self.rows = len(self.tiles[0])
+    def polygon(self, points):
+        # QPolygonF through a sequence of [lat, lon, ...] points
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(len(points), -1)
+        return ViewProjection.screen_polygon(*self.project(points[:, 0], points[:, 1]))
 
-        # calculate min and max latlon of MapZoomObj
-        min_latlon_center = self.tiles[0][self.rows-1]
-        max_latlon_center = self.tiles[self.cols-1][0]
+    @staticmethod
+    def screen_polygon(xs, ys):
+        # QPolygonF through arrays of window pixels, filled in place from NumPy
+        polygon = QPolygonF(len(xs))
+        if len(xs):
+            buffer = polygon.data()
+            buffer.setsize(16 * len(xs))
+            xy = numpy.frombuffer(buffer, dtype=numpy.float64).reshape(-1, 2)
+            xy[:, 0], xy[:, 1] = xs, ys
+        return polygon
 
-        min_lon = GoogleMapPlotter.pix_to_rel_lon(min_latlon_center.lon, int(-TILEWIDTH/2.0), zoom)
-        max_lon = GoogleMapPlotter.pix_to_rel_lon(max_latlon_center.lon, int(TILEWIDTH/2.0), zoom)
-        min_lat = GoogleMapPlotter.pix_to_rel_lat(min_latlon_center.lat, -int(TILEWIDTH/2.0 - TILEHEIGHT), zoom)
-        max_lat = GoogleMapPlotter.pix_to_rel_lat(max_latlon_center.lat, -int(TILEWIDTH/2.0), zoom)
+class MapZoomObj():
+    """
+    Tile index of one map at one zoom.
+
+    Tiles are fetched on a lattice that is regular in world pixels (see
+    TileProvider), so the index is just the world pixel position of tile
+    (0, 0) and a cols x rows mask of the tiles in the store. The tile under
+    any point follows in closed form from its world pixels.
+    """
+    def __init__(self, store, zoom, provider):
+        self.zoom = zoom
+        self.tile_size = provider.tile_size
+        self.col_spacing = provider.col_spacing
+        self.row_spacing = provider.row_spacing
+
+        lattice = store.lattice(zoom)
+        if lattice is not None:
+            # exact, and no tile centers to project
+            self.x0, self.y0, tiles = lattice
+            ij = numpy.array(tiles, dtype=numpy.intp).reshape(-1, 2)
+            i, j = ij[:, 0], ij[:, 1]
+        else:
+            info = numpy.array(store.read_info(zoom), dtype=numpy.float64).reshape(-1, 4)
+            i = info[:, 0].astype(numpy.intp)
+            j = info[:, 1].astype(numpy.intp)
+
+            # upper left corner of the image of tile (0, 0); the median irons out
+            # the rounding of the stored tile centers
+            self.x0 = self.y0 = 0.0
+            if len(info):
+                x = (_EARTHPIX + numpy.radians(info[:, 3]) * _pixrad) / 2**(21-zoom)
+                sinlat = numpy.sin(numpy.radians(info[:, 2]))
+                y = (_EARTHPIX - _pixrad * numpy.log((1 + sinlat)/(1 - sinlat)) / 2.0) / 2**(21-zoom)
+                self.x0 = float(numpy.median(x - i * self.col_spacing)) - self.tile_size/2.0
+                self.y0 = float(numpy.median(y - j * self.row_spacing)) - self.tile_size/2.0
+
+        # no tiles at all makes an empty index, 0 x 0 (see load)
+        self.cols = int(i.max()) + 1 if len(i) else 0
+        self.rows = int(j.max()) + 1 if len(j) else 0
+        self.present = numpy.zeros((self.cols, self.rows), dtype=bool)
+        self.present[i, j] = True
 
-        self.min_latlon = LatLon(min_lat, min_lon)
-        self.max_latlon = LatLon(max_lat, max_lon)
+    @staticmethod
+    def load(store, zoom, provider):
+        # the tile index of a zoom, or None if the store has no tiles there
+        mz_obj = MapZoomObj(store, zoom, provider)
+        return mz_obj if mz_obj.cols else None
+
+    def origin(self, i, j):
+        # world pixel position of the upper left corner of a tile image
+        return self.x0 + i * self.col_spacing, self.y0 + j * self.row_spacing
+
+    def center(self, i, j):
+        x, y = self.origin(i, j)
+        return LatLon(world_to_lat(y + self.tile_size/2.0, self.zoom), world_to_lon(x + self.tile_size/2.0, self.zoom))
+
+    def visible_height(self, j):
+        # only the bottom row of the map shows the strip below row_spacing (the Google logo)
+        return self.tile_size if j == self.rows - 1 else self.row_spacing
+
+    def locate(self, x, y):
+        # tile whose visible area holds world pixel x, y, clamped to the grid
+        i = int(math.floor((x - self.x0) / self.col_spacing))
+        j = int(math.floor((y - self.y0) / self.row_spacing))
+        return min(max(i, 0), self.cols - 1), min(max(j, 0), self.rows - 1)
+
+    def tile_range(self, left, top, right, bottom):
+        # min_i, max_i, min_j, max_j of the tiles covering a world pixel rectangle
+        min_i, min_j = self.locate(left, top)
+        max_i, max_j = self.locate(right, bottom)
+        return min_i, max_i, min_j, max_j
 
 class GoogleMapPlotter():
-    def __init__(self, mapdict, width, height, mapname, blankname):
-        # grab all info objects, all at once
+    def __init__(self, mapdict, width, height, mapname, blankname, cache_bytes=256*1024*1024, loader=None):
+        # decoded tiles, shared by every map and zoom
+        self.tile_cache = TileCache(cache_bytes)
+        # with a TileLoader, tiles are read and decoded off the GUI thread; its owner
+        # forwards loader.tile_loaded to tile_loaded() and loader.index_loaded to
+        # index_loaded(), and repaints when those return True
+        self.loader = loader
+        self.absent_tiles = set()
+        self.view_tiles = None
+        self.last_center = None
+        self.pan_direction = (0, 0)
+
+        # stores and tile indexes are loaded when a map or zoom is first shown;
+        # the least recently used indexes are dropped beyond _MAX_TILE_INDEXES
         self.mapname = mapname
         self.blankname = blankname
         self.mapdict = mapdict
-        self.mz_objs = defaultdict(dict)
-        for mapname in list(self.mapdict.keys()):
-            if not mapname == self.blankname:
-                for zoom in zooms:
-                    self.mz_objs[mapname][zoom] = MapZoomObj(mapname, zoom)
+        self.mz_objs = OrderedDict()
+        self.providers = {}
+        self.stores = {}
+        self.store_zooms = {}
 
         # grab objects for rendering
         self.width = width
         self.height = height
         self.center = LatLon(self.mapdict[self.mapname][0][0], self.mapdict[self.mapname][0][1])
 
-        self.zoom = self.mapdict[self.mapname][1]
-        if self.zoom > max(zooms):
-            self.zoom = max(zooms)
-        elif self.zoom < min(zooms):
-            self.zoom = min(zooms)
-        self.zoom_index = zooms.index(self.zoom)
+        # zoom may be fractional; tiles come from the cached level nearest to it, scaled to fit
+        self.zoom = self.clamp_zoom(self.mapdict[self.mapname][1])
+        self.level = self.nearest_level(self.zoom)
+        self.wanted_level = self.level  # the level to show once its index is loaded
+        self.zooming = False
 
-        self.mz_obj = self.mz_objs[self.mapname][self.zoom]
+        self.mz_obj = None
 
         # kickoff fetching and updating
         self.x_offset = 0.0
         self.y_offset = 0.0
+        self.view_shift = (0, 0)
         self.window_img = self.new_image(self.width, self.height)
+        self.back_img = None    # the other half of the double buffer that PanView scrolls through
         self.fetch_and_update()
 
+    def get_provider(self, mapname):
+        if not mapname in self.providers:
+            # map_info.xml may name a tile source after the center and zoom
+            spec = self.mapdict[mapname][2] if len(self.mapdict[mapname]) > 2 else None
+            self.providers[mapname] = get_provider(spec)
+        return self.providers[mapname]
+
+    def get_store(self, mapname):
+        if not mapname in self.stores:
+            # maps are fetched separately (see FETCH_MAPS.py), so only open what is cached
+            self.stores[mapname] = open_tile_store(mapname, provider=self.get_provider(mapname))
+            if self.stores[mapname] is not None:
+                self.store_zooms[mapname] = self.stores[mapname].zooms()
+        return self.stores[mapname]
+
+    def zoom_levels(self):
+        # zooms cached for the current map, including levels built locally by FETCH_MAPS
+        if self.mapname == self.blankname or self.get_store(self.mapname) is None:
+            return zooms
+        return self.store_zooms[self.mapname] or zooms
+
+    def clamp_zoom(self, zoom):
+        levels = self.zoom_levels()
+        return self.sat(zoom, min(levels), max(levels))
+
+    def nearest_level(self, zoom):
+        # ties go to the sharper level
+        return min(self.zoom_levels(), key=lambda level: (abs(level - zoom), -level))
+
+    def get_mz_obj(self, mapname, zoom, wait=True):
+        # tile index of a map at one zoom, or None if that zoom is not cached; with
+        # wait=False and a loader, an index that is not in memory is built in the
+        # background (see index_loaded) and None is returned meanwhile
+        key = (mapname, zoom)
+        if key in self.mz_objs:
+            mz_obj = self.mz_objs.pop(key)
+            self.mz_objs[key] = mz_obj  # most recently used goes last
+            return mz_obj
+        if mapname == self.blankname or self.get_store(mapname) is None or \
+                not zoom in self.store_zooms[mapname]:
+            return None
+        store, provider = self.stores[mapname], self.get_provider(mapname)
+        if not wait and self.loader is not None:
+            self.loader.request_index(key, lambda: MapZoomObj.load(store, zoom, provider))
+            return None
+        return self.add_mz_obj(key, MapZoomObj.load(store, zoom, provider))
+
+    def add_mz_obj(self, key, mz_obj):
+        self.mz_objs.pop(key, None)
+        self.mz_objs[key] = mz_obj
+        while len(self.mz_objs) > _MAX_TILE_INDEXES:
+            self.mz_objs.popitem(last=False)
+        return mz_obj
+
+    def switch_level(self, level):
+        # shows level once its index is in memory (or failed to load, and is kept as None);
+        # until then the current level stays up, scaled
+        self.wanted_level = level
+        if self.mz_obj is None or self.get_mz_obj(self.mapname, level, wait=False) is not None or \
+                (self.mapname, level) in self.mz_objs or not level in self.store_zooms.get(self.mapname, ()):
+            self.level = level
+
+    def index_loaded(self, key, mz_obj):
+        # receives indexes from the loader on the GUI thread (None for one that could not be
+        # loaded, shown as a zoom that is not cached); returns True if the view changed
+        self.add_mz_obj(key, mz_obj)
+        if key != (self.mapname, self.wanted_level) or key[1] == self.level:
+            return False
+        self.level = key[1]
+        self.fetch_and_update()
+        return True
+
     def GetImage(self):
         return self.window_img
 
@@ -84,26 +275,96 @@ class GoogleMapPlotter():
         self.center.lon = new_lon
         self.fetch_and_update()
 
-    def UpdateZoom(self, zoom_increment):
-        self.zoom_index = self.sat(self.zoom_index + zoom_increment, 0, len(zooms) - 1)
-        self.zoom = zooms[self.zoom_index]
+    def PanView(self, dx, dy):
+        # drag panning: moves the map dx, dy window pixels (right, down) by scrolling the
+        # image and drawing only the strips that come into view
+        self.center.lon = world_to_lon(lon_to_world(self.center.lon, self.zoom) - dx, self.zoom)
+        self.center.lat = world_to_lat(lat_to_world(self.center.lat, self.zoom) - dy, self.zoom)
+        if self.mz_obj is None or self.view_tiles is None or abs(dx) >= self.width or abs(dy) >= self.height:
+            self.fetch_and_update()
+            return
+        self.compute_region()
+
+        # the copy goes through the back buffer, so it never reads pixels it has written
+        if self.back_img is None or self.back_img.size() != self.window_img.size():
+            self.back_img = self.new_image(self.width, self.height)
+        self.window_img, self.back_img = self.back_img, self.window_img
+        painter = QPainter(self.window_img)
+        painter.drawImage(dx, dy, self.back_img)
+        painter.end()
+
+        # the tiles stay in the frame they were composited in, shifted by the pan
+        self.view_shift = (self.view_shift[0] + dx, self.view_shift[1] + dy)
+        self.view_tiles = self.window_tiles(QRect(0, 0, self.width, self.height))
+        strips = []
+        if dx != 0:
+            strips.append(QRect(0 if dx > 0 else self.width + dx, 0, abs(dx), self.height))
+        if dy != 0:
+            strips.append(QRect(0, 0 if dy > 0 else self.height + dy, self.width, abs(dy)))
+        for strip in strips:
+            min_i, max_i, min_j, max_j = self.window_tiles(strip)
+            tiles = self.grab_tiles(min_i, max_i, min_j, max_j)
+            painter = self.tile_painter(self.window_img, strip)
+            x_offset, y_offset = self.tile_offsets(min_i, min_j)
+            self.draw_tiles(painter, self.tile_clip(strip), tiles, min_i, max_i, min_j, max_j, x_offset, y_offset)
+            painter.end()
+        if self.loader is not None:
+            self.prefetch(*self.view_tiles)
+
+    def ScaleZoom(self, zoom_increment):
+        # interactive zoom: scales the tiles of the current level (cached ones, or placeholders),
+        # switching levels only when the scale would pass a factor of two
+        self.zoom = self.clamp_zoom(self.zoom + zoom_increment)
+        self.zooming = True
+        if abs(self.zoom - self.level) > 1:
+            self.switch_level(self.nearest_level(self.zoom))
+        self.fetch_and_update()
+
+    def SettleZoom(self):
+        # loads the level that best matches the zoom, once interactive zooming stops
+        self.zooming = False
+        self.switch_level(self.nearest_level(self.zoom))
         self.fetch_and_update()
 
     def UpdateMap(self, mapname):
+        if self.loader is not None:
+            self.loader.clear()
+        if self.stores.get(mapname) is None:
+            # look again, the map may have been fetched since
+            self.stores.pop(mapname, None)
         self.mapname = mapname
+        self.mz_obj = None  # nothing to show meanwhile, so the new map's index is read right away
         self.center.lat = self.mapdict[self.mapname][0][0]
         self.center.lon = self.mapdict[self.mapname][0][1]
-        self.zoom = self.mapdict[self.mapname][1]
-        self.fetch_and_update()
+        self.zoom = self.clamp_zoom(self.mapdict[self.mapname][1])
+        self.SettleZoom()
+
+    def RefreshMap(self, mapname):
+        # forgets what was read of a map's store, after FETCH_MAPS wrote to it
+        store = self.stores.get(mapname)
+        if store is None:
+            self.stores.pop(mapname, None)
+        else:
+            self.store_zooms[mapname] = store.zooms()
+        for key in [key for key in self.mz_objs if key[0] == mapname]:
+            del self.mz_objs[key]
+        self.tile_cache.remove_map(mapname)
+        self.absent_tiles = set(key for key in self.absent_tiles if key[0] != mapname)
+        if mapname == self.mapname:
+            if self.loader is not None:
+                self.loader.clear()
+            self.zoom = self.clamp_zoom(self.zoom)
+            self.level = self.wanted_level = self.nearest_level(self.zoom)
+            self.fetch_and_update()
 
     def fetch_and_update(self):
         self.compute_region()
-        if self.mapname == self.blankname:
+        self.mz_obj = self.get_mz_obj(self.mapname, self.level)
+        if self.mz_obj is None:
+            self.view_tiles = None
             self.blank_update()
         else:
-            self.mz_obj = self.mz_objs[self.mapname][self.zoom  ]
-            self.fetch()
-            self.update()
+            self.composite()
 
     @staticmethod
     def pix_to_rel_lon(centerlon, pix, zoom): # positive pix = right
@@ -131,16 +392,6 @@ class GoogleMapPlotter():
         zoom_factor = 2**(21-zoom)
         return (_pixrad*A + _EARTHPIX - centerlatpix)/zoom_factor
 
-    def fetch(self):
-        self.img = self.fetch_tiles()
-
-    def update(self):
-        painter = QPainter()
-        painter.begin(self.window_img)
-        painter.fillRect(QRect(0, 0, self.width, self.height), Qt.black)
-        painter.end()
-        self.paste(self.window_img, self.img, -self.x_offset, -self.y_offset)
-
     def blank_update(self):
         painter = QPainter()
         painter.begin(self.window_img)
@@ -153,31 +404,67 @@ class GoogleMapPlotter():
         # see http://pyqt.sourceforge.net/Docs/PyQt4/qimage.html#Format-enum
         return QImage(width, height, 4)
 
-    def paste(self, big_image, small_image, upper_left_x, upper_left_y):
-        destPos = QPoint(upper_left_x, upper_left_y)
-        painter = QPainter(big_image)
-	if small_image is not None:
-		painter.drawImage(destPos, small_image)
-
-    def grab_tile(self, i, j):
-        filename = os.path.join(_MAPS_CACHE_PATH, self.mapname, str(self.zoom), '%d_%d.jpg' % (i, j))
-        tile = None
-
-        if os.path.isfile(filename):
-            tile = QImage(QString(filename))
-
-        return tile
-
-    def localize_point(self, latlon, min_latlon, max_latlon):
-        # which column?
-        i = int((latlon.lon - min_latlon.lon) / (max_latlon.lon - min_latlon.lon) * self.mz_obj.cols)
-        i = self.sat(i, 0, self.mz_obj.cols - 1)
-
-        # which row? (calculated up-positive, but will be retrieved down-positive)
-        j = self.mz_obj.rows - 1 - int((latlon.lat - min_latlon.lat) / (max_latlon.lat - min_latlon.lat) * self.mz_obj.rows)
-        j = self.sat(j, 0, self.mz_obj.rows - 1)
+    def grab_tiles(self, min_i, max_i, min_j, max_j):
+        # decoded tiles for a block of the grid, reading only cache misses from the store;
+        # with a loader, misses are requested in the background and left out
+        tiles = {}
+        missing = []
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                key = (self.mapname, self.level, i, j)
+                tile = self.tile_cache.get(key)
+                if tile is not None:
+                    tiles[(i, j)] = tile
+                elif self.loader is not None:
+                    if self.mz_obj.present[i, j] and not key in self.absent_tiles:
+                        self.loader.request(key, self.stores[self.mapname])
+                else:
+                    missing.append((i, j))
+        if missing:
+            region = self.stores[self.mapname].get_region(self.level, min(k[0] for k in missing), max(k[0] for k in missing),
+                                                          min(k[1] for k in missing), max(k[1] for k in missing))
+            for key in missing:
+                tile = self.decode_tile((self.mapname, self.level) + key, region.get(key))
+                if tile is not None:
+                    tiles[key] = tile
+        return tiles
+
+    def decode_tile(self, key, data):
+        # decodes and caches a tile, unless a tile with the same data is already cached
+        if data is None:
+            return None
+        tile_digest = digest(data)
+        tile = self.tile_cache.shared_tile(tile_digest)
+        if tile is None:
+            tile = QImage()
+            tile.loadFromData(data)
+        return self.tile_cache.put(key, tile, tile_digest)
+
+    def tile_loaded(self, key, tile, digest):
+        # receives tiles from the loader on the GUI thread; returns True if the view changed
+        if tile.isNull():
+            self.absent_tiles.add(key)
+        else:
+            tile = self.tile_cache.put(key, tile, digest)
+        if self.view_tiles is None or key[0] != self.mapname or key[1] != self.level:
+            return False
+        min_i, max_i, min_j, max_j = self.view_tiles
+        if not (min_i <= key[2] <= max_i and min_j <= key[3] <= max_j):
+            return False
+        painter = self.tile_painter(self.window_img)
+        x_offset, y_offset = self.tile_offsets(min_i, min_j)
+        self.draw_tiles(painter, self.tile_clip(QRect(0, 0, self.width, self.height)), {(key[2], key[3]): tile},
+                        min_i, max_i, min_j, max_j, x_offset, y_offset, False)
+        painter.end()
+        return True
 
-        return i, j
+    def tile_range(self, mz_obj, level):
+        # range of tiles of mz_obj (a zoom level) under the current view
+        x = lon_to_world(self.center.lon, level)
+        y = lat_to_world(self.center.lat, level)
+        half_width = self.width / 2.0 / 2**(self.zoom - level)
+        half_height = self.height / 2.0 / 2**(self.zoom - level)
+        return mz_obj.tile_range(x - half_width, y - half_height, x + half_width, y + half_height)
 
     def sat(self, val, minval, maxval):
         if val < minval:
@@ -195,27 +482,156 @@ class GoogleMapPlotter():
 
         self.northeast = LatLon(self.north, self.east)
         self.southwest = LatLon(self.south, self.west)
+        self.projection = ViewProjection(self.west, self.north, self.zoom)
 
-    def fetch_tiles(self):
+    def composite(self):
         # find out which i, j values correspond to each corner
-        min_i, max_j = self.localize_point(self.southwest, self.mz_obj.min_latlon, self.mz_obj.max_latlon)
-        max_i, min_j = self.localize_point(self.northeast, self.mz_obj.min_latlon, self.mz_obj.max_latlon)
-
-        # fetch and paste images onto a big canvas
-        bigsize_x = (max_i - min_i + 1) * TILEWIDTH
-        bigsize_y = (max_j - min_j + 1) * TILEHEIGHT
-        bigimage = self.new_image(bigsize_x, bigsize_y)
-
+        min_i, max_i, min_j, max_j = self.tile_range(self.mz_obj, self.level)
+        self.view_tiles = (min_i, max_i, min_j, max_j)
+
+        # the window in pixels of the tile level, which the painter scales up to the zoom
+        self.view_scale = 2.0 ** (self.zoom - self.level)
+        self.view_shift = (0, 0)
+
+        upper_left_x, upper_left_y = self.mz_obj.origin(min_i, min_j)
+        self.x_offset = lon_to_world(self.center.lon, self.level) - self.width/2.0/self.view_scale - upper_left_x
+        self.y_offset = lat_to_world(self.center.lat, self.level) - self.height/2.0/self.view_scale - upper_left_y
+        # the frame tiles are drawn in until the next composite: tile (min_i, min_j) at -offset
+        self.tile_frame = (min_i, min_j, int(round(self.x_offset)), int(round(self.y_offset)))
+
+        tiles = self.grab_tiles(min_i, max_i, min_j, max_j)
+        painter = self.tile_painter(self.window_img)
+        self.draw_tiles(painter, self.tile_clip(QRect(0, 0, self.width, self.height)), tiles,
+                        min_i, max_i, min_j, max_j, self.tile_frame[2], self.tile_frame[3])
+        painter.end()
+        if self.loader is not None:
+            self.prefetch(min_i, max_i, min_j, max_j)
+
+    def tile_offsets(self, min_i, min_j):
+        # x_offset, y_offset of tile (min_i, min_j) in the tile frame
+        ref_i, ref_j, x_offset, y_offset = self.tile_frame
+        return x_offset - (min_i - ref_i) * self.mz_obj.col_spacing, y_offset - (min_j - ref_j) * self.mz_obj.row_spacing
+
+    def tile_clip(self, rect):
+        # a rectangle of the window in pixels of the tile frame, rounded outwards
+        scale = self.view_scale
+        left = int(math.floor((rect.left() - self.view_shift[0]) / scale))
+        top = int(math.floor((rect.top() - self.view_shift[1]) / scale))
+        right = int(math.ceil((rect.right() + 1 - self.view_shift[0]) / scale))
+        bottom = int(math.ceil((rect.bottom() + 1 - self.view_shift[1]) / scale))
+        return QRect(left, top, right - left, bottom - top)
+
+    def window_tiles(self, rect):
+        # range of tiles under a rectangle of the window
+        clip = self.tile_clip(rect)
+        ref_i, ref_j, x_offset, y_offset = self.tile_frame
+        x, y = self.mz_obj.origin(ref_i, ref_j)
+        return self.mz_obj.tile_range(x + x_offset + clip.left(), y + y_offset + clip.top(),
+                                      x + x_offset + clip.right(), y + y_offset + clip.bottom())
+
+    def tile_painter(self, image, rect=None):
+        # painter that draws the tile frame into image, limited to rect of the window
+        painter = QPainter(image)
+        if rect is not None:
+            painter.setClipRect(rect)
+        painter.translate(self.view_shift[0], self.view_shift[1])
+        if self.view_scale != 1.0:
+            painter.scale(self.view_scale, self.view_scale)
+            # smooth filtering once the zoom has settled
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, not self.zooming)
+        return painter
+
+    def draw_tiles(self, painter, clip, tiles, min_i, max_i, min_j, max_j, x_offset, y_offset, fill=True):
+        # draws the part of each tile that falls inside clip with painter (see tile_painter),
+        # where tile (min_i, min_j) has its upper left corner at (-x_offset, -y_offset);
+        # with fill, tiles that are not given get a placeholder, otherwise they are skipped;
+        # clip and offsets are in tile pixels
+        mz_obj = self.mz_obj
+        covered = x_offset <= clip.left() and y_offset <= clip.top() and \
+            (max_i - min_i + 1) * mz_obj.col_spacing - x_offset > clip.right() and \
+            (max_j - min_j + 1) * mz_obj.row_spacing - y_offset > clip.bottom()
+        if fill and not covered:
+            painter.fillRect(clip, Qt.black)
         for i in range(min_i, max_i + 1):
             for j in range(min_j, max_j + 1):
-                tile = self.grab_tile(i, j)
-                self.paste(bigimage, tile, (i-min_i)*TILEWIDTH, (j-min_j)*TILEHEIGHT)
-
-        upper_left_center = self.mz_obj.tiles[min_i][min_j]
-        upper_left_lon = GoogleMapPlotter.pix_to_rel_lon(upper_left_center.lon, int(-TILEWIDTH/2), self.zoom)
-        upper_left_lat = GoogleMapPlotter.pix_to_rel_lat(upper_left_center.lat, int(-TILEWIDTH/2), self.zoom)
-
-        self.x_offset = GoogleMapPlotter.rel_lon_to_rel_pix(upper_left_lon, self.west, self.zoom)
-        self.y_offset = GoogleMapPlotter.rel_lat_to_rel_pix(upper_left_lat, self.north, self.zoom)
-
-        return bigimage
+                tile = tiles.get((i, j))
+                if tile is None and not fill:
+                    continue
+                tile_x = (i - min_i) * mz_obj.col_spacing - x_offset
+                tile_y = (j - min_j) * mz_obj.row_spacing - y_offset
+                target = QRect(tile_x, tile_y, mz_obj.tile_size, mz_obj.visible_height(j)).intersected(clip)
+                if target.isEmpty():
+                    continue
+                if tile is not None and not tile.isNull():
+                    source = target.translated(-tile_x, -tile_y)
+                    painter.drawImage(QRectF(target), tile, QRectF(source))
+                elif tile is not None or not mz_obj.present[i, j] or \
+                        (self.mapname, self.level, i, j) in self.absent_tiles:
+                    painter.fillRect(target, Qt.black)
+                else:
+                    origin_x, origin_y = mz_obj.origin(i, j)
+                    self.draw_placeholder(painter, target, origin_x - tile_x, origin_y - tile_y)
+
+    def draw_placeholder(self, painter, target, origin_x, origin_y):
+        # fills target (tile pixels, where target + origin = world pixels at self.level)
+        # with an upscaled lower zoom tile from the cache, or gray if there is none
+        painter.fillRect(target, Qt.darkGray)
+        for zoom in (self.level - 1, self.level - 2):
+            mz_obj = self.get_mz_obj(self.mapname, zoom, wait=False)
+            if mz_obj is None:
+                continue
+            scale = 2.0 ** (self.level - zoom)
+            min_i, max_i, min_j, max_j = mz_obj.tile_range((target.left() + origin_x) / scale, (target.top() + origin_y) / scale,
+                                                           (target.right() + origin_x) / scale, (target.bottom() + origin_y) / scale)
+            drawn = False
+            for i in range(min_i, max_i + 1):
+                for j in range(min_j, max_j + 1):
+                    tile = self.tile_cache.peek((self.mapname, zoom, i, j))
+                    if tile is None:
+                        continue
+                    tile_x, tile_y = mz_obj.origin(i, j)
+                    part = QRectF(tile_x * scale - origin_x, tile_y * scale - origin_y, mz_obj.tile_size * scale,
+                                  mz_obj.visible_height(j) * scale).intersected(QRectF(target))
+                    if part.isEmpty():
+                        continue
+                    source = QRectF((part.x() + origin_x) / scale - tile_x, (part.y() + origin_y) / scale - tile_y,
+                                    part.width() / scale, part.height() / scale)
+                    painter.drawImage(part, tile, source)
+                    drawn = True
+            if drawn:
+                return
+
+    def prefetch(self, min_i, max_i, min_j, max_j):
+        # queue the ring of tiles in the pan direction and the view one zoom level up and down
+        center = (self.level, lon_to_world(self.center.lon, self.level), lat_to_world(self.center.lat, self.level))
+        if self.last_center is not None and self.last_center[0] == center[0]:
+            dx = center[1] - self.last_center[1]
+            dy = center[2] - self.last_center[2]
+            if dx != 0 or dy != 0:
+                self.pan_direction = ((dx > 0) - (dx < 0), (dy > 0) - (dy < 0))
+        self.last_center = center
+
+        self.loader.clear_prefetch()
+        wanted = []
+        dx, dy = self.pan_direction
+        if dx != 0:
+            i = max_i + 1 if dx > 0 else min_i - 1
+            wanted += [(self.level, i, j) for j in range(min_j - 1, max_j + 2)]
+        if dy != 0:
+            j = max_j + 1 if dy > 0 else min_j - 1
+            wanted += [(self.level, i, j) for i in range(min_i - 1, max_i + 2)]
+        # the neighbouring levels' indexes are loaded in the background first, if need be
+        levels = {self.level: self.mz_obj}
+        for zoom in (self.level + 1, self.level - 1):
+            mz_obj = self.get_mz_obj(self.mapname, zoom, wait=False)
+            if mz_obj is not None:
+                levels[zoom] = mz_obj
+                zmin_i, zmax_i, zmin_j, zmax_j = self.tile_range(mz_obj, zoom)
+                wanted += [(zoom, i, j) for i in range(zmin_i, zmax_i + 1) for j in range(zmin_j, zmax_j + 1)]
+
+        for zoom, i, j in wanted:
+            mz_obj = levels[zoom]
+            key = (self.mapname, zoom, i, j)
+            if 0 <= i < mz_obj.cols and 0 <= j < mz_obj.rows and mz_obj.present[i, j] \
+                    and not self.tile_cache.contains(key) and not key in self.absent_tiles:
+                self.loader.request(key, self.stores[self.mapname], prefetch=True)
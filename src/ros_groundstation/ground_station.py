@@ -1,5 +1,6 @@
 from __future__ import print_function
 import argparse
+import rospy
 from python_qt_binding import QT_BINDING
 from python_qt_binding.QtCore import qDebug, QTimer, Qt
 from python_qt_binding.QtWidgets import QWidget, QBoxLayout, QVBoxLayout, QHBoxLayout, QPushButton, QSplitter
@@ -50,12 +51,17 @@ class GroundStationWidget(QWidget):
         total_layout.addWidget(self._principle_layout)
         self.setLayout(total_layout)
 
-        # Global timer for marble_map and artificial_horizon
-        self.interval = 100     # in milliseconds, period of regular update
+        # Global timer for marble_map and artificial_horizon; each tick they repaint only
+        # what changed, so this caps the frame rate rather than setting it
+        self.max_fps = rospy.get_param('mapMaxFps', 10)
+        if not self.max_fps > 0:
+            rospy.logwarn('mapMaxFps must be positive, using 10')
+            self.max_fps = 10
+        self.interval = max(1, int(1000 / self.max_fps))    # in milliseconds, period of regular update
         self.timer = QTimer(self)
         self.timer.setInterval(self.interval)
-        self.timer.timeout.connect(self._mw._marble_map.update)
-        self.timer.timeout.connect(self._ah.update)
+        self.timer.timeout.connect(self._mw._marble_map.refresh)
+        self.timer.timeout.connect(self._ah.refresh)
         self.timer.start()
 
     def closeEvent(self, event):
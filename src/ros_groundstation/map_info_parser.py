@@ -25,7 +25,9 @@ def get_gps_dict():
         lat = float(str(xmlnode.find('lat').text))
         lon = float(str(xmlnode.find('lon').text))
         zoom = int(str(xmlnode.find('zoom').text))
-        gps_dict[name] = [[lat, lon], zoom]
+        # optional tile source, see tile_providers.get_provider
+        tiles = xmlnode.find('tiles')
+        gps_dict[name] = [[lat, lon], zoom, None if tiles is None else (tiles.text or '').strip()]
     return gps_dict
 
 def get_typed_waypoints(map_name, folder_name):
@@ -0,0 +1,96 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPainter, QPixmap
+
+class MapLayer():
+    """
+    One overlay drawn on top of the map tiles by draw(painter).
+
+    Static layers are painted into a cached pixmap that is reused until the
+    view or the tuple returned by versions() changes. Dynamic layers are drawn
+    straight onto the widget every frame. active() tells whether the layer has
+    anything to draw (e.g. whether its subscriber is enabled).
+
+    A layer that only grows can pass extend(painter, versions), which brings
+    a pixmap painted for the given versions up to date by drawing on top of
+    it, or returns False to have the layer painted again. It is only tried
+    while the view stays the same.
+    """
+    def __init__(self, name, z, draw, versions=None, active=None, dynamic=False, extend=None):
+        self.name = name
+        self.z = z                  # layers are painted in increasing z
+        self.draw = draw
+        self.versions = versions or (lambda: ())
+        self.active = active or (lambda: True)
+        self.dynamic = dynamic
+        self.extend = extend
+        self.visible = True
+        self.pixmap = None
+        self.key = None             # (view, versions) the pixmap was painted for
+
+    def cached_pixmap(self, view, size):
+        key = (view, self.versions())
+        if self.pixmap is None or self.pixmap.size() != size:
+            self.pixmap = QPixmap(size)
+            self.key = None
+        if self.key != key:
+            extended = False
+            if self.extend is not None and self.key is not None and self.key[0] == view:
+                painter = self.painter()
+                extended = self.extend(painter, self.key[1])
+                painter.end()
+            if not extended:
+                self.pixmap.fill(Qt.transparent)
+                painter = self.painter()
+                self.draw(painter)
+                painter.end()
+            self.key = key
+        return self.pixmap
+
+    def painter(self):
+        painter = QPainter(self.pixmap)
+        painter.setRenderHint(QPainter.Antialiasing, True)
+        return painter
+
+class LayerStack():
+    """
+    The overlays of a map widget, in z-order, with a visibility flag each.
+    """
+    def __init__(self):
+        self.layers = []
+
+    def add(self, layer):
+        self.layers.append(layer)
+        self.layers.sort(key=lambda item: item.z)
+        return layer
+
+    def layer(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        return None
+
+    def set_visible(self, name, visible):
+        self.layer(name).visible = visible
+
+    def invalidate(self):
+        # forces every static layer to be painted again
+        for layer in self.layers:
+            layer.key = None
+
+    def state(self, dynamic=False):
+        # what the static (or dynamic) layers would draw, to compare against the last frame
+        return tuple((layer.visible, layer.visible and layer.active(), layer.versions())
+                     for layer in self.layers if layer.dynamic == dynamic)
+
+    def paint(self, painter, view, size, rect=None):
+        # view is anything that changes whenever map pixels move (center, zoom, size);
+        # rect limits the copy of cached pixmaps to the part of the widget being repainted
+        for layer in self.layers:
+            if not layer.visible or not layer.active():
+                continue
+            if layer.dynamic:
+                layer.draw(painter)
+            elif rect is None:
+                painter.drawPixmap(0, 0, layer.cached_pixmap(view, size))
+            else:
+                painter.drawPixmap(rect, layer.cached_pixmap(view, size), rect)
@@ -1,7 +1,7 @@
 from __future__ import print_function
 import rospy
 from std_msgs.msg import String
-import json, re
+import json, re, numpy
 from Geo import Geobase
 from math import fmod, pi
 
@@ -16,10 +16,15 @@ from uav_msgs.srv import GetMissionWithId, PlanMissionPoints, UploadPath
 from rosflight_msgs.msg import GNSS, RCRaw
 
 from Path import Path
+from flight_trail import FlightTrail
+from tile_providers import lon_to_world, lat_to_world
+
+_TRAIL_CAPACITY = 1 << 20  # state samples kept in the flight trail, about 3 hours at 100 Hz
 
 
 class InitSub():
     init_latlonalt = [0.0, 0.0, 0.0]
+    version = 0     # bumped whenever the data changes, so views know when to redraw
     with_init = False
     enabled = False
     GB = None
@@ -34,6 +39,7 @@ class InitSub():
         InitSub.init_latlonalt = new_init_latlonalt
         InitSub.GB = Geobase(InitSub.init_latlonalt[0], InitSub.init_latlonalt[1])
         InitSub.enabled = True
+        InitSub.version += 1
 
     @staticmethod
     def state_callback(state):
@@ -42,6 +48,7 @@ class InitSub():
         InitSub.init_latlonalt[2] = state.altitude
         InitSub.GB = Geobase(InitSub.init_latlonalt[0], InitSub.init_latlonalt[1])
         InitSub.enabled = True  # only perform the calculations if GPS init received
+        InitSub.version += 1
         InitSub.gi_sub.unregister()
 
     @staticmethod
@@ -65,6 +72,7 @@ class InitSub():
         InitSub.init_latlonalt = [0.0, 0.0, 0.0]
         InitSub.enabled = False
         InitSub.GB = None
+        InitSub.version += 1
         if not InitSub.gi_sub is None:
             InitSub.gi_sub.unregister()
             InitSub.gi_sub = None
@@ -76,6 +84,7 @@ class MissionSub():
     obstacles = []
     waypoints = []
     currentWaypoint = []
+    version = 0
     mission_proxy = rospy.ServiceProxy('get_mission_with_id', GetMissionWithId)
     cwp_sub = None
 
@@ -118,20 +127,21 @@ class MissionSub():
             lon = boundary.point.longitude
             MissionSub.boundaries.append([lat, lon])
         MissionSub.boundaries.append(MissionSub.boundaries[0])
-        for obstacle in response.mission.stationary_obstacles:
-            lat = obstacle.point.latitude
-            lon = obstacle.point.longitude
-            rad = obstacle.cylinder_radius
-            N, E, D = InitSub.GB.gps_to_ned(lat, lon)
-            lat_ul, lon_ul, alt_ul = InitSub.GB.ned_to_gps(N + rad, E - rad, D)
-            lat_lr, lon_lr, alt_lr = InitSub.GB.ned_to_gps(N - rad, E + rad, D)
-            MissionSub.obstacles.append([lat_ul, lon_ul, lat_lr, lon_lr])
+        obstacles = response.mission.stationary_obstacles
+        N, E, D = InitSub.GB.gps_to_ned_many([obstacle.point.latitude for obstacle in obstacles],
+                                             [obstacle.point.longitude for obstacle in obstacles])
+        rad = numpy.array([obstacle.cylinder_radius for obstacle in obstacles], dtype=numpy.float64)
+        lat_ul, lon_ul, alt_ul = InitSub.GB.ned_to_gps_many(N + rad, E - rad, D)
+        lat_lr, lon_lr, alt_lr = InitSub.GB.ned_to_gps_many(N - rad, E + rad, D)
+        MissionSub.obstacles = numpy.column_stack((lat_ul, lon_ul, lat_lr, lon_lr)).tolist()
         MissionSub.enabled = True
+        MissionSub.version += 1
 
     @staticmethod
     def cwp_callback(wp):
         lat, lon, alt = InitSub.GB.ned_to_gps(wp.w[0], wp.w[1], wp.w[2])
         MissionSub.currentWaypoint = [lat, lon, alt]
+        MissionSub.version += 1
 
 
 # "POINTS AND PATHS" Subscriber
@@ -147,6 +157,7 @@ class PPSub():
     seaoutput_rawh_wps = []
     seaoutput_rawh_approved = False
     mission_type = 0
+    version = 0
     clear_proxy = rospy.ServiceProxy('clear_wpts', UploadPath)
     approval_proxy = rospy.ServiceProxy('approved_path', UploadPath)
     path_wps_proxy = rospy.ServiceProxy('plan_path', PlanMissionPoints)
@@ -162,15 +173,18 @@ class PPSub():
     def setFirstLandingWaypoint(waypoint):
         PPSub.land_wps[0] = waypoint
         PPSub.enabled = True
+        PPSub.version += 1
 
     @staticmethod
     def setSecondLandingWaypoint(waypoint):
         PPSub.land_wps[1] = waypoint
         PPSub.enabled = True
+        PPSub.version += 1
 
     @staticmethod
     def resetLandingWaypoints():
         PPSub.land_wps = [[], []]
+        PPSub.version += 1
 
     @staticmethod
     def clearAllWaypoints():
@@ -178,6 +192,7 @@ class PPSub():
         PPSub.landing_wps = []
         PPSub.seaoutput_rawh_wps = []
         PPSub.payload_wps = []
+        PPSub.version += 1
         try:
             cleared = PPSub.clear_proxy()
             print('Successfully cleared waypoints.')
@@ -206,34 +221,22 @@ class PPSub():
 
             if PPSub.mission_type == 0:
                 PPSub.path_approved = False
-                PPSub.path_wps = []
-                for NED in response.planned_waypoints.waypoint_list:
-                    lat, lon, alt = InitSub.GB.ned_to_gps(NED.N, NED.E, NED.D)
-                    PPSub.path_wps.append([lat, lon])
+                PPSub.path_wps = PPSub.convertPath(response.planned_waypoints.waypoint_list)
             elif PPSub.mission_type == 2:
                 PPSub.seaoutput_rawh_approved = False
-                PPSub.seaoutput_rawh_wps = []
-                for NED in response.planned_waypoints.waypoint_list:
-                    lat, lon, alt = InitSub.GB.ned_to_gps(NED.N, NED.E, NED.D)
-                    PPSub.seaoutput_rawh_wps.append([lat, lon])
+                PPSub.seaoutput_rawh_wps = PPSub.convertPath(response.planned_waypoints.waypoint_list)
                 if len(PPSub.path_wps) > 0:
                     PPSub.seaoutput_rawh_wps.insert(0, PPSub.path_wps[-1])
             elif PPSub.mission_type == 1:
                 PPSub.payload_approved = False
-                PPSub.payload_wps = []
-                for NED in response.planned_waypoints.waypoint_list:
-                    lat, lon, alt = InitSub.GB.ned_to_gps(NED.N, NED.E, NED.D)
-                    PPSub.payload_wps.append([lat, lon])
+                PPSub.payload_wps = PPSub.convertPath(response.planned_waypoints.waypoint_list)
                 if len(PPSub.seaoutput_rawh_wps) > 0:
                     PPSub.payload_wps.insert(0, PPSub.seaoutput_rawh_wps[-1])
                 elif len(PPSub.path_wps) > 0:
                     PPSub.payload_wps.insert(0, PPSub.path_wps[-1])
             elif PPSub.mission_type == 4:
                 PPSub.landing_approved = False
-                PPSub.landing_wps = []
-                for NED in response.planned_waypoints.waypoint_list:
-                    lat, lon, alt = InitSub.GB.ned_to_gps(NED.N, NED.E, NED.D)
-                    PPSub.landing_wps.append([lat, lon])
+                PPSub.landing_wps = PPSub.convertPath(response.planned_waypoints.waypoint_list)
                 if len(PPSub.payload_wps) > 0:
                     PPSub.landing_wps.insert(0, PPSub.payload_wps[-1])
                 elif len(PPSub.seaoutput_rawh_wps) > 0:
@@ -241,9 +244,17 @@ class PPSub():
                 elif len(PPSub.path_wps) > 0:
                     PPSub.landing_wps.insert(0, PPSub.path_wps[-1])
             PPSub.enabled = True
+            PPSub.version += 1
         except:
             return
 
+    @staticmethod
+    def convertPath(waypoint_list):
+        # NED_pts to [[lat, lon], ...], all at once
+        lat, lon, alt = InitSub.GB.ned_to_gps_many([NED.N for NED in waypoint_list], [NED.E for NED in waypoint_list],
+                                                   [NED.D for NED in waypoint_list])
+        return numpy.column_stack((lat, lon)).tolist()
+
     @staticmethod
     def approvePath():
         # try:
@@ -265,6 +276,7 @@ class PPSub():
             PPSub.payload_approved = PPSub.approval_proxy()
         if PPSub.mission_type == 4:
             PPSub.landing_approved = PPSub.approval_proxy()
+        PPSub.version += 1
 
 
 class StateSub():
@@ -279,6 +291,8 @@ class StateSub():
     psi = 0.0
     chi = 0.0
     enabled = False
+    version = 0
+    trail = None    # FlightTrail, created with the first state message
 
     @staticmethod
     def updateStateTopic(new_state_topic):
@@ -305,6 +319,10 @@ class StateSub():
             StateSub.phi = state.phi
             StateSub.theta = state.theta
             StateSub.enabled = True
+            StateSub.version += 1
+            if StateSub.trail is None:
+                StateSub.trail = FlightTrail(_TRAIL_CAPACITY)
+            StateSub.trail.append(state.header.stamp.to_sec(), StateSub.lat, StateSub.lon, StateSub.alt, state.Va)
 
     @staticmethod
     def closeSubscriber():
@@ -322,16 +340,72 @@ class StateSub():
         StateSub.theta = 0.0
         StateSub.psi = 0.0
         StateSub.chi = 0.0
+        StateSub.version += 1
+        if StateSub.trail is not None:
+            StateSub.trail.clear()
         if not StateSub.state_sub is None:
             StateSub.state_sub.unregister()
             StateSub.state_sub = None
 
 
+class VehicleSub():
+    """
+    State of the other aircraft in the air, one State topic each (e.g.
+    /uav2/state), for drawing them on the map. StateSub stays the aircraft
+    this ground station flies.
+
+    All vehicles share one array, a row of X, Y, ALT, CHI, VA, STAMP per
+    vehicle, with x and y in world pixels at zoom 0, so the map projects and
+    culls every vehicle at once (see ViewProjection.from_world).
+    """
+    X, Y, ALT, CHI, VA, STAMP = range(6)
+    state_subs = []
+    topics = []
+    names = []              # namespace of each topic, for labels
+    states = numpy.zeros((0, 6))
+    heard = numpy.zeros(0, dtype=bool)  # whether each vehicle has reported yet
+    version = 0
+
+    @staticmethod
+    def updateStateTopics(new_state_topics):
+        print('subscribing to', ' '.join(new_state_topics))
+        VehicleSub.reset()
+        VehicleSub.topics = list(new_state_topics)
+        VehicleSub.names = [topic.rstrip('/').rsplit('/', 1)[0].strip('/') or topic for topic in VehicleSub.topics]
+        VehicleSub.states = numpy.zeros((len(VehicleSub.topics), 6))
+        VehicleSub.heard = numpy.zeros(len(VehicleSub.topics), dtype=bool)
+        VehicleSub.state_subs = [rospy.Subscriber(topic, State, VehicleSub.state_callback, index)
+                                 for index, topic in enumerate(VehicleSub.topics)]
+
+    @staticmethod
+    def state_callback(state, index):
+        # a message still in flight when the topics change may not fit the new arrays
+        states, heard = VehicleSub.states, VehicleSub.heard
+        if InitSub.enabled and index < len(states):
+            lat, lon, alt = InitSub.GB.ned_to_gps(state.position[0], state.position[1], state.position[2])
+            states[index] = (lon_to_world(lon, 0), lat_to_world(lat, 0), alt, fmod(state.chi, 2 * pi),
+                             state.Va, state.header.stamp.to_sec())
+            heard[index] = True
+            VehicleSub.version += 1
+
+    @staticmethod
+    def reset():
+        for state_sub in VehicleSub.state_subs:
+            state_sub.unregister()
+        VehicleSub.state_subs = []
+        VehicleSub.topics = []
+        VehicleSub.names = []
+        VehicleSub.states = numpy.zeros((0, 6))
+        VehicleSub.heard = numpy.zeros(0, dtype=bool)
+        VehicleSub.version += 1
+
+
 class RCSub():
     output_raw_sub = None
     output_raw_topic = None
     autopilotEnabled = True
     channel = 6
+    version = 0
 
     @staticmethod
     def updateRCRawTopic(new_output_raw_topic):
@@ -353,6 +427,7 @@ class RCSub():
     @staticmethod
     def output_raw_callback(output_rawRaw):
         RCSub.autopilotEnabled = (output_rawRaw.values[RCSub.channel] < 950)  # <<<<<
+        RCSub.version += 1
 
     @staticmethod
     def closeSubscriber():
@@ -362,6 +437,7 @@ class RCSub():
     @staticmethod
     def reset():
         RCSub.autopilotEnabled = True
+        RCSub.version += 1
         if not RCSub.output_raw_sub is None:
             RCSub.output_raw_sub.unregister()
             RCSub.output_raw_sub = None
@@ -377,6 +453,7 @@ class PathSub:
     c = [0.0, 0.0, 0.0]
     rho = 0.0
     enabled = False
+    version = 0
 
     @staticmethod
     def updatePathTopic(new_path_topic):
@@ -401,6 +478,7 @@ class PathSub:
             PathSub.c = [c_lat, c_lon, c_alt]
             PathSub.rho = path.rho
             PathSub.enabled = True
+            PathSub.version += 1
 
     @staticmethod
     def closeSubscriber():
@@ -415,6 +493,7 @@ class PathSub:
         PathSub.q = [0.0, 0.0, 0.0]
         PathSub.c = [0.0, 0.0, 0.0]
         PathSub.rho = 0.0
+        PathSub.version += 1
         if not PathSub.path_sub is None:
             PathSub.path_sub.unregister()
             PathSub.path_sub = None
@@ -434,6 +513,7 @@ class ExtendedPathSub:
     clockwise = False
     enabled = False
     last_path = None
+    version = 0
 
     @staticmethod
     def updateExtendedPathTopic(new_extended_path_topic):
@@ -474,6 +554,7 @@ class ExtendedPathSub:
                                                             extended_path.path.c[2])
                 ExtendedPathSub.c = [c_lat, c_lon, c_alt]
                 extended_path.path.c = FullPathSub.convert_ned_to_gps(extended_path.path.c)
+            ExtendedPathSub.version += 1
 
     @staticmethod
     def closeSubscriber():
@@ -488,6 +569,7 @@ class ExtendedPathSub:
         ExtendedPathSub.q = [0.0, 0.0, 0.0]
         ExtendedPathSub.c = [0.0, 0.0, 0.0]
         ExtendedPathSub.rho = 0.0
+        ExtendedPathSub.version += 1
         if not ExtendedPathSub.extended_path_sub is None:
             ExtendedPathSub.extended_path_sub.unregister()
             ExtendedPathSub.extended_path_sub = None
@@ -498,6 +580,7 @@ class FullPathSub:
     full_path_topic = None
     current_path = None
     enabled = False
+    version = 0
 
     @staticmethod
     def update_full_path_topic(topic):
@@ -514,7 +597,8 @@ class FullPathSub:
     def full_path_callback(full_path):
         FullPathSub.enabled = True
         if InitSub.enabled:
-            FullPathSub.current_path = [Path(path) for path in full_path.paths]
+            FullPathSub.current_path = Path.convert_paths(full_path.paths)
+            FullPathSub.version += 1
 
     @staticmethod
     def convert_ned_to_gps(ned):
@@ -532,6 +616,7 @@ class FullPathSub:
     @staticmethod
     def reset():
         FullPathSub.enabled = False
+        FullPathSub.version += 1
         if FullPathSub.full_path_sub is not None:
             FullPathSub.full_path_sub.unregister()
             FullPathSub.full_path_sub = None
@@ -610,6 +695,7 @@ class WaypointSub():
     waypoint_topic = None
     waypoints = []
     enabled = False
+    version = 0
 
     @staticmethod
     def updateWaypointTopic(new_waypoint_topic):
@@ -628,17 +714,23 @@ class WaypointSub():
         print("Waypoint recieved")
         if wp.clear_wp_list or wp.set_current:
             WaypointSub.waypoints = list()
+            WaypointSub.version += 1
             if wp.clear_wp_list:
                 return
         if InitSub.enabled:
             print("Initsub ready")
             lat, lon, alt = InitSub.GB.ned_to_gps(wp.w[0], wp.w[1], wp.w[2])
             WaypointSub.waypoints.append(renderable_wp(lat, lon, alt, wp.chi_d, wp.chi_valid, wp.Va_d))
-            for rwp in WaypointSub.waypoints:
-                if not rwp.converted:
-                    rwp.lat, rwp.lon, rwp.alt = InitSub.GB.ned_to_gps(rwp.lat, rwp.lon, rwp.alt)
+            # waypoints that came in before InitSub was ready are still NED
+            waiting = [rwp for rwp in WaypointSub.waypoints if not rwp.converted]
+            if waiting:
+                lats, lons, alts = InitSub.GB.ned_to_gps_many([rwp.lat for rwp in waiting], [rwp.lon for rwp in waiting],
+                                                              [rwp.alt for rwp in waiting])
+                for rwp, lat, lon, alt in zip(waiting, lats.tolist(), lons.tolist(), alts.tolist()):
+                    rwp.lat, rwp.lon, rwp.alt = lat, lon, alt
                     rwp.converted = True
             WaypointSub.enabled = True
+            WaypointSub.version += 1
         else:
             print("InitSub not ready")
             WaypointSub.waypoints.append(
@@ -655,6 +747,7 @@ class WaypointSub():
         print("Resetting WayPointSub")
         WaypointSub.enabled = False
         WaypointSub.waypoints = []
+        WaypointSub.version += 1
         if not WaypointSub.wp_sub is None:
             WaypointSub.wp_sub.unregister()
             WaypointSub.wp_sub = None
@@ -805,6 +898,7 @@ class ConComSub():
     h_c = 0.0
     chi_c = 0.0
     enabled = False
+    version = 0
 
     @staticmethod
     def updateConComTopic(new_controller_commands_topic):
@@ -825,6 +919,7 @@ class ConComSub():
         ConComSub.h_c = controller_commands.h_c
         ConComSub.chi_c = controller_commands.chi_c
         ConComSub.enabled = True
+        ConComSub.version += 1
 
     @staticmethod
     def closeSubscriber():
@@ -837,6 +932,7 @@ class ConComSub():
         ConComSub.Va_c = 0.0
         ConComSub.h_c = 0.0
         ConComSub.chi_c = 0.0
+        ConComSub.version += 1
         if not ConComSub.con_com_sub is None:
             ConComSub.con_com_sub.unregister()
             ConComSub.con_com_sub = None
@@ -5,7 +5,8 @@ from .marble_map import MarbleMap
 from .ct_window import CtWindow
 from .op_window import OpWindow
 import map_info_parser
-import os
+import os, rospy
+from FETCH_MAPS import MapFetchThread
 
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
@@ -13,6 +14,8 @@ from PyQt5.QtCore import *
 PWD = os.path.dirname(os.path.abspath(__file__))
 
 class MapWindow(QWidget):
+    map_fetched = pyqtSignal(str)   # emitted by the fetch thread, delivered on the GUI thread
+
     def __init__(self, uifname = 'map_widget_TEMPDEVEL.ui'):
         super(MapWindow, self).__init__()
         button_icon_file = os.path.join(PWD, 'resources', 'airplane.png')
@@ -26,6 +29,12 @@ class MapWindow(QWidget):
         self._marble_map = MarbleMap(self.gps_dict, self.blankname)
         self.verticalLayout.addWidget(self._marble_map)
 
+        # tiles are downloaded by the fetch_maps script; optionally run it in the background instead
+        if rospy.get_param('fetchMapsOnStartup', False):
+            self.map_fetched.connect(self._marble_map.map_fetched)
+            self.fetch_thread = MapFetchThread(fetched=self.map_fetched.emit)
+            self.fetch_thread.start()
+
         self._home_opts.clear()
         keylist = sorted(self.gps_dict, key=self.gps_dict.get)
         self._home_opts.addItems(keylist)
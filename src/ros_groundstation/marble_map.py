@@ -1,12 +1,16 @@
-from .gm_plotter import GoogleMapPlotter
+from .gm_plotter import GoogleMapPlotter, ViewProjection
+from .tile_loader import TileLoader
+from .map_layers import MapLayer, LayerStack
+from .flight_trail import FlightTrail
+from .feature_index import FeatureIndex
 from python_qt_binding import loadUi
-from python_qt_binding.QtWidgets import QWidget, QMenu
+from python_qt_binding.QtWidgets import QWidget, QMenu, QRubberBand
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
 QString = type("")
-import os.path
-from math import sin, cos, radians, degrees
+import os.path, rospy, numpy
+from math import sin, cos, radians, degrees, ceil
 
 import map_info_parser
 from Signals import WP_Handler  # , AttentiveHandler
@@ -35,28 +39,102 @@ class MarbleMap(QWidget):
 
         self.GB = Geobase(self.latlon[0], self.latlon[1])  # For full current path drawer
         self._mouse_attentive = False
-        self.movement_offset = QPoint(0, 0)
-
-        self.mouse_event_counter = 0
-        self.counter_limit = 4
-        self.lon_multiplier = -0.25
-        self.lat_multiplier = -0.25
-        self.wheel_angle = 0
-        self.wheel_angle_thresh = 1 * 120
+        self.movement_offset = QPoint(0, 0)  # last mouse position of a drag
+        # wheel zoom is continuous; the proper tile level loads once the wheel rests
+        self.zoom_per_notch = 0.5
+        self.zoom_settle_timer = QTimer(self)
+        self.zoom_settle_timer.setSingleShot(True)
+        self.zoom_settle_timer.setInterval(250)
+        self.zoom_settle_timer.timeout.connect(self.settle_zoom)
 
         # geometric items for drawing
         self.plane_h = 30  # pixels
         self.plane_w = 25  # pixels
 
-        self.draw_gridlines = False
         self.grid_dist = 20  # meters
 
+        # the flight trail is coloured in bands from blue (lowest) to red (highest)
+        self.trail_color = rospy.get_param('trailColor', 'altitude')  # or 'airspeed'
+        self.trail_pens = [QPen(QBrush(QColor.fromHsv(240 - 16 * band, 255, 255)), 2.0, Qt.SolidLine, Qt.RoundCap,
+                                Qt.RoundJoin) for band in range(16)]
+        # what the trail layer last drew: (clears, total, first, low, high) of the trail, see extend_trail
+        self.trail_drawn = None
+        # (clears, total) of the trail as far as trail_state has looked, and the total when a
+        # sample last landed in the window
+        self.trail_seen = (0, 0)
+        self.trail_shown = 0
+
+        self.vehicle_glyphs = {}  # heading in degrees -> QPixmap, see get_vehicle_glyph
+
+        # overlays in z-order; all but the aircraft are cached until the view or their data changes
+        self.layers = LayerStack()
+        self.layers.add(MapLayer('grid', 10, self.draw_grid, lambda: (InitSub.version,)))
+        self.layers.add(MapLayer('crosshair', 20, self.draw_crosshair))
+        self.layers.add(MapLayer('waypoints', 30, self.draw_waypoints, lambda: (WaypointSub.version,),
+                                 lambda: WaypointSub.enabled))
+        self.layers.add(MapLayer('current_path', 40, self.draw_current_path,
+                                 lambda: (ExtendedPathSub.version, PathSub.version),
+                                 lambda: ExtendedPathSub.enabled or PathSub.enabled))
+        self.layers.add(MapLayer('full_path', 50, self.draw_full_path, lambda: (FullPathSub.version,),
+                                 lambda: FullPathSub.enabled))
+        self.layers.add(MapLayer('mission', 60, self.draw_mission, lambda: (MissionSub.version,),
+                                 lambda: MissionSub.enabled))
+        self.layers.add(MapLayer('planned_path', 70, self.draw_planned_path,
+                                 lambda: (PPSub.version, WaypointSub.version), lambda: PPSub.enabled))
+        self.layers.add(MapLayer('trail', 75, self.draw_trail, self.trail_state,
+                                 lambda: StateSub.trail is not None and StateSub.trail.total > 0, extend=self.extend_trail))
+        self.layers.add(MapLayer('aircraft', 80, self.draw_plane,
+                                 lambda: (StateSub.version, RCSub.version, ConComSub.version),
+                                 lambda: StateSub.enabled, dynamic=True))
+        self.layers.add(MapLayer('vehicles', 78, self.draw_vehicles, lambda: (VehicleSub.version,),
+                                 lambda: VehicleSub.heard.any(), dynamic=True))
+        self.layers.add(MapLayer('selection', 85, self.draw_selection,
+                                 lambda: (self.selection_version, WaypointSub.version, MissionSub.version, PPSub.version),
+                                 lambda: len(self.selection) > 0))
+        self.layers.set_visible('grid', False)
+
+        # features that can be picked with the mouse, indexed in world pixels at zoom 0 (about
+        # 120 m cells); each source is (group, label, version, [lat, lon] or obstacle boxes)
+        self.world_projection = ViewProjection.world()
+        self.features = FeatureIndex(2.0**-10)
+        self.feature_sources = [
+            ('waypoints', 'Waypoint', lambda: WaypointSub.version,
+             lambda: [(wp.lat, wp.lon) for wp in WaypointSub.waypoints] if WaypointSub.enabled else []),
+            ('mission_waypoints', 'Mission waypoint', lambda: MissionSub.version, lambda: MissionSub.waypoints),
+            ('obstacles', 'Obstacle', lambda: MissionSub.version, lambda: MissionSub.obstacles),
+            ('path_wps', 'Path point', lambda: PPSub.version, lambda: PPSub.path_wps),
+            ('seaoutput_rawh_wps', 'Search point', lambda: PPSub.version, lambda: PPSub.seaoutput_rawh_wps),
+            ('payload_wps', 'Payload point', lambda: PPSub.version, lambda: PPSub.payload_wps),
+            ('landing_wps', 'Landing point', lambda: PPSub.version, lambda: PPSub.landing_wps)]
+        self.selection = {}  # group -> feature numbers
+        self.selection_version = 0
+        self.press_pos = QPoint(0, 0)
+        self.rubber_band = QRubberBand(QRubberBand.Rectangle, self)
+
+        # what the last paint showed, so refresh() only repaints what changed since
+        self.shown_view = None
+        self.shown_layers = None
+        self.shown_aircraft = None
+        self.poses = None
+        self.pose_region = QRegion()
+
     def show_context_menu(self, point):
         menu = QMenu(self)
+        picked = self.pick(point)
+        if picked is not None:
+            menu.addAction(self.feature_label(picked[0], picked[1])).setEnabled(False)
+            menu.addSeparator()
         waypoint_action = menu.addAction("Add Waypoint")
         replace_action = menu.addAction("Replace all waypoints")
         land_action = menu.addAction("Land here")
         clear_action = menu.addAction("Clear all waypoints")
+        menu.addSeparator()
+        if self.trail_color == 'altitude':
+            trail_color_action = menu.addAction("Color trail by airspeed")
+        else:
+            trail_color_action = menu.addAction("Color trail by altitude")
+        clear_trail_action = menu.addAction("Clear trail")
+        clear_selection_action = menu.addAction("Clear selection") if self.selection else None
         choice = menu.exec_(self.mapToGlobal(point))
         clickX = point.x()
         clickY = point.y()
@@ -71,6 +149,12 @@ class MarbleMap(QWidget):
             self.clear_waypoints()
         elif choice == land_action:
 	    self.add_land_waypoint([n,e,0])
+        elif choice == trail_color_action:
+            self.trail_color = 'airspeed' if self.trail_color == 'altitude' else 'altitude'
+        elif choice == clear_trail_action and StateSub.trail is not None:
+            StateSub.trail.clear()
+        elif choice is not None and choice == clear_selection_action:
+            self.set_selection({})
 
     def add_waypoint(self, n, e, d):
         PPPub.publishWaypointShort(n, e)
@@ -101,12 +185,30 @@ class MarbleMap(QWidget):
         self.zoom = self._gps_dict[self._home_map][1]
         self.GB = Geobase(self.latlon[0], self.latlon[1])
         if self.GMP is None:
-            self.GMP = GoogleMapPlotter(self._gps_dict, self.w_width, self.w_height, self._home_map, self.blankname)
+            # connected before the plotter requests its first tiles
+            self.tile_loader = TileLoader()
+            self.tile_loader.tile_loaded.connect(self.tile_loaded)
+            self.tile_loader.index_loaded.connect(self.index_loaded)
+            self.GMP = GoogleMapPlotter(self._gps_dict, self.w_width, self.w_height, self._home_map, self.blankname,
+                                        rospy.get_param('tileCacheMB', 256) * 1024 * 1024, self.tile_loader)
         else:
             self.GMP.UpdateMap(map_name)
         self.update()
         self.WPH.emit_home_change(self._home_map)
 
+    def tile_loaded(self, key, tile, digest):
+        if self.GMP.tile_loaded(key, tile, digest):
+            self.update()
+
+    def index_loaded(self, key, mz_obj):
+        if self.GMP.index_loaded(key, mz_obj):
+            self.update()
+
+    def map_fetched(self, map_name):
+        # a background fetch finished a map, which may now have more zoom levels and tiles
+        self.GMP.RefreshMap(str(map_name))
+        self.update()
+
     def get_size(self):
         frame_size = self.frameSize()
         self.w_width = frame_size.width()
@@ -117,26 +219,25 @@ class MarbleMap(QWidget):
         self.GMP.UpdateSize(self.w_width, self.w_height)
 
     def wheelEvent(self, QWheelEvent):
-        self.wheel_angle += QWheelEvent.angleDelta().y()
-        if self.wheel_angle >= self.wheel_angle_thresh:
-            self.GMP.UpdateZoom(1)
-            self.wheel_angle = 0
-        if self.wheel_angle <= -self.wheel_angle_thresh:
-            self.GMP.UpdateZoom(-1)
-            self.wheel_angle = 0
+        self.GMP.ScaleZoom(QWheelEvent.angleDelta().y() / 120.0 * self.zoom_per_notch)
+        self.zoom_settle_timer.start()
+        self.update()
+
+    def settle_zoom(self):
+        self.GMP.SettleZoom()
+        self.update()
 
     def mouseMoveEvent(self, QMouseEvent):
         if not self._mouse_attentive:  # we won't do anything with movement in point-and-click mode
-            if QMouseEvent.buttons():  # in act of dragging
-                self.mouse_event_counter += 1
-                if self.mouse_event_counter > self.counter_limit:
-                    qpoint_delta = QMouseEvent.pos() - self.movement_offset
-                    delta_x = self.lon_multiplier * qpoint_delta.x()
-                    lon_incremented = GoogleMapPlotter.pix_to_rel_lon(self.GMP.center.lon, delta_x, self.GMP.zoom)
-                    delta_y = self.lat_multiplier * qpoint_delta.y()
-                    lat_incremented = GoogleMapPlotter.pix_to_rel_lat(self.GMP.center.lat, delta_y, self.GMP.zoom)
-                    self.GMP.UpdateView(lat_incremented, lon_incremented)
-                    self.mouse_event_counter = 0
+            if QMouseEvent.buttons() and self.rubber_band.isVisible():
+                self.rubber_band.setGeometry(QRect(self.press_pos, QMouseEvent.pos()).normalized())
+            elif QMouseEvent.buttons():  # in act of dragging
+                # the map follows the mouse pixel for pixel
+                qpoint_delta = QMouseEvent.pos() - self.movement_offset
+                self.movement_offset = QMouseEvent.pos()
+                if not qpoint_delta.isNull():
+                    self.GMP.PanView(qpoint_delta.x(), qpoint_delta.y())
+                    self.update()
 
     def recenter(self):
         self.GMP.UpdateView(self.latlon[0], self.latlon[1])
@@ -164,58 +265,194 @@ class MarbleMap(QWidget):
             self.deactivateAttentive()
         else:
             self.movement_offset = QMouseEvent.pos()
-            self.setCursor(QCursor(Qt.ClosedHandCursor))
+            self.press_pos = QMouseEvent.pos()
+            if QMouseEvent.modifiers() & Qt.ShiftModifier:
+                # shift-drag selects the features in a box instead of panning
+                self.rubber_band.setGeometry(QRect(self.press_pos, QSize()))
+                self.rubber_band.show()
+            else:
+                self.setCursor(QCursor(Qt.ClosedHandCursor))
 
     def mouseReleaseEvent(self, QMouseEvent):
         if not self._mouse_attentive:
             self.setCursor(QCursor(Qt.OpenHandCursor))
+            if self.rubber_band.isVisible():
+                self.rubber_band.hide()
+                self.select_box(self.rubber_band.geometry())
+            elif QMouseEvent.button() == Qt.LeftButton and QMouseEvent.pos() == self.press_pos:
+                # a click without a drag selects the feature under the mouse, or nothing
+                picked = self.pick(QMouseEvent.pos())
+                self.set_selection({picked[0]: numpy.array([picked[1]])} if picked else {})
 
     def grid_viewer_toggle(self, state_integer):
-        if state_integer == 2:
-            self.draw_gridlines = True
-        else:
-            self.draw_gridlines = False
+        self.layers.set_visible('grid', state_integer == 2)
+        self.update()
 
     def get_mission(self):
         MissionSub.getMission()
 
+    # =====================================================
+    # ================ FEATURE SELECTION ==================
+    # =====================================================
+
+    def update_features(self):
+        # reindexes the feature groups whose source changed, dropping their selection if its
+        # features are no longer the same
+        for name, label, version, points in self.feature_sources:
+            key = version()
+            if self.features.key(name) == key:
+                continue
+            points = numpy.array(points(), dtype=numpy.float64).reshape(-1, 4 if name == 'obstacles' else 2)
+            xs, ys = self.world_projection.project(points[:, 0], points[:, 1])
+            if name == 'obstacles':
+                # [lat_ul, lon_ul, lat_lr, lon_lr] boxes, picked anywhere on the circle drawn in them
+                xs_lr, ys_lr = self.world_projection.project(points[:, 2], points[:, 3])
+                changed = self.features.set_group(name, (xs + xs_lr) / 2, (ys + ys_lr) / 2,
+                                                  numpy.abs(xs_lr - xs) / 2, key)
+            else:
+                changed = self.features.set_group(name, xs, ys, key=key)
+            if changed and self.selection.pop(name, None) is not None:
+                self.selection_version += 1
+
+    def pick(self, point, radius=8):
+        # the feature drawn nearest to a window point, within radius pixels: (group, number) or None
+        self.update_features()
+        projection = self.GMP.projection
+        x, y = projection.to_world(point.x(), point.y())
+        found = self.features.nearest(x, y, radius / projection.world_scale)
+        return found and found[:2]
+
+    def select_box(self, rect):
+        self.update_features()
+        projection = self.GMP.projection
+        left, top = projection.to_world(rect.left(), rect.top())
+        right, bottom = projection.to_world(rect.right() + 1, rect.bottom() + 1)
+        self.set_selection(self.features.box(left, top, right, bottom))
+
+    def set_selection(self, selection):
+        self.selection = selection
+        self.selection_version += 1
+        self.update()
+
+    def feature_label(self, name, number):
+        for group, label, version, points in self.feature_sources:
+            if group == name:
+                return '%s %d' % (label, number + 1)
+
     # =====================================================
     # ==================== FOR DRAWING ====================
     # =====================================================
 
+    def refresh(self):
+        # polled at the frame rate cap: the whole map is repainted only when the view or an
+        # overlay changed, otherwise just the old and new aircraft rects (or nothing)
+        if self.get_view() != self.shown_view or self.layers.state() != self.shown_layers:
+            self.update()
+        elif self.layers.state(dynamic=True) != self.shown_aircraft:
+            poses = self.get_poses()
+            if poses != self.poses:
+                self.update(self.pose_region)
+                self.update(self.get_pose_region(poses))
+            else:
+                self.shown_aircraft = self.layers.state(dynamic=True)
+
     def paintEvent(self, QPaintEvent):
         painter = QPainter()
         painter.begin(self)
         painter.setRenderHint(QPainter.Antialiasing, True)
 
-        upper_left = QPoint(0, 0)
-        painter.drawImage(upper_left, self.GMP.GetImage())
+        rect = QPaintEvent.rect()
+        painter.drawImage(rect, self.GMP.GetImage(), rect)
+
+        # cached overlays are repainted when any of these move the map under them
+        view = self.get_view()
+        self.layers.paint(painter, view, self.size(), rect)
 
-        if self.draw_gridlines:
-            self.draw_grid(painter)
+        painter.end()
+
+        if rect.contains(self.rect()):
+            self.shown_view = view
+            self.shown_layers = self.layers.state()
+        self.shown_aircraft = self.layers.state(dynamic=True)
+        self.poses = self.get_poses()
+        self.pose_region = self.get_pose_region(self.poses)
+
+    def get_view(self):
+        return (self.GMP.west, self.GMP.north, self.GMP.zoom, self.GMP.width, self.GMP.height)
+
+    def get_plane_pose(self):
+        # what draw_plane draws, to a tenth of a pixel or degree; None when nothing is drawn
+        if not StateSub.enabled or not self.layers.layer('aircraft').visible:
+            return None
+        return (round(self.lon_to_pix(StateSub.lon), 1), round(self.lat_to_pix(StateSub.lat), 1),
+                round(degrees(StateSub.chi), 1), RCSub.autopilotEnabled,
+                ConComSub.enabled and round(degrees(ConComSub.chi_c), 1))
+
+    def get_plane_rect(self, pose):
+        if pose is None:
+            return QRect()
+        # the commanded heading line is the longest stroke, plus half the 5 px pen
+        radius = int(max(self.plane_h / 2, self.plane_w)) + 4
+        return QRect(int(pose[0]) - radius, int(pose[1]) - radius, 2 * radius + 1, 2 * radius + 1)
+
+    def get_visible_vehicles(self):
+        # indices of the vehicles on screen, and the screen x and y of every vehicle
+        states = VehicleSub.states
+        xs, ys = self.GMP.projection.from_world(states[:, VehicleSub.X], states[:, VehicleSub.Y])
+        shown = self.visible_indices(xs, ys)
+        return shown[VehicleSub.heard[shown]], xs, ys
+
+    def get_poses(self):
+        # what the aircraft and vehicles layers draw: the aircraft pose, then an (x, y, chi, index)
+        # per vehicle on screen, rounded like get_plane_pose
+        if not self.layers.layer('vehicles').visible:
+            return self.get_plane_pose(), ()
+        shown, xs, ys = self.get_visible_vehicles()
+        chis = numpy.degrees(VehicleSub.states[shown, VehicleSub.CHI])
+        return self.get_plane_pose(), tuple(zip(numpy.round(xs[shown], 1).tolist(), numpy.round(ys[shown], 1).tolist(),
+                                                numpy.round(chis, 1).tolist(), shown.tolist()))
+
+    def get_pose_region(self, poses):
+        region = QRegion(self.get_plane_rect(poses[0]))
+        metrics = self.fontMetrics()
+        for pose in poses[1]:
+            region += self.get_plane_rect(pose)
+            # the label, as draw_vehicles places it
+            label = metrics.boundingRect(QString(VehicleSub.names[pose[3]])).adjusted(-2, -2, 2, 2)
+            region += label.translated(int(pose[0]) + self.plane_w, int(pose[1]))
+        return region
+
+    def draw_selection(self, painter):
+        self.update_features()
+        painter.setPen(QPen(QBrush(Qt.white), 2.5, Qt.SolidLine))
+        projection = self.GMP.projection
+        for name, numbers in self.selection.items():
+            xs, ys, radii = self.features.points(name, numbers)
+            xs, ys = projection.from_world(xs, ys)
+            radii = radii * projection.world_scale + 9
+            for idx in self.visible_indices(xs, ys):
+                painter.drawEllipse(QRectF(xs[idx] - radii[idx], ys[idx] - radii[idx], 2 * radii[idx], 2 * radii[idx]))
+
+    def draw_crosshair(self, painter):
         # Draw center crosshairs (probably temporary until smartzoom feature is implemented)
         painter.setPen(QPen(QBrush(Qt.blue), 2, Qt.SolidLine, Qt.RoundCap))
         painter.drawLine(self.GMP.width / 2, self.GMP.height / 2 - 8, self.GMP.width / 2, self.GMP.height / 2 + 8)
         painter.drawLine(self.GMP.width / 2 - 8, self.GMP.height / 2, self.GMP.width / 2 + 8, self.GMP.height / 2)
-        if WaypointSub.enabled:
-            self.draw_waypoints(painter)
+
+    def draw_current_path(self, painter):
         if ExtendedPathSub.enabled:
             self.draw_extended_path(painter)
         elif PathSub.enabled:
             self.draw_currentpath(painter)
-        if FullPathSub.enabled:
-            self.draw_full_path(painter)
-        if MissionSub.enabled:
-            self.draw_obstacles(painter)
-            self.draw_boundaries(painter)
-            self.draw_mission_waypoints(painter)
-        if PPSub.enabled:
-            self.draw_waypoints(painter)
-            self.draw_path(painter)
-        if StateSub.enabled:
-            self.draw_plane(painter)
 
-        painter.end()
+    def draw_mission(self, painter):
+        self.draw_obstacles(painter)
+        self.draw_boundaries(painter)
+        self.draw_mission_waypoints(painter)
+
+    def draw_planned_path(self, painter):
+        self.draw_waypoints(painter)
+        self.draw_path(painter)
 
     # draws gridlines at 10-meter increments
     def draw_grid(self, painter):
@@ -257,23 +494,22 @@ class MarbleMap(QWidget):
     def draw_waypoints(self, painter):
         painter.setPen(QPen(QBrush(Qt.darkRed), 2.5, Qt.SolidLine, Qt.RoundCap))
         # it can be assumed that all waypoints are converted to latlon if the sub is enabled
-        for waypoint in WaypointSub.waypoints:
-            x = self.lon_to_pix(waypoint.lon)
-            y = self.lat_to_pix(waypoint.lat)
-            if x >= 0 and x <= self.GMP.width and y >= 0 and y <= self.GMP.height:
-                rad = 5
-                painter.drawEllipse(x - rad, y - rad, 2 * rad, 2 * rad)
-                if waypoint.chi_valid:
-                    painter.drawLine(x, y, x + 2 * rad * sin(waypoint.chi_d), y - 2 * rad * cos(waypoint.chi_d))
+        waypoints = WaypointSub.waypoints
+        xs, ys = self.GMP.projection.project([wp.lat for wp in waypoints], [wp.lon for wp in waypoints])
+        rad = 5
+        for idx in self.visible_indices(xs, ys):
+            x, y = xs[idx], ys[idx]
+            painter.drawEllipse(QRectF(x - rad, y - rad, 2 * rad, 2 * rad))
+            if waypoints[idx].chi_valid:
+                chi_d = waypoints[idx].chi_d
+                painter.drawLine(QPointF(x, y), QPointF(x + 2 * rad * sin(chi_d), y - 2 * rad * cos(chi_d)))
 
     def draw_mission_waypoints(self, painter):
         painter.setPen(QPen(QBrush(Qt.green), 3.0, Qt.SolidLine, Qt.RoundCap))
-        for wp in MissionSub.waypoints:
-            x = self.lon_to_pix(wp[1])
-            y = self.lat_to_pix(wp[0])
-            # print x, y
-            if x >= 0 and x <= self.GMP.width and y >= 0 and y <= self.GMP.height:
-                painter.drawEllipse(x - 5, y - 5, 10, 10)
+        xs, ys = self.GMP.projection.project([wp[0] for wp in MissionSub.waypoints],
+                                             [wp[1] for wp in MissionSub.waypoints])
+        for idx in self.visible_indices(xs, ys):
+            painter.drawEllipse(QRectF(xs[idx] - 5, ys[idx] - 5, 10, 10))
         # draw current waypoint
         wp = MissionSub.currentWaypoint
         if len(wp) > 0:
@@ -305,56 +541,28 @@ class MarbleMap(QWidget):
     def draw_path(self, painter):
         # DRAW PATH WAYPOINTS
         if PPSub.path_approved:
-            painter.setPen(QPen(QBrush(Qt.green), 2.0, Qt.SolidLine, Qt.RoundCap))
+            painter.setPen(QPen(QBrush(Qt.green), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
         else:
-            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap))
-        for idx in range(len(PPSub.path_wps) - 1):
-            pt1 = PPSub.path_wps[idx]
-            pt2 = PPSub.path_wps[idx + 1]
-            x1 = self.lon_to_pix(pt1[1])
-            y1 = self.lat_to_pix(pt1[0])
-            x2 = self.lon_to_pix(pt2[1])
-            y2 = self.lat_to_pix(pt2[0])
-            painter.drawLine(x1, y1, x2, y2)
+            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        self.draw_polyline(painter, PPSub.path_wps)
         # DRAW SEARCH WAYPOINTS
         if PPSub.search_approved:
-            painter.setPen(QPen(QBrush(Qt.magenta), 2.0, Qt.SolidLine, Qt.RoundCap))
+            painter.setPen(QPen(QBrush(Qt.magenta), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
         else:
-            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap))
-        for idx in range(len(PPSub.search_wps) - 1):
-            pt1 = PPSub.search_wps[idx]
-            pt2 = PPSub.search_wps[idx + 1]
-            x1 = self.lon_to_pix(pt1[1])
-            y1 = self.lat_to_pix(pt1[0])
-            x2 = self.lon_to_pix(pt2[1])
-            y2 = self.lat_to_pix(pt2[0])
-            painter.drawLine(x1, y1, x2, y2)
+            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        self.draw_polyline(painter, PPSub.search_wps)
         # DRAW PAYLOAD WAYPOINTS
         if PPSub.payload_approved:
-            painter.setPen(QPen(QBrush(Qt.blue), 2.0, Qt.SolidLine, Qt.RoundCap))
+            painter.setPen(QPen(QBrush(Qt.blue), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
         else:
-            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap))
-        for idx in range(len(PPSub.payload_wps) - 1):
-            pt1 = PPSub.payload_wps[idx]
-            pt2 = PPSub.payload_wps[idx + 1]
-            x1 = self.lon_to_pix(pt1[1])
-            y1 = self.lat_to_pix(pt1[0])
-            x2 = self.lon_to_pix(pt2[1])
-            y2 = self.lat_to_pix(pt2[0])
-            painter.drawLine(x1, y1, x2, y2)
+            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        self.draw_polyline(painter, PPSub.payload_wps)
         # DRAW LANDING WAYPOINTS
         if PPSub.landing_approved:
-            painter.setPen(QPen(QBrush(Qt.cyan), 2.0, Qt.SolidLine, Qt.RoundCap))
+            painter.setPen(QPen(QBrush(Qt.cyan), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
         else:
-            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap))
-        for idx in range(len(PPSub.landing_wps) - 1):
-            pt1 = PPSub.landing_wps[idx]
-            pt2 = PPSub.landing_wps[idx + 1]
-            x1 = self.lon_to_pix(pt1[1])
-            y1 = self.lat_to_pix(pt1[0])
-            x2 = self.lon_to_pix(pt2[1])
-            y2 = self.lat_to_pix(pt2[0])
-            painter.drawLine(x1, y1, x2, y2)
+            painter.setPen(QPen(QBrush(Qt.gray), 2.0, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        self.draw_polyline(painter, PPSub.landing_wps)
 
     def draw_obstacles(self, painter):
         painter.setPen(QPen(QBrush(Qt.yellow), 2.5, Qt.SolidLine, Qt.RoundCap))
@@ -367,15 +575,17 @@ class MarbleMap(QWidget):
             painter.drawEllipse(ul_x, ul_y, lr_x - ul_x, lr_y - ul_y)
 
     def draw_boundaries(self, painter):
-        painter.setPen(QPen(QBrush(Qt.yellow), 2.5, Qt.SolidLine, Qt.RoundCap))
-        for idx in range(len(MissionSub.boundaries) - 1):
-            pt1 = MissionSub.boundaries[idx]
-            pt2 = MissionSub.boundaries[idx + 1]
-            x1 = self.lon_to_pix(pt1[1])
-            y1 = self.lat_to_pix(pt1[0])
-            x2 = self.lon_to_pix(pt2[1])
-            y2 = self.lat_to_pix(pt2[0])
-            painter.drawLine(x1, y1, x2, y2)
+        painter.setPen(QPen(QBrush(Qt.yellow), 2.5, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        # the boundary list already ends with its first point
+        self.draw_polyline(painter, MissionSub.boundaries)
+
+    def draw_polyline(self, painter, points):
+        # points are [lat, lon, ...]
+        if len(points) > 1:
+            painter.drawPolyline(self.GMP.projection.polygon([point[:2] for point in points]))
+
+    def visible_indices(self, xs, ys):
+        return numpy.flatnonzero((xs >= 0) & (xs <= self.GMP.width) & (ys >= 0) & (ys <= self.GMP.height))
 
     def draw_currentpath(self, painter):
         painter.setPen(QPen(QBrush(Qt.red), 3.5, Qt.SolidLine, Qt.RoundCap))
@@ -454,6 +664,106 @@ class MarbleMap(QWidget):
                 R_pix = R * 2 ** self.GMP.zoom / (156543.03392 * cos(radians(c[0])))
                 painter.drawArc(pt_c[0] - R_pix, pt_c[1] - R_pix, 2 * R_pix, 2 * R_pix, orbit_start_qt, orbit_span_qt)
 
+    def trail_level(self):
+        # decimating at the next whole zoom keeps the grid at most trail.cell pixels on screen
+        return int(ceil(self.GMP.zoom))
+
+    def trail_near_window(self, trail, numbers):
+        # whether any of the samples is in the window, or within the margin draw_trail keeps around it
+        xs, ys = self.GMP.projection.from_world(trail.field(FlightTrail.X, numbers), trail.field(FlightTrail.Y, numbers))
+        margin = 10
+        return numpy.any((xs >= -margin) & (xs <= self.GMP.width + margin) &
+                         (ys >= -margin) & (ys <= self.GMP.height + margin))
+
+    def trail_state(self):
+        # changes when the trail is cleared or recoloured, or gets samples in the window;
+        # not with samples appended out of sight (the layer is painted again when the view moves)
+        trail = StateSub.trail
+        if trail is None:
+            return (self.trail_color,)
+        with trail.lock:
+            clears, total = self.trail_seen
+            if clears != trail.clears:
+                total = 0
+            if trail.total > total:
+                # the last sample looked at too, for the segment to the first new one
+                if self.trail_near_window(trail, numpy.arange(max(total - 1, trail.first()), trail.total)):
+                    self.trail_shown = trail.total
+            self.trail_seen = (trail.clears, trail.total)
+            return (self.trail_color, trail.clears, self.trail_shown)
+
+    def trail_field(self):
+        # the field the trail is coloured by, and the label format for its range
+        if self.trail_color == 'airspeed':
+            return FlightTrail.VA, 'airspeed %.1f-%.1f m/s'
+        return FlightTrail.ALT, 'altitude %.0f-%.0f m'
+
+    def draw_trail_lines(self, painter, xs, ys, values, low, high, max_step):
+        # polylines through window pixels xs, ys, coloured by where values fall in low-high
+        bands = numpy.minimum((values - low) * len(self.trail_pens) / max(high - low, 1e-9),
+                              len(self.trail_pens) - 1).astype(int)
+        # consecutive points further apart than max_step are not joined
+        joined = numpy.hypot(numpy.diff(xs), numpy.diff(ys)) <= max_step
+        # one polyline per run of joined points in one colour band
+        starts = numpy.flatnonzero((bands[1:] != bands[:-1]) | ~joined) + 1
+        for start, end in zip(numpy.r_[0, starts], numpy.r_[starts, len(bands)]):
+            if end < len(bands) and joined[end - 1]:
+                end += 1    # through the first point of the next band, so the bands meet
+            if end - start > 1:
+                painter.setPen(self.trail_pens[bands[start]])
+                painter.drawPolyline(self.GMP.projection.screen_polygon(xs[start:end], ys[start:end]))
+
+    def draw_trail(self, painter):
+        trail = StateSub.trail
+        self.trail_drawn = None
+        level = self.trail_level()
+        # the samples near the window, in world pixels at level (segments leaving the window are
+        # shorter than the margin)
+        margin = 10
+        scale = 2**(level - self.GMP.zoom)
+        left, top = self.GMP.projection.world_x - margin, self.GMP.projection.world_y - margin
+        with trail.lock:
+            if trail.total == 0:
+                return  # cleared since the layer was found active
+            field, label = self.trail_field()
+            # the colours span the whole trail, so they stay put as parts of it come into view
+            low, high = trail.value_range(field)
+            numbers = trail.decimated(level, left * scale, top * scale, (left + self.GMP.width + 2 * margin) * scale,
+                                      (top + self.GMP.height + 2 * margin) * scale)
+            if len(numbers) >= 2:
+                xs, ys = self.GMP.projection.from_world(trail.field(FlightTrail.X, numbers),
+                                                        trail.field(FlightTrail.Y, numbers))
+                # consecutive points further apart than neighbouring grid cells are not joined
+                # (a gap in the data, or ground that a later lap was drawn over)
+                self.draw_trail_lines(painter, xs, ys, trail.field(field, numbers), low, high,
+                                      3 * trail.cell * 2**(self.GMP.zoom - level))
+            self.trail_drawn = (trail.clears, trail.total, trail.first(), low, high)
+
+        painter.setPen(QPen(Qt.white))
+        painter.drawText(QPoint(self.GMP.width - 200, 15), QString('Trail: ' + label % (low, high)))
+
+    def extend_trail(self, painter, versions):
+        # draws the samples appended since the last draw on top of it, as long as they fit its colour
+        # range; samples that dropped out of the buffer are erased by a full draw now and then
+        trail = StateSub.trail
+        if self.trail_drawn is None or versions[0] != self.trail_color:
+            return False
+        with trail.lock:
+            clears, total, first, low, high = self.trail_drawn
+            if clears != trail.clears or trail.first() - first > trail.capacity // 64:
+                return False
+            numbers = numpy.arange(max(total - 1, trail.first()), trail.total)
+            if len(numbers) >= 2:
+                values = trail.field(self.trail_field()[0], numbers)
+                if values.min() < low or values.max() > high:
+                    return False
+                xs, ys = self.GMP.projection.from_world(trail.field(FlightTrail.X, numbers),
+                                                        trail.field(FlightTrail.Y, numbers))
+                self.draw_trail_lines(painter, xs, ys, values, low, high,
+                                      3 * trail.cell * 2**(self.GMP.zoom - self.trail_level()))
+            self.trail_drawn = (clears, trail.total, first, low, high)
+            return True
+
     def draw_plane(self, painter):
         if RCSub.autopilotEnabled:
             painter.setPen(QPen(QBrush(Qt.red), 5, Qt.SolidLine, Qt.RoundCap))
@@ -500,16 +810,50 @@ class MarbleMap(QWidget):
                 heading_y = y - heading_length * cos(heading_c)
                 painter.drawLine(x, y, heading_x, heading_y)
 
+    def draw_vehicles(self, painter):
+        # the other aircraft: only those on screen are drawn, each a copy of a prerendered glyph
+        shown, xs, ys = self.get_visible_vehicles()
+        chis = numpy.degrees(VehicleSub.states[shown, VehicleSub.CHI])
+        painter.setPen(QPen(Qt.white))
+        for index, x, y, chi in zip(shown.tolist(), xs[shown].tolist(), ys[shown].tolist(), chis.tolist()):
+            rect = self.get_plane_rect((x, y))
+            painter.drawPixmap(rect.topLeft(), self.get_vehicle_glyph(int(round(chi)) % 360))
+            painter.drawText(QPoint(int(x) + self.plane_w, int(y)), QString(VehicleSub.names[index]))
+
+    def get_vehicle_glyph(self, heading):
+        # the strokes of draw_plane in orange, at a whole-degree heading, centered in a
+        # get_plane_rect sized pixmap; drawn once per heading and kept
+        glyph = self.vehicle_glyphs.get(heading)
+        if glyph is None:
+            size = self.get_plane_rect((0, 0)).size()
+            glyph = QPixmap(size)
+            glyph.fill(Qt.transparent)
+            h, w = self.plane_h / 2.0, self.plane_w / 2.0
+            # nose to tail, both wings, the tail; y is down the screen
+            lines = [QLineF(0, -h, 0, h), QLineF(0, 0, -w, h / 2), QLineF(0, 0, w, h / 2),
+                     QLineF(-w / 2, 4 * h / 5, w / 2, 4 * h / 5)]
+            painter = QPainter(glyph)
+            painter.setRenderHint(QPainter.Antialiasing, True)
+            painter.translate(size.width() / 2.0, size.height() / 2.0)
+            painter.rotate(heading)
+            painter.setPen(QPen(QBrush(QColor(255, 140, 0)), 5, Qt.SolidLine, Qt.RoundCap))
+            painter.drawLines(lines)
+            painter.setPen(QPen(QBrush(Qt.black), 2.5, Qt.SolidLine, Qt.RoundCap))
+            painter.drawLines(lines)
+            painter.end()
+            self.vehicle_glyphs[heading] = glyph
+        return glyph
+
     def point_to_pix(self, p):  # p is [lat, lon]
         lat = p[0]
         lon = p[1]
         return self.lon_to_pix(lon), self.lat_to_pix(lon)
 
     def lon_to_pix(self, lon):  # assuming origin at upper left
-        return GoogleMapPlotter.rel_lon_to_rel_pix(self.GMP.west, lon, self.GMP.zoom)
+        return self.GMP.projection.x(lon)
 
     def lat_to_pix(self, lat):  # assuming origin at upper left
-        return GoogleMapPlotter.rel_lat_to_rel_pix(self.GMP.north, lat, self.GMP.zoom)
+        return self.GMP.projection.y(lat)
 
     def rotate_x(self, x, y, a):
         return x * cos(a) + y * sin(a)
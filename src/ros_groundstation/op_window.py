@@ -82,6 +82,8 @@ class OpWindow(QWidget):
         layout.addLayout(pubsub_layout)
 
         layout.addLayout(OpWindow.make_topic_option('Full Path Subscriber', 'fullPath', '/full_path', self.handle_full_path_sub_option))
+        layout.addLayout(OpWindow.make_topic_option('Other Vehicle State Subscribers', 'vehicleState', '',
+                                                    self.handle_vehicle_state_sub_option))
 
         label = 'Waypoint Subscriber'
         checked = rospy.get_param('waypointSubChecked', True)
@@ -283,6 +285,13 @@ class OpWindow(QWidget):
         else:
             FullPathSub.reset()
 
+    def handle_vehicle_state_sub_option(self, checked, topics):
+        # space-separated state topics, one per vehicle
+        if checked and str(topics).split():
+            VehicleSub.updateStateTopics(str(topics).split())
+        else:
+            VehicleSub.reset()
+
     def handle_altitude_spinbox(self):
         altitude = self.waypoint_altitude_spinbox.value()
         PPPub.setDefaultAltitude(altitude)
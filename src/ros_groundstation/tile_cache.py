@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+class TileCache():
+    """
+    LRU cache of decoded tile images, bounded by their size in bytes.
+
+    Keys are (mapname, zoom, i, j). Tiles put with the digest of their data
+    share one image with every other tile of the same content, and its bytes
+    are only counted once. The hit, miss and eviction counters can be read
+    directly or through stats().
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.tiles = OrderedDict()
+        self.digests = {}       # key -> digest, for tiles put with one
+        self.shared = {}        # digest -> [image, number of keys using it]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        tile = self.tiles.pop(key, None)
+        if tile is None:
+            self.misses += 1
+            return None
+        self.tiles[key] = tile  # most recently used goes last
+        self.hits += 1
+        return tile
+
+    def contains(self, key):
+        return key in self.tiles
+
+    def peek(self, key):
+        # lookup that neither counts nor refreshes the entry, for placeholders
+        return self.tiles.get(key)
+
+    def shared_tile(self, digest):
+        # image already decoded from data with this digest, if any
+        entry = self.shared.get(digest)
+        return None if entry is None else entry[0]
+
+    def put(self, key, tile, digest=None):
+        if key in self.tiles:
+            self.release(key)
+        if digest is None:
+            self.bytes += tile.byteCount()
+        elif digest in self.shared:
+            tile = self.shared[digest][0]
+            self.shared[digest][1] += 1
+            self.digests[key] = digest
+        else:
+            self.shared[digest] = [tile, 1]
+            self.digests[key] = digest
+            self.bytes += tile.byteCount()
+        self.tiles[key] = tile
+        self.evict()
+        return tile
+
+    def release(self, key):
+        tile = self.tiles.pop(key)
+        digest = self.digests.pop(key, None)
+        if digest is None:
+            self.bytes -= tile.byteCount()
+        else:
+            self.shared[digest][1] -= 1
+            if self.shared[digest][1] == 0:
+                del self.shared[digest]
+                self.bytes -= tile.byteCount()
+
+    def evict(self):
+        while self.bytes > self.max_bytes and len(self.tiles) > 1:
+            self.release(next(iter(self.tiles)))
+            self.evictions += 1
+
+    def remove_map(self, mapname):
+        # drops the tiles of one map, e.g. after it was fetched again and its tiles moved
+        for key in [key for key in self.tiles if key[0] == mapname]:
+            self.release(key)
+
+    def clear(self):
+        self.tiles.clear()
+        self.digests.clear()
+        self.shared.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'tiles': len(self.tiles), 'images': len(self.tiles) - len(self.digests) + len(self.shared),
+                'bytes': self.bytes, 'max_bytes': self.max_bytes}
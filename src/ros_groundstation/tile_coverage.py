@@ -0,0 +1,135 @@
+import math
+from tile_providers import lon_to_world, lat_to_world
+from coordinates import parse_latlon
+
+def point_segment_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+def segments_cross(ax, ay, bx, by, cx, cy, dx, dy):
+    def side(px, py, qx, qy, rx, ry):
+        return (qx - px) * (ry - py) - (qy - py) * (rx - px)
+    return side(ax, ay, bx, by, cx, cy) * side(ax, ay, bx, by, dx, dy) < 0 and \
+        side(cx, cy, dx, dy, ax, ay) * side(cx, cy, dx, dy, bx, by) < 0
+
+def rect_segment_distance(left, top, right, bottom, ax, ay, bx, by):
+    # 0 if the segment touches the rectangle
+    if left <= ax <= right and top <= ay <= bottom or left <= bx <= right and top <= by <= bottom:
+        return 0.0
+    corners = ((left, top), (right, top), (right, bottom), (left, bottom))
+    for k in range(4):
+        if segments_cross(ax, ay, bx, by, corners[k][0], corners[k][1], corners[k-1][0], corners[k-1][1]):
+            return 0.0
+    distance = min(point_segment_distance(x, y, ax, ay, bx, by) for x, y in corners)
+    for x, y in ((ax, ay), (bx, by)):
+        distance = min(distance, math.hypot(max(left - x, 0, x - right), max(top - y, 0, y - bottom)))
+    return distance
+
+class CoverageShape():
+    """
+    Area a map has to cover: a mission boundary polygon, or a corridor along
+    a path, grown by buffer_m meters on every side.
+
+    In map_info.xml, a map may hold one of
+        <boundary buffer_m="100">lat,lon lat,lon lat,lon ...</boundary>
+        <corridor width_m="300">lat,lon lat,lon ...</corridor>
+    in place of radius_m. A corridor's buffer is half its width.
+    """
+    def __init__(self, points, closed, buffer_m):
+        self.points = points        # [(lat, lon), ...]
+        self.closed = closed        # polygon if True, path if False
+        self.buffer_m = buffer_m
+
+    @staticmethod
+    def from_xml(xmlnode):
+        # the shape in a <map> entry of map_info.xml, or None
+        boundary = xmlnode.find('boundary')
+        corridor = xmlnode.find('corridor')
+        if boundary is not None:
+            return CoverageShape(CoverageShape.parse_points(boundary.text), True,
+                                 float(boundary.attrib.get('buffer_m', 0)))
+        if corridor is not None:
+            return CoverageShape(CoverageShape.parse_points(corridor.text), False,
+                                 float(corridor.attrib['width_m']) / 2.0)
+        return None
+
+    @staticmethod
+    def parse_points(text):
+        # lat,lon pairs, in decimal degrees or as in N40-14-51.2,W111-39-00
+        return [parse_latlon(item) for item in text.split()]
+
+    def spec(self):
+        # canonical text, for telling whether a map's shape changed
+        return '%s %f %s' % ('boundary' if self.closed else 'corridor', self.buffer_m,
+                             ' '.join('%f,%f' % point for point in self.points))
+
+    def center(self):
+        lats = [lat for lat, lon in self.points]
+        lons = [lon for lat, lon in self.points]
+        return (min(lats) + max(lats)) / 2.0, (min(lons) + max(lons)) / 2.0
+
+    def world_segments(self, zoom):
+        # shape edges in world pixels at zoom
+        points = [(lon_to_world(lon, zoom), lat_to_world(lat, zoom)) for lat, lon in self.points]
+        if self.closed:
+            return [(points[k-1], points[k]) for k in range(len(points))]
+        return [(points[k], points[k+1]) for k in range(len(points) - 1)] or [(points[0], points[0])]
+
+    def buffer_pixels(self, zoom):
+        # the buffer in world pixels, measured at the latitude where a meter is longest
+        max_lat = max(abs(lat) for lat, lon in self.points)
+        return self.buffer_m * 2**zoom / (156543.03392 * math.cos(math.radians(max_lat)))
+
+def contains_point(segments, x, y):
+    # even-odd rule over the polygon edges
+    inside = False
+    for (ax, ay), (bx, by) in segments:
+        if (ay > y) != (by > y) and x < ax + (y - ay) * (bx - ax) / (by - ay):
+            inside = not inside
+    return inside
+
+def covered_tiles(shape, provider, anchor_lat, anchor_lon, zoom):
+    """
+    Lattice positions (kx, ky) of every tile whose visible area meets the
+    buffered shape at zoom. The lattice is split as a quadtree: blocks that
+    miss the shape are dropped and blocks inside the polygon are taken whole,
+    so only blocks on the boundary are refined down to single tiles.
+    """
+    segments = shape.world_segments(zoom)
+    buffer_px = shape.buffer_pixels(zoom)
+    dx, dy = provider.col_spacing, provider.row_spacing
+    # upper left corner of the visible area of tile 0, 0
+    x0 = lon_to_world(anchor_lon, zoom) - provider.tile_size / 2.0
+    y0 = lat_to_world(anchor_lat, zoom) - provider.tile_size / 2.0
+
+    xs = [x for segment in segments for x, y in segment]
+    ys = [y for segment in segments for x, y in segment]
+    min_kx = int(math.floor((min(xs) - buffer_px - x0) / dx))
+    max_kx = int(math.floor((max(xs) + buffer_px - x0) / dx))
+    min_ky = int(math.floor((min(ys) - buffer_px - y0) / dy))
+    max_ky = int(math.floor((max(ys) + buffer_px - y0) / dy))
+
+    tiles = set()
+    blocks = [(min_kx, max_kx, min_ky, max_ky)]
+    while blocks:
+        kx0, kx1, ky0, ky1 = blocks.pop()
+        left, top = x0 + kx0 * dx, y0 + ky0 * dy
+        right, bottom = x0 + (kx1 + 1) * dx, y0 + (ky1 + 1) * dy
+        edge_distance = min(rect_segment_distance(left, top, right, bottom, ax, ay, bx, by)
+                            for (ax, ay), (bx, by) in segments)
+        inside = shape.closed and contains_point(segments, (left + right) / 2.0, (top + bottom) / 2.0)
+        if edge_distance > buffer_px and not inside:
+            continue
+        if inside and edge_distance > 0 or kx0 == kx1 and ky0 == ky1:
+            for kx in range(kx0, kx1 + 1):
+                for ky in range(ky0, ky1 + 1):
+                    tiles.add((kx, ky))
+            continue
+        mid_kx, mid_ky = (kx0 + kx1) // 2, (ky0 + ky1) // 2
+        for block in ((kx0, mid_kx, ky0, mid_ky), (mid_kx + 1, kx1, ky0, mid_ky),
+                      (kx0, mid_kx, mid_ky + 1, ky1), (mid_kx + 1, kx1, mid_ky + 1, ky1)):
+            if block[0] <= block[1] and block[2] <= block[3]:
+                blocks.append(block)
+    return tiles
@@ -0,0 +1,110 @@
+import threading, time, urllib2, Queue
+
+class TokenBucket():
+    """
+    Thread-safe token bucket shared by all download workers.
+
+    Tokens refill continuously at `rate` per second, up to `capacity`. Every
+    request takes one token, so the combined request rate of all workers
+    never exceeds `rate`, no matter how many workers there are.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class TileJob():
+    def __init__(self, i, j, lat, lon, zoom, url, kx=0, ky=0):
+        self.i = i
+        self.j = j
+        self.lat = lat
+        self.lon = lon
+        self.zoom = zoom
+        self.url = url
+        self.kx = kx            # lattice position, for callers that track one
+        self.ky = ky
+
+class TileDownloader():
+    """
+    Downloads tiles with a pool of worker threads.
+
+    Workers only do network I/O. Results are handed back to the thread that
+    called download(), so callers can save and paint tiles without locking.
+    """
+    def __init__(self, rate, num_workers=4, timeout=10.0, retries=3):
+        # rate None downloads as fast as the workers go (local servers and files)
+        self.bucket = None if rate is None else TokenBucket(rate)
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.retries = retries
+
+    def fetch(self, url):
+        for attempt in range(self.retries):
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                response = urllib2.urlopen(url, timeout=self.timeout)
+                if response.info().gettype().startswith('text/'):
+                    # an error page (quota, bad key) rather than an image
+                    continue
+                return response.read()
+            except (urllib2.URLError, IOError):
+                continue
+        return None
+
+    def _work(self, jobs, results, stop):
+        while not stop.is_set():
+            try:
+                job = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            results.put((job, self.fetch(job.url)))
+
+    def download(self, jobs, callback):
+        """
+        Fetches every job and calls callback(job, data) once per job, on the
+        calling thread, in completion order. data is None if every retry
+        failed. Returns the list of failed jobs.
+        """
+        job_queue = Queue.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        results = Queue.Queue()
+        stop = threading.Event()
+        workers = []
+        for n in range(min(self.num_workers, len(jobs))):
+            worker = threading.Thread(target=self._work, args=(job_queue, results, stop))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        failed = []
+        try:
+            for n in range(len(jobs)):
+                # a timeout keeps the main thread responsive to Ctrl-C
+                while True:
+                    try:
+                        job, data = results.get(timeout=0.5)
+                        break
+                    except Queue.Empty:
+                        continue
+                if data is None:
+                    failed.append(job)
+                callback(job, data)
+        finally:
+            stop.set()
+        return failed
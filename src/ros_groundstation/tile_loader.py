@@ -0,0 +1,119 @@
+import threading
+from collections import deque, OrderedDict
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage
+from tile_store import digest as data_digest
+
+_DECODED_MEMO = 8   # recently decoded tiles kept by digest, so runs of identical tiles decode once
+
+class TileLoader(QObject):
+    """
+    Reads and decodes tiles on a worker thread.
+
+    Finished tiles are emitted through tile_loaded(key, image, digest), which
+    Qt delivers on the GUI thread. The image is null (and the digest None) if
+    the store has no such tile, or it could not be read. Requests for visible tiles jump ahead of prefetch requests, and
+    prefetch requests that are no longer useful can be dropped with
+    clear_prefetch().
+
+    Tile indexes (see MapZoomObj) are built here too, ahead of any tile, and
+    emitted through index_loaded(key, index), with None for an index that
+    could not be built. Errors are printed, and the worker goes on.
+    """
+    tile_loaded = pyqtSignal(object, object, object)
+    index_loaded = pyqtSignal(object, object)
+
+    def __init__(self):
+        super(TileLoader, self).__init__()
+        self.requests = deque()
+        self.prefetch = deque()
+        self.indexes = deque()
+        self.pending = set()
+        self.condition = threading.Condition()
+        self.decoded = OrderedDict()    # digest -> image, only touched by the worker
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, key, store, prefetch=False):
+        # key is (mapname, zoom, i, j)
+        with self.condition:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+            if prefetch:
+                self.prefetch.append((key, store))
+            else:
+                self.requests.append((key, store))
+            self.condition.notify()
+
+    def request_index(self, key, build):
+        # key is (mapname, zoom); build() returns the index, and is called on the worker thread
+        with self.condition:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+            self.indexes.append((key, build))
+            self.condition.notify()
+
+    def clear_prefetch(self):
+        with self.condition:
+            for key, store in self.prefetch:
+                self.pending.discard(key)
+            self.prefetch.clear()
+
+    def clear(self):
+        with self.condition:
+            self.requests.clear()
+            self.prefetch.clear()
+            self.indexes.clear()
+            self.pending.clear()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.requests and not self.prefetch and not self.indexes:
+                    self.condition.wait()
+                if self.indexes:
+                    key, build = self.indexes.popleft()
+                    store = None
+                elif self.requests:
+                    key, store = self.requests.popleft()
+                else:
+                    key, store = self.prefetch.popleft()
+            if store is None:
+                try:
+                    index = build()
+                except Exception as error:
+                    # e.g. the store locked by a fetch; the plotter takes None as a zoom not cached
+                    print 'Could not load the tile index of %s at zoom %d: %s' % (key[0], key[1], error)
+                    index = None
+                with self.condition:
+                    self.pending.discard(key)
+                self.index_loaded.emit(key, index)
+                continue
+            try:
+                tile, digest = self.load(key, store)
+            except Exception as error:
+                # a null tile, which the plotter marks absent
+                print 'Could not load tile %s: %s' % (key, error)
+                tile, digest = QImage(), None
+            with self.condition:
+                self.pending.discard(key)
+            self.tile_loaded.emit(key, tile, digest)
+
+    def load(self, key, store):
+        # the decoded tile and its digest, a null image if the store has none
+        digest = store.digest(key[1], key[2], key[3])
+        tile = self.decoded.pop(digest, None)
+        if tile is None:
+            tile = QImage()
+            data = store.get(key[1], key[2], key[3])
+            if data is not None:
+                digest = digest or data_digest(data)
+                tile.loadFromData(data)
+        if digest is not None and not tile.isNull():
+            self.decoded[digest] = tile
+            while len(self.decoded) > _DECODED_MEMO:
+                self.decoded.popitem(last=False)
+        return tile, digest
@@ -0,0 +1,137 @@
+import os, hashlib
+
+class TileRecord():
+    def __init__(self, zoom, kx, ky, i, j, lat, lon, size, digest):
+        self.zoom = zoom
+        self.kx = kx            # lattice column, relative to the zoom's anchor tile
+        self.ky = ky            # lattice row, relative to the zoom's anchor tile (down-positive)
+        self.i = i              # position in the current grid, as stored in the tile store
+        self.j = j
+        self.lat = lat          # tile center
+        self.lon = lon
+        self.size = size        # bytes stored
+        self.digest = digest    # sha1 of the tile data
+
+    def line(self):
+        return 'tile %d %d %d %d %d %f %f %d %s\n' % (self.zoom, self.kx, self.ky, self.i, self.j,
+                                                      self.lat, self.lon, self.size, self.digest)
+
+class TileManifest():
+    """
+    Append-only record of every tile stored for one map.
+
+    Each zoom level has an anchor (the center of the tile at lattice position
+    0, 0). Every tile ever fetched for that zoom sits on the lattice spanned by
+    the anchor, so a changed radius or center only needs the tiles that are
+    not in the manifest yet. Lines are flushed as tiles are saved, so an
+    interrupted download resumes from the last saved tile.
+
+    The provider line records the <tiles> entry the tiles came from (empty
+    for Google, the default for manifests written before providers existed).
+
+    Line formats (later lines win):
+        provider [<spec>]
+        anchor <zoom> <lat> <lon>
+        tile <zoom> <kx> <ky> <i> <j> <lat> <lon> <size> <sha1>
+        drop <zoom> <kx> <ky>
+        forget <zoom>
+    """
+    FILENAME = '_manifest.txt'
+
+    def __init__(self, folder_path):
+        self.path = os.path.join(folder_path, TileManifest.FILENAME)
+        self.provider = ''
+        self.anchors = {}
+        self.tiles = {}
+        self.logfile = None
+        self.load()
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as manifest_file:
+            for line in manifest_file:
+                items = line.split()
+                try:
+                    if items[0] == 'provider':
+                        self.provider = line.strip()[len('provider'):].strip()
+                    elif items[0] == 'anchor':
+                        self.anchors[int(items[1])] = (float(items[2]), float(items[3]))
+                    elif items[0] == 'tile':
+                        record = TileRecord(int(items[1]), int(items[2]), int(items[3]), int(items[4]),
+                                            int(items[5]), float(items[6]), float(items[7]), int(items[8]),
+                                            items[9])
+                        self.tiles[(record.zoom, record.kx, record.ky)] = record
+                    elif items[0] == 'drop':
+                        self.tiles.pop((int(items[1]), int(items[2]), int(items[3])), None)
+                    elif items[0] == 'forget':
+                        self.clear_zoom(int(items[1]))
+                except (IndexError, ValueError):
+                    # a line cut short by an interrupted run
+                    continue
+
+    def write(self, line):
+        if self.logfile is None:
+            self.logfile = open(self.path, 'a')
+        self.logfile.write(line)
+        self.logfile.flush()
+
+    def set_provider(self, spec):
+        self.provider = spec
+        self.write('provider %s\n' % spec)
+
+    def anchor(self, zoom):
+        return self.anchors.get(zoom)
+
+    def set_anchor(self, zoom, lat, lon):
+        self.anchors[zoom] = (lat, lon)
+        self.write('anchor %d %f %f\n' % (zoom, lat, lon))
+        return self.anchors[zoom]
+
+    def get(self, zoom, kx, ky):
+        return self.tiles.get((zoom, kx, ky))
+
+    def records(self, zoom):
+        return [record for key, record in self.tiles.items() if key[0] == zoom]
+
+    def add(self, record):
+        self.tiles[(record.zoom, record.kx, record.ky)] = record
+        self.write(record.line())
+
+    def drop(self, record):
+        self.tiles.pop((record.zoom, record.kx, record.ky), None)
+        self.write('drop %d %d %d\n' % (record.zoom, record.kx, record.ky))
+
+    def clear_zoom(self, zoom):
+        self.anchors.pop(zoom, None)
+        for key in [key for key in self.tiles if key[0] == zoom]:
+            del self.tiles[key]
+
+    def forget(self, zoom):
+        # the zoom is no longer downloaded (e.g. it is built locally instead)
+        self.clear_zoom(zoom)
+        self.write('forget %d\n' % zoom)
+
+    def verify(self, record, store):
+        # checks that the tile store still holds the tile the record describes
+        return store.size(record.zoom, record.i, record.j) == record.size
+
+    def compact(self):
+        self.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            manifest_file.write('provider %s\n' % self.provider)
+            for zoom in sorted(self.anchors):
+                manifest_file.write('anchor %d %f %f\n' % (zoom, self.anchors[zoom][0], self.anchors[zoom][1]))
+            for key in sorted(self.tiles):
+                manifest_file.write(self.tiles[key].line())
+        os.rename(tmp_path, self.path)
+
+    def close(self):
+        if self.logfile is not None:
+            self.logfile.close()
+            self.logfile = None
@@ -0,0 +1,123 @@
+import math, urllib, urlparse
+from map_info_parser import get_key
+
+_EARTHPIX = 268435456  # Number of pixels in half the earth's circumference at zoom = 21
+_pixrad = _EARTHPIX / math.pi
+
+def lon_to_world(lon, zoom): # pixels east of the antimeridian at zoom
+    return (_EARTHPIX + math.radians(lon) * _pixrad) / 2**(21-zoom)
+
+def lat_to_world(lat, zoom): # pixels south of the top of the map at zoom
+    sinlat = math.sin(math.radians(lat))
+    return (_EARTHPIX - _pixrad * math.log((1 + sinlat)/(1 - sinlat)) / 2.0) / 2**(21-zoom)
+
+def world_to_lon(x, zoom):
+    return math.degrees((x * 2**(21-zoom) - _EARTHPIX) / _pixrad)
+
+def world_to_lat(y, zoom):
+    return math.degrees(math.pi/2 - 2 * math.atan(math.exp((y * 2**(21-zoom) - _EARTHPIX) / _pixrad)))
+
+class TileProvider():
+    """
+    Where the tiles of a map come from, and how they are laid out.
+
+    Tile images are tile_size pixels square and sit on a lattice that is
+    regular in world pixels, col_spacing apart in x and row_spacing apart in
+    y. Rows may overlap: the strip of an image below row_spacing is only shown
+    on the bottom row of a map. Lattice positions (kx, ky) count tiles from an
+    anchor tile, whose center anchor() picks for each zoom.
+    """
+    tile_size = 256
+    col_spacing = 256
+    row_spacing = 256
+    rate = None             # requests per second, or None for no limit
+
+    def __init__(self, spec=''):
+        self.spec = spec    # the <tiles> entry of map_info.xml this came from
+
+    def anchor(self, lat, lon, zoom):
+        raise NotImplementedError
+
+    def lattice_offset(self, anchor_lat, anchor_lon, lat, lon, zoom):
+        # lattice position of the tile centered nearest to lat, lon
+        kx = int(round((lon_to_world(lon, zoom) - lon_to_world(anchor_lon, zoom)) / self.col_spacing))
+        ky = int(round((lat_to_world(lat, zoom) - lat_to_world(anchor_lat, zoom)) / self.row_spacing))
+        return kx, ky
+
+    def tile_center(self, anchor_lat, anchor_lon, kx, ky, zoom):
+        lat = world_to_lat(lat_to_world(anchor_lat, zoom) + ky * self.row_spacing, zoom)
+        lon = world_to_lon(lon_to_world(anchor_lon, zoom) + kx * self.col_spacing, zoom)
+        return lat, lon
+
+    def tile_counts(self, lat, radius_m, zoom):
+        # columns and rows needed to cover radius_m around a point at lat
+        # (the conversion formula comes from an employee at google:
+        # https://groups.google.com/forum/#!topic/google-maps-js-api-v3/hDRO4oHVSeM)
+        pixels_per_meter = 2**zoom / (156543.03392 * math.cos(math.radians(lat)))
+        return int(round(2.0 * pixels_per_meter * radius_m / self.col_spacing)), \
+            int(round(2.0 * pixels_per_meter * radius_m / self.row_spacing))
+
+    def url(self, kx, ky, zoom, lat, lon):
+        raise NotImplementedError
+
+    def directory(self):
+        # (root, extension) of a <root>/<z>/<x>/<y>.<extension> tree that can be read in place
+        return None
+
+class GoogleStaticProvider(TileProvider):
+    """
+    Google Static Maps satellite images, centered on the requested point, with
+    the Google logo in the bottom 25 px. The lattice is anchored on the map
+    center the first time a zoom is fetched.
+    """
+    tile_size = 640         # Larget tile dimension you can grab without paying
+    col_spacing = 640
+    row_spacing = 615       # Effective height to cut off Google logo
+    rate = 4                # Fastest rate at which we can download tiles without paying
+
+    def anchor(self, lat, lon, zoom):
+        return lat, lon
+
+    def url(self, kx, ky, zoom, lat, lon):
+        urlbase = 'https://maps.googleapis.com/maps/api/staticmap?center=%f,%f&zoom=%d&maptype=%s&size=%dx%d&format=jpg'
+        if get_key():
+            urlbase += '&key=' + get_key()
+        return urlbase % (lat, lon, zoom, 'satellite', self.tile_size, self.tile_size)
+
+class XYZProvider(TileProvider):
+    """
+    Standard 256 px slippy map tiles from a URL template with {z}, {x} and {y},
+    such as http://localhost:8080/{z}/{x}/{y}.png for a local tile server or
+    file:///data/tiles/{z}/{x}/{y}.jpg for tiles staged on disk. Lattice
+    positions are the x, y tile numbers themselves.
+    """
+    def __init__(self, spec, rate=None):
+        TileProvider.__init__(self, spec)
+        self.rate = rate
+
+    def anchor(self, lat, lon, zoom):
+        # center of tile 0, 0
+        return world_to_lat(self.tile_size / 2.0, zoom), world_to_lon(self.tile_size / 2.0, zoom)
+
+    def url(self, kx, ky, zoom, lat, lon):
+        return self.spec.format(z=zoom, x=kx, y=ky)
+
+    def directory(self):
+        parts = urlparse.urlparse(self.spec)
+        suffix = '/{z}/{x}/{y}'
+        if parts.scheme != 'file' or not suffix in parts.path:
+            return None
+        root, extension = parts.path.split(suffix, 1)
+        return urllib.unquote(root), extension.lstrip('.')
+
+def get_provider(spec=None, rate=None):
+    """
+    Provider for the <tiles> entry of a map in map_info.xml: empty or 'google'
+    for Google Static Maps, otherwise an XYZ URL template. rate limits
+    requests to an XYZ server (files are never limited).
+    """
+    if not spec or spec == 'google':
+        return GoogleStaticProvider('')
+    if spec.startswith('file:'):
+        rate = None
+    return XYZProvider(spec, rate)
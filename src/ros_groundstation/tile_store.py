@@ -0,0 +1,371 @@
+import math, os, shutil, sqlite3, threading, hashlib
+
+_MAPS_CACHE_PATH = os.path.expanduser('~/.local/share/mapscache')
+_STORE_FILENAME = 'tiles.db'
+
+def digest(data):
+    # content hash tiles are shared by, the same sha1 the manifest records
+    return hashlib.sha1(data).hexdigest()
+
+class TileStore():
+    """
+    Storage interface for the tiles of one map.
+
+    Tiles are addressed by (zoom, i, j), where i counts columns from the west
+    edge and j counts rows from the north edge, and carry the lat/lon of their
+    center (what info.txt used to hold).
+    """
+    def zooms(self):
+        raise NotImplementedError
+
+    def read_info(self, zoom):
+        # list of (i, j, lat, lon) for every stored tile
+        raise NotImplementedError
+
+    def lattice(self, zoom):
+        # (x0, y0, [(i, j), ...]) for stores that know the exact world pixel position
+        # (x0, y0) of the image of tile 0, 0; None if it has to be found from read_info
+        return None
+
+    def get(self, zoom, i, j):
+        raise NotImplementedError
+
+    def digest(self, zoom, i, j):
+        # content hash of a tile without reading it, for stores that keep one
+        return None
+
+    def get_region(self, zoom, min_i, max_i, min_j, max_j):
+        # bulk read: {(i, j): data} for every stored tile in the inclusive range
+        tiles = {}
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                data = self.get(zoom, i, j)
+                if data is not None:
+                    tiles[(i, j)] = data
+        return tiles
+
+    def size(self, zoom, i, j):
+        data = self.get(zoom, i, j)
+        return None if data is None else len(data)
+
+    def put(self, zoom, i, j, lat, lon, data):
+        raise NotImplementedError
+
+    def remove(self, zoom, i, j):
+        raise NotImplementedError
+
+    def remove_zoom(self, zoom):
+        for i, j, lat, lon in self.read_info(zoom):
+            self.remove(zoom, i, j)
+
+    def move(self, zoom, moves):
+        # moves is a list of ((i, j), (new_i, new_j)); targets may be sources of other moves
+        raise NotImplementedError
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+class SQLiteTileStore(TileStore):
+    """
+    All tiles of a map packed into a single SQLite file, indexed by (zoom, i, j).
+
+    Tile data is stored once per distinct content (blobs, keyed by sha1), so
+    the identical tiles of water, desert and other blank areas share one
+    copy. Blobs left without tiles are pruned when the store is closed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        # the connection may be shared with a tile loading thread
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.text_factory = str
+        self.lock = threading.RLock()
+        self.dirty = False
+        with self.lock:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS tiles (zoom INTEGER, i INTEGER, j INTEGER, '
+                              'lat REAL, lon REAL, hash TEXT, PRIMARY KEY (zoom, i, j))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB)')
+            self.conn.commit()
+
+    def zooms(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute('SELECT DISTINCT zoom FROM tiles ORDER BY zoom')]
+
+    def read_info(self, zoom):
+        with self.lock:
+            return list(self.conn.execute('SELECT i, j, lat, lon FROM tiles WHERE zoom = ?', (zoom,)))
+
+    def get(self, zoom, i, j):
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM tiles JOIN blobs USING (hash) WHERE zoom = ? AND i = ? AND j = ?',
+                                    (zoom, i, j)).fetchone()
+        return None if row is None else str(row[0])
+
+    def digest(self, zoom, i, j):
+        with self.lock:
+            row = self.conn.execute('SELECT hash FROM tiles WHERE zoom = ? AND i = ? AND j = ?',
+                                    (zoom, i, j)).fetchone()
+        return None if row is None else row[0]
+
+    def get_region(self, zoom, min_i, max_i, min_j, max_j):
+        with self.lock:
+            rows = self.conn.execute('SELECT i, j, data FROM tiles JOIN blobs USING (hash) WHERE zoom = ? '
+                                     'AND i BETWEEN ? AND ? AND j BETWEEN ? AND ?',
+                                     (zoom, min_i, max_i, min_j, max_j)).fetchall()
+        return dict(((i, j), str(data)) for i, j, data in rows)
+
+    def size(self, zoom, i, j):
+        with self.lock:
+            row = self.conn.execute('SELECT length(data) FROM tiles JOIN blobs USING (hash) '
+                                    'WHERE zoom = ? AND i = ? AND j = ?', (zoom, i, j)).fetchone()
+        return None if row is None else row[0]
+
+    def count(self):
+        # (tiles, distinct blobs)
+        with self.lock:
+            return (self.conn.execute('SELECT COUNT(*) FROM tiles').fetchone()[0],
+                    self.conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0])
+
+    def put(self, zoom, i, j, lat, lon, data):
+        tile_hash = digest(data)
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?)', (tile_hash, sqlite3.Binary(data)))
+            self.conn.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)',
+                              (zoom, i, j, lat, lon, tile_hash))
+            self.dirty = True
+
+    def remove(self, zoom, i, j):
+        with self.lock:
+            self.conn.execute('DELETE FROM tiles WHERE zoom = ? AND i = ? AND j = ?', (zoom, i, j))
+            self.dirty = True
+
+    def remove_zoom(self, zoom):
+        with self.lock:
+            self.conn.execute('DELETE FROM tiles WHERE zoom = ?', (zoom,))
+            self.dirty = True
+
+    def prune(self):
+        # drops blobs no tile refers to any more
+        with self.lock:
+            self.conn.execute('DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM tiles)')
+            self.conn.commit()
+            self.dirty = False
+
+    def move(self, zoom, moves):
+        with self.lock:
+            rows = []
+            for (i, j), (new_i, new_j) in moves:
+                row = self.conn.execute('SELECT lat, lon, hash FROM tiles WHERE zoom = ? AND i = ? AND j = ?',
+                                        (zoom, i, j)).fetchone()
+                self.conn.execute('DELETE FROM tiles WHERE zoom = ? AND i = ? AND j = ?', (zoom, i, j))
+                rows.append((zoom, new_i, new_j) + tuple(row))
+            self.conn.executemany('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.dirty:
+                self.prune()
+            self.conn.close()
+
+class DirectoryTileStore(TileStore):
+    """
+    The original cache layout: <map>/<zoom>/i_j.jpg plus an info.txt per zoom.
+    """
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.info = {}
+
+    def tile_path(self, zoom, i, j):
+        return os.path.join(self.folder_path, str(zoom), '%d_%d.jpg' % (i, j))
+
+    def zooms(self):
+        if not os.path.isdir(self.folder_path):
+            return []
+        # zooms with at least one tile in their info.txt
+        return sorted(int(name) for name in os.listdir(self.folder_path) if name.isdigit() and
+                      self.load_info(int(name)))
+
+    def load_info(self, zoom):
+        if not zoom in self.info:
+            self.info[zoom] = {}
+            info_path = os.path.join(self.folder_path, str(zoom), 'info.txt')
+            if os.path.isfile(info_path):
+                with open(info_path, 'r') as info_file:
+                    for line in info_file:
+                        items = line.split(' ')
+                        if len(items) >= 4:
+                            self.info[zoom][(int(items[0]), int(items[1]))] = (float(items[2]), float(items[3].strip()))
+        return self.info[zoom]
+
+    def read_info(self, zoom):
+        return [(i, j, lat, lon) for (i, j), (lat, lon) in self.load_info(zoom).items()]
+
+    def get(self, zoom, i, j):
+        filename = self.tile_path(zoom, i, j)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as tile_file:
+            return tile_file.read()
+
+    def size(self, zoom, i, j):
+        filename = self.tile_path(zoom, i, j)
+        return os.path.getsize(filename) if os.path.isfile(filename) else None
+
+    def put(self, zoom, i, j, lat, lon, data):
+        if not os.path.isdir(os.path.join(self.folder_path, str(zoom))):
+            os.makedirs(os.path.join(self.folder_path, str(zoom)))
+        with open(self.tile_path(zoom, i, j), 'wb') as tile_file:
+            tile_file.write(data)
+        self.load_info(zoom)[(i, j)] = (lat, lon)
+
+    def remove(self, zoom, i, j):
+        if os.path.isfile(self.tile_path(zoom, i, j)):
+            os.remove(self.tile_path(zoom, i, j))
+        self.load_info(zoom).pop((i, j), None)
+
+    def move(self, zoom, moves):
+        info = self.load_info(zoom)
+        # two passes through temporary names, so renames never collide
+        staged = []
+        for (i, j), (new_i, new_j) in moves:
+            tmp_path = self.tile_path(zoom, i, j) + '.move'
+            os.rename(self.tile_path(zoom, i, j), tmp_path)
+            staged.append((tmp_path, (new_i, new_j), info.pop((i, j))))
+        for tmp_path, (new_i, new_j), latlon in staged:
+            os.rename(tmp_path, self.tile_path(zoom, new_i, new_j))
+            info[(new_i, new_j)] = latlon
+        self.commit()
+
+    def commit(self):
+        for zoom, info in self.info.items():
+            with open(os.path.join(self.folder_path, str(zoom), 'info.txt'), 'w') as info_file:
+                for (i, j) in sorted(info):
+                    info_file.write('%d %d %f %f\n' % (i, j, info[(i, j)][0], info[(i, j)][1]))
+
+class XYZDirectoryTileStore(TileStore):
+    """
+    Read-only view of a slippy map tree, <root>/<z>/<x>/<y>.<extension>, such
+    as tiles staged on disk for the field. Grid positions count from the
+    smallest x and y present at each zoom.
+    """
+    def __init__(self, root, extension, tile_size=256):
+        self.root = root
+        self.extension = extension
+        self.tile_size = tile_size
+        self.grids = {}
+
+    def zooms(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(name) for name in os.listdir(self.root) if name.isdigit() and self.has_tiles(int(name)))
+
+    def has_tiles(self, zoom):
+        # whether the zoom holds any tile, looking no further than the first one
+        suffix = '.' + self.extension
+        zoom_path = os.path.join(self.root, str(zoom))
+        for x in os.listdir(zoom_path) if os.path.isdir(zoom_path) else []:
+            x_path = os.path.join(zoom_path, x)
+            if x.isdigit() and os.path.isdir(x_path) and \
+                    any(name.endswith(suffix) and name[:-len(suffix)].isdigit() for name in os.listdir(x_path)):
+                return True
+        return False
+
+    def load_grid(self, zoom):
+        # (min_x, min_y, [(x, y), ...]) from the directory listing
+        if not zoom in self.grids:
+            suffix = '.' + self.extension
+            tiles = []
+            zoom_path = os.path.join(self.root, str(zoom))
+            for x in os.listdir(zoom_path) if os.path.isdir(zoom_path) else []:
+                if x.isdigit() and os.path.isdir(os.path.join(zoom_path, x)):
+                    tiles += [(int(x), int(name[:-len(suffix)])) for name in os.listdir(os.path.join(zoom_path, x))
+                              if name.endswith(suffix) and name[:-len(suffix)].isdigit()]
+            if tiles:
+                self.grids[zoom] = (min(x for x, y in tiles), min(y for x, y in tiles), tiles)
+            else:
+                self.grids[zoom] = (0, 0, [])
+        return self.grids[zoom]
+
+    def lattice(self, zoom):
+        min_x, min_y, tiles = self.load_grid(zoom)
+        return min_x * self.tile_size, min_y * self.tile_size, [(x - min_x, y - min_y) for x, y in tiles]
+
+    def read_info(self, zoom):
+        min_x, min_y, tiles = self.load_grid(zoom)
+        world = 2.0 ** zoom * self.tile_size
+        info = []
+        for x, y in tiles:
+            lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) * self.tile_size / world))))
+            lon = (x + 0.5) * self.tile_size / world * 360.0 - 180.0
+            info.append((x - min_x, y - min_y, lat, lon))
+        return info
+
+    def tile_path(self, zoom, i, j):
+        min_x, min_y, tiles = self.load_grid(zoom)
+        return os.path.join(self.root, str(zoom), str(min_x + i), '%d.%s' % (min_y + j, self.extension))
+
+    def get(self, zoom, i, j):
+        filename = self.tile_path(zoom, i, j)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as tile_file:
+            return tile_file.read()
+
+    def size(self, zoom, i, j):
+        filename = self.tile_path(zoom, i, j)
+        return os.path.getsize(filename) if os.path.isfile(filename) else None
+
+def store_path(mapname):
+    return os.path.join(_MAPS_CACHE_PATH, mapname, _STORE_FILENAME)
+
+def open_tile_store(mapname, create=False, provider=None):
+    """
+    Opens the packed store of a map, falling back to a legacy tile directory,
+    then to the provider's own tile tree if it can be read in place. Returns
+    None if the map has no tiles and create is False.
+    """
+    if os.path.isfile(store_path(mapname)) or create:
+        if not os.path.isdir(os.path.dirname(store_path(mapname))):
+            os.makedirs(os.path.dirname(store_path(mapname)))
+        return SQLiteTileStore(store_path(mapname))
+    legacy = DirectoryTileStore(os.path.join(_MAPS_CACHE_PATH, mapname))
+    if legacy.zooms():
+        return legacy
+    if provider is not None and provider.directory() is not None:
+        root, extension = provider.directory()
+        staged = XYZDirectoryTileStore(root, extension, provider.tile_size)
+        if staged.zooms():
+            return staged
+    return None
+
+def migrate_directory_store(mapname, remove=True):
+    """
+    Packs a legacy <map>/<zoom>/i_j.jpg cache into the map's tiles.db.
+    Returns the number of tiles migrated.
+    """
+    folder_path = os.path.join(_MAPS_CACHE_PATH, mapname)
+    legacy = DirectoryTileStore(folder_path)
+    zooms = legacy.zooms()
+    if not zooms:
+        return 0
+    store = open_tile_store(mapname, create=True)
+    count = 0
+    for zoom in zooms:
+        for i, j, lat, lon in legacy.read_info(zoom):
+            data = legacy.get(zoom, i, j)
+            if data is not None:
+                store.put(zoom, i, j, lat, lon, data)
+                count += 1
+        store.commit()
+    store.close()
+    if remove:
+        for zoom in zooms:
+            shutil.rmtree(os.path.join(folder_path, str(zoom)))
+    return count
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Times view updates of a 1920x1080 map: the old path (paint every touched
+# tile into a new bigimage, clear the window, paste bigimage) against
+# GoogleMapPlotter.composite(), which draws the visible part of each tile
+# straight into the reused window image. Tiles are decoded and cached for both.
+#   python test/bench_compositor.py [--width W] [--height H] [--frames N]
+from __future__ import print_function, division
+import os, sys, time, shutil, tempfile, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+from synthetic_map import make_store
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtCore import QPoint, QRect, Qt
+from ros_groundstation import gm_plotter
+from ros_groundstation.tile_providers import lat_to_world, lon_to_world, world_to_lat, world_to_lon
+
+LAT, LON, ZOOM = 40.2518, -111.6493, 20
+
+def bigimage_update(window_img, mz_obj, tiles, min_i, max_i, min_j, max_j, x_offset, y_offset):
+    # fetch_tiles() and update() before the compositor; returns bytes allocated
+    bigimage = QImage((max_i - min_i + 1) * mz_obj.col_spacing, (max_j - min_j + 1) * mz_obj.row_spacing, 4)
+    painter = QPainter(bigimage)
+    for i in range(min_i, max_i + 1):
+        for j in range(min_j, max_j + 1):
+            painter.drawImage(QPoint((i - min_i) * mz_obj.col_spacing, (j - min_j) * mz_obj.row_spacing), tiles[(i, j)])
+    painter.end()
+    painter = QPainter(window_img)
+    painter.fillRect(QRect(0, 0, window_img.width(), window_img.height()), Qt.black)
+    painter.drawImage(QPoint(-x_offset, -y_offset), bigimage)
+    painter.end()
+    return bigimage.byteCount()
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        store = make_store(os.path.join(folder, 'tiles.db'), LAT, LON, [ZOOM], 8, 8)
+        gm_plotter.open_tile_store = lambda mapname, *rest, **options: store
+        mapdict = {'bench': ((LAT, LON), ZOOM)}
+        plotter = gm_plotter.GoogleMapPlotter(mapdict, args.width, args.height, 'bench', 'blank')
+
+        # the center wanders over the map, a few pixels per frame as when dragging
+        x, y = lon_to_world(LON, ZOOM), lat_to_world(LAT, ZOOM)
+        views = [(world_to_lat(y + 7 * (k % 60) - 200, ZOOM), world_to_lon(x + 11 * (k % 90) - 500, ZOOM))
+                 for k in range(args.frames)]
+        for lat, lon in views:
+            plotter.UpdateView(lat, lon)     # decodes every tile once
+        window_img = plotter.GetImage()
+
+        new_times, frames = [], []
+        for lat, lon in views:
+            start = time.time()
+            plotter.UpdateView(lat, lon)
+            new_times.append(time.time() - start)
+            frames.append((plotter.view_tiles, plotter.tile_frame[2], plotter.tile_frame[3], plotter.GetImage().copy()))
+        reused = plotter.GetImage() is window_img
+
+        old_times, allocated, mismatches = [], [], 0
+        old_img = QImage(args.width, args.height, 4)
+        for (min_i, max_i, min_j, max_j), x_offset, y_offset, new_img in frames:
+            tiles = plotter.grab_tiles(min_i, max_i, min_j, max_j)
+            start = time.time()
+            allocated.append(bigimage_update(old_img, plotter.mz_obj, tiles, min_i, max_i, min_j, max_j, x_offset, y_offset))
+            old_times.append(time.time() - start)
+            mismatches += old_img != new_img
+        store.close()
+    finally:
+        shutil.rmtree(folder)
+
+    frame_bytes = args.width * args.height * 4
+    print('%dx%d, %d view updates, tiles already decoded' % (args.width, args.height, args.frames))
+    print('bigimage:   %6.2f ms median, allocates %.1f MB and writes %.1f MB per update' %
+          (median(old_times) * 1e3, median(allocated) / 1e6, (median(allocated) + 2 * frame_bytes) / 1e6))
+    print('composite:  %6.2f ms median, allocates %s and writes %.1f MB per update' %
+          (median(new_times) * 1e3, 'nothing' if reused else 'a new window image', frame_bytes / 1e6))
+    print('frames that differ: %d of %d' % (mismatches, args.frames))
+
+if __name__ == '__main__':
+    main()
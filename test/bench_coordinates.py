@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Times the input handling of Geobase.gps_to_ned: the old way (str() both values,
+# scan for N/S/E/W, float() or split on '-') against coordinates.to_degrees, for
+# floats, numeric strings and DMS strings; parse_coordinate on DMS strings; and
+# to_degrees_many on an array against converting it value by value.
+#   python test/bench_coordinates.py [--calls N] [--array N]
+from __future__ import print_function, division
+import os, sys, time, random, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+import numpy
+from ros_groundstation.coordinates import to_degrees, to_degrees_many, parse_coordinate
+
+def decimal_degrees(string):
+    # Geo.decimal_degrees as it was (it sat in the class without self, so gps_to_ned
+    # could not reach it; here it is a plain function)
+    a = 0
+    firstLetter = string[0]
+    if firstLetter == 'N' or firstLetter == 'E':
+        a = 1
+    elif firstLetter == 'S' or firstLetter == 'W':
+        a = -1
+    lessString = string.strip("NSEW ")
+    values = lessString.split('-', 2)
+    d = float(values[0])
+    m = float(values[1])
+    s = float(values[2])
+    return a*(d+(m/60.0)+(s/3600.0))
+
+def old_inputs(lat2, long2):
+    # the start of gps_to_ned as it was
+    values = [str(lat2), str(long2)]
+    newValues = []
+    for value in values:
+        if ("N" in value) or ("S" in value) or ("E" in value) or ("W" in value) == True:
+            newValues.append(decimal_degrees(value))
+        else:
+            newValues.append(float(value))
+    return newValues
+
+def new_inputs(lat2, long2):
+    return to_degrees(lat2), to_degrees(long2)
+
+def dms(value, positive, negative):
+    letter = positive if value >= 0 else negative
+    hundredths = int(round(abs(value) * 360000))
+    return '%s%d-%02d-%05.2f' % (letter, hundredths // 360000, hundredths // 6000 % 60, hundredths % 6000 / 100.0)
+
+def per_call(function, pairs):
+    start = time.time()
+    for lat, lon in pairs:
+        function(lat, lon)
+    return (time.time() - start) / len(pairs)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--array', type=int, default=5000, help='length of the array given to to_degrees_many')
+    args = parser.parse_args()
+    random.seed(1)
+    floats = [(random.uniform(40.2, 40.3), random.uniform(-111.7, -111.6)) for k in range(args.calls)]
+    strings = [(repr(lat), repr(lon)) for lat, lon in floats]
+    texts = [(dms(lat, 'N', 'S'), dms(lon, 'E', 'W')) for lat, lon in floats]
+
+    print('%d lat/lon pairs, time per pair' % args.calls)
+    for name, pairs in (('floats', floats), ('numeric strings', strings), ('DMS strings', texts)):
+        old, new = per_call(old_inputs, pairs), per_call(new_inputs, pairs)
+        print('  %-16s old %5.2f us -> to_degrees %5.2f us (%.1fx)' % (name + ':', old * 1e6, new * 1e6, old / new))
+    parse = per_call(lambda lat, lon: (parse_coordinate(lat, 'lat'), parse_coordinate(lon, 'lon')), texts)
+    print('  parse_coordinate on DMS strings, with kind checks: %.2f us' % (parse * 1e6))
+    worst = max(abs(a - b) for pair in texts for a, b in zip(old_inputs(*pair), new_inputs(*pair)))
+    print('  largest difference between the two on DMS strings: %.1e degrees' % worst)
+
+    array = numpy.array([lat for lat, lon in floats[:args.array]])
+    repeat = 200
+    start = time.time()
+    for k in range(repeat):
+        to_degrees_many(array)
+    many = (time.time() - start) / repeat
+    start = time.time()
+    for k in range(repeat // 20):
+        numpy.array([float(value) for value in array])
+    one_by_one = (time.time() - start) / (repeat // 20)
+    print('%d-element float array: value by value %.0f us -> to_degrees_many %.2f us' %
+          (args.array, one_by_one * 1e6, many * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Times NED <-> GPS conversions near the origin with the geodesic (Geodesic.WGS84
+# Direct and Inverse, as Geobase used to) and through the local tangent plane,
+# per call and for whole arrays, with the largest difference between the two.
+#   python test/bench_geo.py [--points N] [--radius M]
+from __future__ import print_function, division
+import os, sys, time, math, random, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+from ros_groundstation.Geo import Geobase
+
+ORIGIN = (40.25, -111.65)
+
+def timed(function):
+    start = time.time()
+    result = function()
+    return result, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=20000)
+    parser.add_argument('--radius', type=float, default=5000, help='points lie within this many meters of the origin')
+    args = parser.parse_args()
+    random.seed(1)
+    points = []
+    for k in range(args.points):
+        distance, azimuth = args.radius * math.sqrt(random.random()), random.uniform(0, 2 * math.pi)
+        points.append((distance * math.cos(azimuth), distance * math.sin(azimuth)))
+    norths, easts = [p[0] for p in points], [p[1] for p in points]
+
+    geodesic = Geobase(*ORIGIN)
+    geodesic.ltp_range = 0
+    ltp = Geobase(*ORIGIN)
+    print('%d points within %g m of %.2f, %.2f' % (args.points, args.radius, ORIGIN[0], ORIGIN[1]))
+
+    old_gps, old_time = timed(lambda: [geodesic.ned_to_gps(north, east) for north, east in points])
+    new_gps, new_time = timed(lambda: [ltp.ned_to_gps(north, east) for north, east in points])
+    many, many_time = timed(lambda: ltp.ned_to_gps_many(norths, easts))
+    print('ned_to_gps:  geodesic %6.2f us -> tangent plane %5.2f us (%.0fx), ned_to_gps_many %5.3f us per point' %
+          (old_time / len(points) * 1e6, new_time / len(points) * 1e6, old_time / new_time,
+           many_time / len(points) * 1e6))
+
+    lats, lons = [gps[0] for gps in old_gps], [gps[1] for gps in old_gps]
+    old_ned, old_time = timed(lambda: [geodesic.gps_to_ned(lat, lon) for lat, lon in zip(lats, lons)])
+    new_ned, new_time = timed(lambda: [ltp.gps_to_ned(lat, lon) for lat, lon in zip(lats, lons)])
+    many, many_time = timed(lambda: ltp.gps_to_ned_many(lats, lons))
+    print('gps_to_ned:  geodesic %6.2f us -> tangent plane %5.2f us (%.0fx), gps_to_ned_many %5.3f us per point' %
+          (old_time / len(points) * 1e6, new_time / len(points) * 1e6, old_time / new_time,
+           many_time / len(points) * 1e6))
+
+    difference = max(math.hypot(a[0] - b[0], a[1] - b[1]) for a, b in zip(old_ned, new_ned))
+    bound = args.radius**3 / (3 * 6371000.0**2)
+    print('largest difference from the geodesic: %.2f mm (d**3/(3*R**2) at %g m: %.2f mm)' %
+          (difference * 1e3, args.radius, bound * 1e3))
+
+if __name__ == '__main__':
+    main()
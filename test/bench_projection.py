@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Projects and draws a path of N lat/lon points the old way (rel_lon_to_rel_pix and
+# rel_lat_to_rel_pix per point, drawLine per segment, as draw_path did) and through
+# ViewProjection.polygon() and one drawPolyline.
+#   python test/bench_projection.py [--points N] [--zoom Z] [--repeat N]
+from __future__ import print_function, division
+import os, sys, time, random, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+from synthetic_map import application
+from PyQt5.QtGui import QImage, QPainter, QPen
+from PyQt5.QtCore import QPointF, Qt
+from ros_groundstation.gm_plotter import GoogleMapPlotter, ViewProjection
+from ros_groundstation.tile_providers import lat_to_world, lon_to_world, world_to_lat, world_to_lon
+
+LAT, LON = 40.2518, -111.6493
+WIDTH, HEIGHT = 1920, 1080
+
+def old_project(points, west, north, zoom):
+    return [(GoogleMapPlotter.rel_lon_to_rel_pix(west, point[1], zoom),
+             GoogleMapPlotter.rel_lat_to_rel_pix(north, point[0], zoom)) for point in points]
+
+def old_draw(painter, points, west, north, zoom):
+    for idx in range(len(points) - 1):
+        pt1 = points[idx]
+        pt2 = points[idx + 1]
+        x1 = GoogleMapPlotter.rel_lon_to_rel_pix(west, pt1[1], zoom)
+        y1 = GoogleMapPlotter.rel_lat_to_rel_pix(north, pt1[0], zoom)
+        x2 = GoogleMapPlotter.rel_lon_to_rel_pix(west, pt2[1], zoom)
+        y2 = GoogleMapPlotter.rel_lat_to_rel_pix(north, pt2[0], zoom)
+        painter.drawLine(QPointF(x1, y1), QPointF(x2, y2))
+
+def new_draw(painter, points, projection):
+    painter.drawPolyline(projection.polygon(points))
+
+def best(function, repeat):
+    times = []
+    for k in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+def painted(draw):
+    image = QImage(WIDTH, HEIGHT, QImage.Format_RGB32)
+    image.fill(Qt.black)
+    painter = QPainter(image)
+    painter.setPen(QPen(Qt.yellow, 2.0, Qt.SolidLine, Qt.RoundCap))
+    draw(painter)
+    painter.end()
+    return image
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=10000)
+    parser.add_argument('--zoom', type=float, default=17.5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    application()
+    random.seed(1)
+    zoom = args.zoom
+    west = world_to_lon(lon_to_world(LON, zoom) - WIDTH / 2.0, zoom)
+    north = world_to_lat(lat_to_world(LAT, zoom) - HEIGHT / 2.0, zoom)
+    # a random walk around the view, [lat, lon, alt] like the mission topics
+    x, y = lon_to_world(LON, zoom), lat_to_world(LAT, zoom)
+    points = []
+    for k in range(args.points):
+        x += random.uniform(-20, 20)
+        y += random.uniform(-20, 20)
+        points.append([world_to_lat(y, zoom), world_to_lon(x, zoom), 0.0])
+    projection = ViewProjection(west, north, zoom)
+
+    old_time = best(lambda: old_project(points, west, north, zoom), args.repeat)
+    new_time = best(lambda: projection.polygon(points), args.repeat)
+    old_xy = old_project(points, west, north, zoom)
+    polygon = projection.polygon(points)
+    error = max(max(abs(polygon[k].x() - old_xy[k][0]), abs(polygon[k].y() - old_xy[k][1])) for k in range(len(points)))
+    print('%d points at zoom %g' % (args.points, zoom))
+    print('project:  per point %7.2f ms -> polygon() %6.2f ms (%.0fx), max difference %.1e px' %
+          (old_time * 1e3, new_time * 1e3, old_time / new_time, error))
+
+    old_time = best(lambda: painted(lambda painter: old_draw(painter, points, west, north, zoom)), args.repeat)
+    new_time = best(lambda: painted(lambda painter: new_draw(painter, points, projection)), args.repeat)
+    print('draw:     drawLine    %7.2f ms -> drawPolyline %3.2f ms (%.1fx)' %
+          (old_time * 1e3, new_time * 1e3, old_time / new_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# Times a zoom level's worth of tile downloads from a local stand-in server
+# with the old loop (urlopen, then sleep 1 / rate) and with TileDownloader.
+#   python test/bench_tile_downloader.py [--tiles N] [--latency S] [--rate R] [--workers N]
+from __future__ import print_function, division
+import os, sys, time, urllib, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+from ros_groundstation.tile_downloader import TileDownloader, TileJob
+from tile_server import TileServer
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tiles', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.2, help='server response time, seconds')
+    parser.add_argument('--rate', type=float, default=4, help='requests per second (FETCH_MAPS._GRABRATE)')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    server = TileServer(args.latency).start()
+    urls = ['%s/tile/%d' % (server.url, n) for n in range(args.tiles)]
+    print('%d tiles, %.0f ms per request, %g requests/s' % (args.tiles, args.latency * 1000, args.rate))
+
+    start = time.time()
+    for url in urls:
+        urllib.urlopen(url).read()
+        time.sleep(1.0 / args.rate)
+    serial = time.time() - start
+    print('serial loop:            %6.2f s' % serial)
+
+    jobs = [TileJob(n, 0, 0.0, 0.0, 19, url) for n, url in enumerate(urls)]
+    for rate in (args.rate, None):
+        start = time.time()
+        failed = TileDownloader(rate, args.workers).download(jobs, lambda job, data: None)
+        elapsed = time.time() - start
+        print('TileDownloader, %-8s %6.2f s (%.1fx, %d failed)' %
+              ('%g/s:' % rate if rate else 'no limit:', elapsed, serial / elapsed, len(failed)))
+    server.stop()
+
+if __name__ == '__main__':
+    main()
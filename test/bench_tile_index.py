@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Compares the old tile index (dict of dicts of LatLon tile centers, tile found
+# by linear interpolation between the map's lat/lon bounds) with MapZoomObj for
+# a site of the given radius: memory, build time, lookup time and how often
+# each finds the wrong tile for random points.
+#   python test/bench_tile_index.py [--radius M] [--zoom Z] [--lats LAT,LAT] [--points N]
+from __future__ import print_function, division
+import os, sys, time, random, argparse
+from collections import defaultdict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+import numpy
+from ros_groundstation.gm_plotter import MapZoomObj, GoogleMapPlotter, LatLon
+from ros_groundstation.tile_providers import GoogleStaticProvider, lat_to_world, lon_to_world, world_to_lat, world_to_lon
+
+TILEWIDTH, TILEHEIGHT = 640, 615
+
+class OldMapZoomObj():
+    # MapZoomObj as it was, fed the lines of info.txt
+    def __init__(self, info, zoom):
+        self.tiles = defaultdict(dict)
+        for i, j, lat, lon in info:
+            self.tiles[i][j] = LatLon(lat, lon)
+        self.cols = len(self.tiles)
+        self.rows = len(self.tiles[0])
+        min_latlon_center = self.tiles[0][self.rows-1]
+        max_latlon_center = self.tiles[self.cols-1][0]
+        min_lon = GoogleMapPlotter.pix_to_rel_lon(min_latlon_center.lon, int(-TILEWIDTH/2.0), zoom)
+        max_lon = GoogleMapPlotter.pix_to_rel_lon(max_latlon_center.lon, int(TILEWIDTH/2.0), zoom)
+        min_lat = GoogleMapPlotter.pix_to_rel_lat(min_latlon_center.lat, -int(TILEWIDTH/2.0 - TILEHEIGHT), zoom)
+        max_lat = GoogleMapPlotter.pix_to_rel_lat(max_latlon_center.lat, -int(TILEWIDTH/2.0), zoom)
+        self.min_latlon = LatLon(min_lat, min_lon)
+        self.max_latlon = LatLon(max_lat, max_lon)
+
+    def localize_point(self, latlon):
+        i = int((latlon.lon - self.min_latlon.lon) / (self.max_latlon.lon - self.min_latlon.lon) * self.cols)
+        i = min(max(i, 0), self.cols - 1)
+        j = self.rows - 1 - int((latlon.lat - self.min_latlon.lat) / (self.max_latlon.lat - self.min_latlon.lat) * self.rows)
+        return i, min(max(j, 0), self.rows - 1)
+
+class InfoStore():
+    # the part of a tile store MapZoomObj reads
+    def __init__(self, info):
+        self.info = info
+
+    def lattice(self, zoom):
+        return None
+
+    def read_info(self, zoom):
+        return self.info
+
+def deep_size(value, seen=None):
+    # bytes held by value and everything it refers to
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, numpy.ndarray):
+        return sys.getsizeof(value) + (0 if value.flags.owndata else value.nbytes)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += deep_size(value.__dict__, seen)
+    return size
+
+def site(lat, lon, radius_m, zoom):
+    # info.txt lines of a Google site: i, j, tile center rounded to 6 decimals
+    provider = GoogleStaticProvider()
+    cols, rows = provider.tile_counts(lat, radius_m, zoom)
+    x0 = lon_to_world(lon, zoom) - cols / 2.0 * TILEWIDTH
+    y0 = lat_to_world(lat, zoom) - rows / 2.0 * TILEHEIGHT
+    info = [(i, j, round(world_to_lat(y0 + j * TILEHEIGHT + TILEWIDTH / 2.0, zoom), 6),
+             round(world_to_lon(x0 + i * TILEWIDTH + TILEWIDTH / 2.0, zoom), 6))
+            for i in range(cols) for j in range(rows)]
+    return info, cols, rows, x0, y0
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--radius', type=float, default=5000, help='site radius, meters')
+    parser.add_argument('--zoom', type=int, default=20)
+    parser.add_argument('--lats', default='40.25,65.0', help='site latitudes, comma separated')
+    parser.add_argument('--points', type=int, default=20000, help='random points looked up')
+    args = parser.parse_args()
+    random.seed(1)
+    zoom = args.zoom
+    for lat in [float(value) for value in args.lats.split(',')]:
+        info, cols, rows, x0, y0 = site(lat, -111.65, args.radius, zoom)
+        old, old_build = timed(OldMapZoomObj, info, zoom)
+        new, new_build = timed(MapZoomObj, InfoStore(info), zoom, GoogleStaticProvider())
+
+        points = [(random.uniform(x0, x0 + cols * TILEWIDTH), random.uniform(y0, y0 + rows * TILEHEIGHT))
+                  for k in range(args.points)]
+        exact = [(int((x - x0) // TILEWIDTH), int((y - y0) // TILEHEIGHT)) for x, y in points]
+        latlons = [LatLon(world_to_lat(y, zoom), world_to_lon(x, zoom)) for x, y in points]
+        old_found, old_time = timed(lambda: [old.localize_point(latlon) for latlon in latlons])
+        # MapZoomObj looks up world pixels, so its time includes projecting each point
+        new_found, new_time = timed(lambda: [new.locate(lon_to_world(latlon.lon, zoom), lat_to_world(latlon.lat, zoom))
+                                             for latlon in latlons])
+
+        print('lat %.2f, %g m radius at zoom %d: %dx%d = %d tiles' % (lat, args.radius, zoom, cols, rows, len(info)))
+        print('  index memory  %7.0f KiB -> %5.0f KiB' % (deep_size(old) / 1024.0, deep_size(new) / 1024.0))
+        print('  index build   %7.1f ms  -> %5.1f ms' % (old_build * 1e3, new_build * 1e3))
+        print('  lookup        %7.2f us  -> %5.2f us' % (old_time / len(points) * 1e6, new_time / len(points) * 1e6))
+        print('  wrong tile    %6.1f %%   -> %5.1f %%' %
+              (100.0 * sum(a != b for a, b in zip(old_found, exact)) / len(points),
+               100.0 * sum(a != b for a, b in zip(new_found, exact)) / len(points)))
+
+if __name__ == '__main__':
+    main()
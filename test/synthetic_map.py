@@ -0,0 +1,49 @@
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5.QtGui import QGuiApplication, QImage, QPainter, QColor
+from PyQt5.QtCore import QBuffer, QIODevice, Qt
+from ros_groundstation.tile_store import SQLiteTileStore
+from ros_groundstation.tile_providers import GoogleStaticProvider, lat_to_world, lon_to_world, world_to_lat, world_to_lon
+
+_app = None
+
+def application():
+    # QPainter and the JPEG plugin need one, offscreen unless QT_QPA_PLATFORM says otherwise
+    global _app
+    _app = QGuiApplication.instance() or QGuiApplication([])
+    return _app
+
+def tile_image(i, j, zoom, size=GoogleStaticProvider.tile_size):
+    # a tile that shows where it belongs: a color per i, j and a square per zoom
+    image = QImage(size, size, QImage.Format_RGB32)
+    image.fill(QColor(37 * i % 256, 59 * j % 256, 11 * zoom % 256))
+    painter = QPainter(image)
+    painter.fillRect(size // 4, size // 4, size // 8, size // 8, Qt.white)
+    painter.end()
+    return image
+
+def jpeg(image, quality=85):
+    buf = QBuffer()
+    buf.open(QIODevice.WriteOnly)
+    image.save(buf, 'JPG', quality)
+    return buf.data().data()
+
+def make_store(filename, lat, lon, zooms, cols, rows):
+    """
+    An SQLite tile store of Google-layout tiles, cols x rows of them per
+    zoom, centered on lat, lon. Returns the store.
+    """
+    application()
+    provider = GoogleStaticProvider()
+    store = SQLiteTileStore(filename)
+    for zoom in zooms:
+        x0 = lon_to_world(lon, zoom) - cols / 2.0 * provider.col_spacing
+        y0 = lat_to_world(lat, zoom) - rows / 2.0 * provider.row_spacing
+        for i in range(cols):
+            for j in range(rows):
+                # tile centers, as FETCH_MAPS records them
+                x = x0 + i * provider.col_spacing + provider.tile_size / 2.0
+                y = y0 + j * provider.row_spacing + provider.tile_size / 2.0
+                store.put(zoom, i, j, world_to_lat(y, zoom), world_to_lon(x, zoom), jpeg(tile_image(i, j, zoom)))
+    store.commit()
+    return store
@@ -0,0 +1,76 @@
+import os, sys, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+import numpy
+from ros_groundstation.coordinates import CoordinateError, to_degrees, to_degrees_many, parse_coordinate, parse_latlon
+
+VALID = [
+    ('N40-14-51.2', None, 40 + 14 / 60.0 + 51.2 / 3600),
+    ('W111-39-00', None, -111.65),
+    ('40 14 51.2 N', None, 40 + 14 / 60.0 + 51.2 / 3600),
+    ('40d14\'51.2"N', 'lat', 40 + 14 / 60.0 + 51.2 / 3600),
+    ("111d39'", 'lon', 111.65),
+    ('-111:39', 'lon', -111.65),
+    ('S 33 52.5', 'lat', -(33 + 52.5 / 60)),
+    ('e151.2', 'lon', 151.2),
+    ('  40.25 ', 'lat', 40.25),
+    ('+90', 'lat', 90.0),
+    ('180W', 'lon', -180.0),
+    ('0-0-0.5', None, 0.5 / 3600),
+]
+
+INVALID = [
+    ('', None),
+    ('N', None),
+    ('abc', None),
+    ('N40-14-51.2S', None),     # two hemisphere letters
+    ('-N40', None),
+    ('N-40', None),             # a sign and a letter
+    ('E40', 'lat'),             # the wrong kind
+    ('N40', 'lon'),
+    ('40.5-14', None),          # a fraction before the last field
+    ('40-60', None),            # minutes of 60
+    ('40-14-60', None),         # seconds of 60
+    ('90.0001', 'lat'),
+    ('N91', None),
+    ('181', None),
+    ('40-14-51-2', None),
+    ('40,25', 'lat'),
+]
+
+class CoordinatesTest(unittest.TestCase):
+    def test_valid(self):
+        for text, kind, degrees in VALID:
+            self.assertAlmostEqual(parse_coordinate(text, kind), degrees, places=12, msg=text)
+
+    def test_invalid(self):
+        for text, kind in INVALID:
+            self.assertRaises(CoordinateError, parse_coordinate, text, kind)
+        # callers that expect float() errors still catch them
+        self.assertTrue(issubclass(CoordinateError, ValueError))
+
+    def test_latlon(self):
+        self.assertEqual(parse_latlon('40.25,-111.65'), (40.25, -111.65))
+        lat, lon = parse_latlon('N40-15-00, W111-39-00')
+        self.assertAlmostEqual(lat, 40.25)
+        self.assertAlmostEqual(lon, -111.65)
+        for text in ('40.25', '40.25,-111.65,0', 'W111-39,N40-15', '91,0'):
+            self.assertRaises(CoordinateError, parse_latlon, text)
+
+    def test_to_degrees(self):
+        self.assertEqual(to_degrees(40.25), 40.25)
+        self.assertEqual(to_degrees(40), 40.0)
+        self.assertEqual(to_degrees(numpy.float32(0.5)), 0.5)
+        self.assertEqual(to_degrees('-111.65'), -111.65)
+        self.assertAlmostEqual(to_degrees('W111-39-00'), -111.65)
+        self.assertRaises(CoordinateError, to_degrees, 'west')
+
+    def test_to_degrees_many(self):
+        values = numpy.array([40.25, -111.65])
+        self.assertTrue(to_degrees_many(values) is values)
+        mixed = to_degrees_many([40.25, '-111.65', 'N40-15'])
+        self.assertEqual(mixed.dtype, numpy.float64)
+        self.assertTrue(numpy.allclose(mixed, [40.25, -111.65, 40.25]))
+        self.assertRaises(CoordinateError, to_degrees_many, [40.25, 'N95'])
+
+if __name__ == '__main__':
+    unittest.main()
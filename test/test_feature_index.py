@@ -0,0 +1,87 @@
+import os, sys, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+import numpy
+from ros_groundstation.feature_index import FeatureIndex
+
+CELL = 2.0**-10
+
+def brute_box(groups, left, top, right, bottom):
+    found = {}
+    for name, (xs, ys, radii) in groups.items():
+        numbers = numpy.flatnonzero((xs >= left) & (xs <= right) & (ys >= top) & (ys <= bottom))
+        if len(numbers):
+            found[name] = list(numbers)
+    return found
+
+def brute_nearest(groups, x, y, radius):
+    best = None
+    for name, (xs, ys, radii) in groups.items():
+        distances = numpy.maximum(numpy.hypot(xs - x, ys - y) - radii, 0)
+        for number in numpy.flatnonzero(distances <= radius):
+            if best is None or distances[number] < best[2]:
+                best = (name, number, distances[number])
+    return best
+
+class FeatureIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.random = numpy.random.RandomState(1)
+        # features spread over about 40 x 40 cells
+        self.groups = {}
+        for name, count, radius in (('waypoints', 300, 0.0), ('path', 2000, 0.0), ('obstacles', 50, 3 * CELL)):
+            xs = 100 + self.random.uniform(0, 40 * CELL, count)
+            ys = 90 + self.random.uniform(0, 40 * CELL, count)
+            self.groups[name] = (xs, ys, self.random.uniform(0, radius, count))
+        self.index = FeatureIndex(CELL)
+        for name, (xs, ys, radii) in self.groups.items():
+            self.index.set_group(name, xs, ys, radii, key=1)
+
+    def check(self):
+        for k in range(200):
+            left, top = 100 + self.random.uniform(-5, 40, 2) * CELL
+            right, bottom = left + self.random.uniform(0, 10) * CELL, top + self.random.uniform(0, 10) * CELL
+            found = dict((name, list(numbers)) for name, numbers in self.index.box(left, top, right, bottom).items())
+            self.assertEqual(found, brute_box(self.groups, left, top, right, bottom))
+            x, y = 100 + self.random.uniform(-5, 45, 2) * CELL
+            radius = self.random.uniform(0, 2) * CELL
+            best = self.index.nearest(x, y, radius)
+            expected = brute_nearest(self.groups, x, y, radius)
+            if expected is None:
+                self.assertEqual(best, None)
+            else:
+                self.assertEqual(best[:2], expected[:2])
+                self.assertAlmostEqual(best[2], expected[2])
+
+    def test_queries(self):
+        self.check()
+
+    def test_append(self):
+        xs, ys, radii = self.groups['waypoints']
+        self.groups['waypoints'] = (numpy.r_[xs, 100.01, 100.02], numpy.r_[ys, 90.01, 90.02], numpy.r_[radii, 0, 0])
+        self.assertFalse(self.index.set_group('waypoints', *self.groups['waypoints'], key=2))
+        self.assertEqual(self.index.key('waypoints'), 2)
+        self.check()
+        # dropping one is a change
+        self.groups['waypoints'] = tuple(values[1:] for values in self.groups['waypoints'])
+        self.assertTrue(self.index.set_group('waypoints', *self.groups['waypoints'], key=3))
+        self.check()
+
+    def test_move(self):
+        xs, ys, radii = [values.copy() for values in self.groups['path']]
+        # a few moved, some to other cells: the features keep their numbers
+        xs[[3, 500, 1999]] += (5 * CELL, 0.1 * CELL, -7 * CELL)
+        ys[[3, 500, 1999]] += (0, 0.2 * CELL, 2 * CELL)
+        self.groups['path'] = (xs, ys, radii)
+        self.assertFalse(self.index.set_group('path', xs, ys, radii, key=2))
+        for number in (3, 500, 1999):
+            x, y = xs[number], ys[number]
+            self.assertTrue(number in self.index.box(x - CELL / 4, y - CELL / 4, x + CELL / 4, y + CELL / 4)['path'])
+            self.assertEqual(self.index.nearest(x, y, CELL / 4)[:2], ('path', number))
+        self.check()
+        # many moved: rebuilt, and no longer the same features
+        xs = xs + CELL
+        self.groups['path'] = (xs, ys, radii)
+        self.assertTrue(self.index.set_group('path', xs, ys, radii, key=3))
+        self.check()
+
+if __name__ == '__main__':
+    unittest.main()
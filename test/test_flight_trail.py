@@ -0,0 +1,80 @@
+import os, sys, random, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+import numpy
+from ros_groundstation.flight_trail import FlightTrail, TrailLevel
+from ros_groundstation.tile_providers import world_to_lat, world_to_lon
+
+LEVEL = 18
+
+def fly(trail, count, seed=1):
+    # a random walk near 40.25, -111.65, a few pixels per sample at LEVEL
+    random.seed(seed)
+    x, y = 0.0, 0.0
+    for n in range(count):
+        x += random.uniform(-3, 3) / 2**LEVEL
+        y += random.uniform(-3, 3) / 2**LEVEL
+        trail.append(n, world_to_lat(97.5 + y, 0), world_to_lon(48.6 + x, 0), 1400 + n % 50, 18 + n % 7)
+
+def brute_decimated(trail, level, left, top, right, bottom):
+    # the latest sample in each cell that meets the rectangle, by looking at every sample
+    latest = {}
+    scale = 2.0**level / trail.cell
+    for n in range(trail.first(), trail.total):
+        cell = (int(numpy.floor(trail.field(FlightTrail.X, n) * scale)),
+                int(numpy.floor(trail.field(FlightTrail.Y, n) * scale)))
+        latest[cell] = n
+    cell = trail.cell
+    return sorted(n for (cx, cy), n in latest.items()
+                  if left // cell <= cx <= right // cell and top // cell <= cy <= bottom // cell)
+
+class FlightTrailTest(unittest.TestCase):
+    def window(self, trail):
+        # the middle of the samples' extent, in world pixels at LEVEL
+        xs = trail.field(FlightTrail.X, numpy.arange(trail.first(), trail.total)) * 2**LEVEL
+        ys = trail.field(FlightTrail.Y, numpy.arange(trail.first(), trail.total)) * 2**LEVEL
+        return (xs.min() * 0.75 + xs.max() * 0.25, ys.min() * 0.75 + ys.max() * 0.25,
+                xs.min() * 0.25 + xs.max() * 0.75, ys.min() * 0.25 + ys.max() * 0.75)
+
+    def test_decimated(self):
+        trail = FlightTrail(100000)
+        fly(trail, 20000)
+        window = self.window(trail)
+        numbers = trail.decimated(LEVEL, *window)
+        self.assertEqual(list(numbers), brute_decimated(trail, LEVEL, *window))
+        self.assertTrue(0 < len(numbers) < 20000)
+
+    def test_incremental(self):
+        # the grid brought up to date in batches, merged along the way, matches one built at once
+        TrailLevel.MERGE_SIZE, merge_size = 500, TrailLevel.MERGE_SIZE
+        try:
+            trail = FlightTrail(100000)
+            random.seed(2)
+            for batch in range(20):
+                fly(trail, random.randint(1, 1000), seed=batch)
+                trail.level(LEVEL)
+            window = self.window(trail)
+            self.assertEqual(list(trail.decimated(LEVEL, *window)), brute_decimated(trail, LEVEL, *window))
+        finally:
+            TrailLevel.MERGE_SIZE = merge_size
+
+    def test_wrap_and_clear(self):
+        trail = FlightTrail(3000)
+        fly(trail, 2000)
+        trail.level(LEVEL)
+        fly(trail, 5000, seed=3)
+        self.assertEqual(trail.first(), 4000)
+        window = (0, 0, 2**(LEVEL + 8), 2**(LEVEL + 8))
+        numbers = trail.decimated(LEVEL, *window)
+        self.assertTrue(numbers.min() >= 4000)
+        self.assertEqual(list(numbers), brute_decimated(trail, LEVEL, *window))
+        self.assertEqual(trail.value_range(FlightTrail.VA), (18, 24))
+
+        clears = trail.clears
+        trail.clear()
+        self.assertEqual((trail.total, trail.clears), (0, clears + 1))
+        self.assertEqual(len(trail.decimated(LEVEL, *window)), 0)
+        trail.append(0, 40.25, -111.65, 1400, 18)
+        self.assertEqual(list(trail.decimated(LEVEL, *window)), [0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os, sys, math, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+import numpy
+from ros_groundstation.Geo import Geobase
+
+ORIGIN = (40.25, -111.65)
+R = 6371000.0
+
+def ned_points(distance):
+    # north, east at distance meters from the origin, every 15 degrees
+    return [(distance * math.cos(math.radians(azimuth)), distance * math.sin(math.radians(azimuth)))
+            for azimuth in range(0, 360, 15)]
+
+class GeoTest(unittest.TestCase):
+    def setUp(self):
+        self.ltp = Geobase(*ORIGIN)
+        self.geodesic = Geobase(*ORIGIN)
+        self.geodesic.ltp_range = 0
+
+    def test_round_trip(self):
+        for distance in (0, 1, 100, 5000, 19999, 50000):
+            for north, east in ned_points(distance):
+                lat, lon, alt = self.ltp.ned_to_gps(north, east, -12.5)
+                self.assertEqual(alt, 12.5)
+                north2, east2, down = self.ltp.gps_to_ned(lat, lon, alt)
+                self.assertTrue(math.hypot(north2 - north, east2 - east) < 1e-6)
+                self.assertEqual(down, -12.5)
+
+    def test_error_bound(self):
+        # the tangent plane puts points about d**3/(3*R**2) nearer the origin than the geodesic
+        # mode does: the geodesic distance to the point is shorter than the plane's
+        for distance in (100, 1000, 5000, 10000, 19999):
+            bound = distance**3 / (3 * R * R)
+            for north, east in ned_points(distance):
+                lat, lon, alt = self.ltp.ned_to_gps(north, east)
+                north2, east2, down = self.geodesic.gps_to_ned(lat, lon)
+                self.assertTrue(math.hypot(north2 - north, east2 - east) <= 1.01 * bound + 1e-6)
+                if distance >= 1000:
+                    self.assertTrue(math.hypot(north2, east2) < math.hypot(north, east))
+
+    def test_geodesic_beyond_range(self):
+        for north, east in ned_points(Geobase.LTP_RANGE * 1.5):
+            self.assertEqual(self.ltp.ned_to_gps(north, east), self.geodesic.ned_to_gps(north, east))
+            lat, lon, alt = self.geodesic.ned_to_gps(north, east)
+            self.assertEqual(self.ltp.gps_to_ned(lat, lon), self.geodesic.gps_to_ned(lat, lon))
+
+    def test_many(self):
+        points = ned_points(300) + ned_points(15000) + ned_points(30000)
+        norths, easts = [p[0] for p in points], [p[1] for p in points]
+        lats, lons, alts = self.ltp.ned_to_gps_many(norths, easts, -3.0)
+        for k, (north, east) in enumerate(points):
+            lat, lon, alt = self.ltp.ned_to_gps(north, east, -3.0)
+            self.assertAlmostEqual(lats[k], lat, places=10)
+            self.assertAlmostEqual(lons[k], lon, places=10)
+            self.assertEqual(alts[k], alt)
+        norths2, easts2, downs = self.ltp.gps_to_ned_many(lats, lons, alts)
+        self.assertTrue(numpy.abs(norths2 - norths).max() < 1e-6)
+        self.assertTrue(numpy.abs(easts2 - easts).max() < 1e-6)
+        self.assertTrue(numpy.all(downs == -3.0))
+
+    def test_strings(self):
+        north, east, down = self.ltp.gps_to_ned('N40-15-00.00', 'W111-39-00.00')
+        self.assertTrue(abs(north) < 1e-6 and abs(east) < 1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os, sys, time, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+from ros_groundstation.tile_downloader import TileDownloader, TileJob
+from tile_server import TileServer, JPEG
+
+class TileDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = TileServer(latency=0.02).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def jobs(self, count, path='tile'):
+        return [TileJob(n, 0, 0.0, 0.0, 19, '%s/%s/%d' % (self.server.url, path, n)) for n in range(count)]
+
+    def test_downloads_every_job(self):
+        results = {}
+        def save(job, data):
+            results[job.i] = data
+        failed = TileDownloader(None, num_workers=4).download(self.jobs(20), save)
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(results), range(20))
+        self.assertEqual(results[7], JPEG + '/tile/7')
+
+    def test_text_responses_fail(self):
+        results = []
+        failed = TileDownloader(None, num_workers=2, retries=2).download(
+            self.jobs(3, 'error'), lambda job, data: results.append(data))
+        self.assertEqual(len(failed), 3)
+        self.assertEqual(results, [None] * 3)
+        # every attempt went to the server
+        self.assertEqual(len(self.server.requests()), 6)
+
+    def test_rate_shared_by_workers(self):
+        rate = 25.0
+        TileDownloader(rate, num_workers=8).download(self.jobs(26), lambda job, data: None)
+        times = sorted(t for t, path in self.server.requests())
+        # the first request takes the bucket's one token, the rest wait 1 / rate each
+        self.assertGreaterEqual(times[-1] - times[0], 25 / rate - 0.05)
+
+    def test_workers_overlap_latency(self):
+        self.server.server.latency = 0.1
+        start = time.time()
+        TileDownloader(None, num_workers=8).download(self.jobs(16), lambda job, data: None)
+        self.assertLess(time.time() - start, 16 * 0.1 / 2)
+
+if __name__ == '__main__':
+    unittest.main()
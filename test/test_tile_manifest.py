@@ -0,0 +1,78 @@
+import os, sys, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+from ros_groundstation.tile_manifest import TileManifest, TileRecord
+from ros_groundstation.tile_store import SQLiteTileStore
+
+def tile_data(kx, ky):
+    return 'tile %d %d' % (kx, ky)
+
+class TileManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.manifest = TileManifest(self.folder)
+        self.manifest.set_anchor(19, 40.25, -111.65)
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.folder)
+
+    def add(self, store, kx, ky, i, j):
+        data = tile_data(kx, ky)
+        store.put(19, i, j, 40.0 + ky, -111.0 + kx, data)
+        self.manifest.add(TileRecord(19, kx, ky, i, j, 40.0 + ky, -111.0 + kx, len(data), TileManifest.digest(data)))
+
+    def reload(self):
+        self.manifest.close()
+        return TileManifest(self.folder)
+
+    def test_replay(self):
+        self.manifest.add(TileRecord(19, 0, 0, 0, 0, 40.25, -111.65, 10, 'a'))
+        self.manifest.add(TileRecord(19, 1, 0, 1, 0, 40.25, -111.64, 10, 'b'))
+        self.manifest.add(TileRecord(19, 1, 0, 2, 0, 40.25, -111.64, 12, 'c'))
+        self.manifest.drop(TileRecord(19, 0, 0, 0, 0, 0, 0, 0, ''))
+        self.manifest.set_anchor(20, 40.25, -111.65)
+        self.manifest.add(TileRecord(20, 0, 0, 0, 0, 40.25, -111.65, 10, 'd'))
+        self.manifest.forget(20)
+        # a line cut short by an interrupted run
+        self.manifest.write('tile 19 5 5 5')
+        manifest = self.reload()
+        self.assertEqual(manifest.anchor(19), (40.25, -111.65))
+        self.assertEqual(manifest.anchor(20), None)
+        self.assertEqual(sorted(manifest.tiles), [(19, 1, 0)])
+        self.assertEqual((manifest.get(19, 1, 0).i, manifest.get(19, 1, 0).digest), (2, 'c'))
+        manifest.compact()
+        manifest = TileManifest(self.folder)
+        self.assertEqual(sorted(manifest.tiles), [(19, 1, 0)])
+        self.assertEqual(manifest.get(19, 1, 0).line(), TileRecord(19, 1, 0, 2, 0, 40.25, -111.64, 12, 'c').line())
+
+    def test_relayout(self):
+        from ros_groundstation.FETCH_MAPS import relayout_tiles
+        store = SQLiteTileStore(os.path.join(self.folder, 'tiles.db'))
+        # a 3x3 grid around lattice 0, 0
+        for kx in range(-1, 2):
+            for ky in range(-1, 2):
+                self.add(store, kx, ky, kx + 1, ky + 1)
+        store.commit()
+        # corrupt one tile, mark another as a known error image
+        store.put(19, 1, 1, 40.0, -111.0, 'x')
+        error_digest = TileManifest.digest(tile_data(1, 1))
+        # the center moved one tile east: a 3x3 grid around lattice 1, 0
+        wanted = dict(((kx, ky), (kx, ky + 1)) for kx in range(0, 3) for ky in range(-1, 2))
+        relayout_tiles(self.manifest, store, 19, wanted, set([error_digest]))
+
+        kept = sorted((record.kx, record.ky) for record in self.manifest.records(19))
+        self.assertEqual(kept, [(0, -1), (0, 1), (1, -1), (1, 0)])
+        for kx, ky in kept:
+            i, j = wanted[(kx, ky)]
+            self.assertEqual((self.manifest.get(19, kx, ky).i, self.manifest.get(19, kx, ky).j), (i, j))
+            self.assertEqual(store.get(19, i, j), tile_data(kx, ky))
+        self.assertEqual(sorted((i, j) for i, j, lat, lon in store.read_info(19)),
+                         sorted(wanted[key] for key in kept))
+        # the manifest on disk agrees
+        manifest = self.reload()
+        self.assertEqual(sorted((key[1], key[2]) for key in manifest.tiles), kept)
+        self.assertEqual(manifest.get(19, 1, 0).i, 1)
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
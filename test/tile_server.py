@@ -0,0 +1,55 @@
+import threading, time, BaseHTTPServer, SocketServer
+
+# smallest JPEG header; the downloader never decodes what it fetches
+JPEG = '\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((time.time(), self.path))
+        time.sleep(server.latency)
+        if 'error' in self.path:
+            # what the static maps API sends for a bad key or spent quota
+            body, content_type = 'quota exceeded', 'text/html'
+        else:
+            body, content_type = JPEG + self.path, 'image/jpeg'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class TileServer():
+    """
+    Local stand-in for the static maps API: answers every path with a
+    synthetic JPEG (paths containing 'error' get a text page instead) after
+    latency seconds, and records when each request arrived.
+    """
+    def __init__(self, latency=0.0):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.latency = latency
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def requests(self):
+        # (time, path) of every request so far
+        with self.server.lock:
+            return list(self.server.requests)